@@ -1,17 +1,109 @@
 import click
-from wemoms_homework.data.make_dataset import dataset
-from wemoms_homework.features.build_features import build
-from wemoms_homework.features.merge_features import merge
-from wemoms_homework.models.train_model import train
-from wemoms_homework.models.predict_model import predict
-
-cli = click.CommandCollection(sources=[
-    dataset,
-    build,
-    merge,
-    predict,
-    train,
-])
+import importlib
+
+from wemoms_homework.instrumentation import PROFILE_ROOT
+from wemoms_homework.instrumentation import enable_profiling
+from wemoms_homework.instrumentation import instrument_command
+
+# Command -> (module defining it, short help). The module is imported only
+# when its command is invoked, so `make-dataset` or `--help` do not pay the
+# import of TensorFlow.
+COMMANDS = {
+    "generate-data": (
+        "wemoms_homework.data.generate_data",
+        "Generate a synthetic raw data file"
+    ),
+    "ingest-data": (
+        "wemoms_homework.data.ingest_data",
+        "Convert the raw data into a day partitioned parquet cache"
+    ),
+    "make-dataset": (
+        "wemoms_homework.data.make_dataset",
+        "Split the data into train, validation and test sets"
+    ),
+    "build-features": (
+        "wemoms_homework.features.build_features",
+        "Compute every group of features"
+    ),
+    "merge-features": (
+        "wemoms_homework.features.merge_features",
+        "Merge all parquet file into one big parquet file"
+    ),
+    "train-model": (
+        "wemoms_homework.models.train_model",
+        "Train the model"
+    ),
+    "sweep": (
+        "wemoms_homework.models.sweep",
+        "Train many feature sets and L2 penalties on data loaded once"
+    ),
+    "export-model": (
+        "wemoms_homework.models.linear_scorer",
+        "Export the saved Keras model to a NumPy scorer"
+    ),
+    "make-predictions": (
+        "wemoms_homework.models.predict_model",
+        "Save the predictions and print the performance"
+    ),
+    "serve-model": (
+        "wemoms_homework.models.serve_model",
+        "Serve the top 10 of yesterday's posts for a user over HTTP"
+    ),
+    "rank-users": (
+        "wemoms_homework.models.rank_users",
+        "Write the top k of yesterday's posts of every known user"
+    ),
+    "run-pipeline": (
+        "wemoms_homework.pipeline",
+        "Run the stages of the pipeline whose inputs, config or code changed"
+    ),
+    "run-daily": (
+        "wemoms_homework.daily",
+        "Ingest one day and append its features partitions"
+    ),
+    "stream-popularity": (
+        "wemoms_homework.features.popularity_counters",
+        "Update the post popularity counters with the new events of the log"
+    ),
+    "benchmark": (
+        "wemoms_homework.benchmark",
+        "Time every stage of the pipeline on synthetic data"
+    ),
+}
+
+
+class LazyGroup(click.Group):
+
+    def list_commands(self, ctx):
+        return sorted(COMMANDS)
+
+    def get_command(self, ctx, cmd_name):
+        if cmd_name not in COMMANDS:
+            return None
+        module = importlib.import_module(COMMANDS[cmd_name][0])
+        # Every command emits its time and memory (see `instrumentation`)
+        return instrument_command(cmd_name, getattr(module, cmd_name.replace("-", "_")))
+
+    def format_commands(self, ctx, formatter):
+        # Use the static help to avoid importing every command
+        rows = [(name, COMMANDS[name][1]) for name in self.list_commands(ctx)]
+        with formatter.section("Commands"):
+            formatter.write_dl(rows)
+
+
+@click.group(cls=LazyGroup)
+@click.option(
+    '--profile',
+    is_flag=True,
+    default=False,
+    help='Save a cProfile of the command in {}'.format(
+        PROFILE_ROOT
+    )
+)
+def cli(profile):
+    if profile:
+        enable_profiling()
+
 
 if __name__ == '__main__':
     cli()
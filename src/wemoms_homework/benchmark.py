@@ -0,0 +1,206 @@
+import click
+import copy
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import yaml
+
+from wemoms_homework.config import load_config
+
+CONF = load_config()
+DATA_PATH = CONF["path"]["input_data_path"]
+N_EVENTS = CONF["benchmark"]["n_events"]
+EPOCHS = CONF["benchmark"]["epochs"]
+TOLERANCE = CONF["benchmark"]["tolerance"]
+BASELINES_PATH = CONF["benchmark"]["baselines_path"]
+
+FEATURE_GROUPS = list(CONF["feature_definitions"].keys())
+
+# Metrics compared with the baselines
+METRICS = ["seconds", "peak_rss_mb"]
+
+# Directory containing the `wemoms_homework` package, so the stages run
+# even if the package is not installed
+PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def command(*args):
+    return [sys.executable, "-m", "wemoms_homework", *args]
+
+
+def stages():
+    """Name and command line of each benchmarked stage, in pipeline order.
+    Each feature group is built alone so the cost of every `Feature` class
+    is measured"""
+    return (
+        [
+            ("ingest_data", command("ingest-data", "--force")),
+            ("load_data", [
+                sys.executable, "-c",
+                "from wemoms_homework.utils import load_data; load_data()"
+            ]),
+            ("make_dataset", command("make-dataset")),
+        ]
+        + [
+            (f"build_features.{group}", command("build-features", "--jobs", "1", "--features", group))
+            for group in FEATURE_GROUPS
+        ]
+        + [
+            ("merge_features", command("merge-features")),
+            ("train_model", command("train-model")),
+            ("make_predictions", command("make-predictions")),
+        ]
+    )
+
+
+def write_config(workdir, epochs):
+    """Same configuration with relative paths inside `workdir` and a bounded
+    number of epochs"""
+    conf = copy.deepcopy(CONF)
+    conf["model"]["epoch"] = epochs
+    with open(os.path.join(workdir, "config.yml"), "w") as f:
+        yaml.safe_dump(conf, f, sort_keys=False)
+
+
+def run_stage(args, workdir, log_path):
+    """Run a stage in its own process and return its wall time, CPU time
+    and peak resident memory (from `wait4`, so the whole process is
+    measured, imports included)"""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [PACKAGE_ROOT, env.get("PYTHONPATH")]))
+
+    start = time.perf_counter()
+    with open(log_path, "w") as log:
+        process = subprocess.Popen(args, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+        _, status, usage = os.wait4(process.pid, 0)
+    seconds = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        raise click.ClickException(f"{' '.join(args)} failed, see {log_path}")
+
+    return {
+        "seconds": seconds,
+        "cpu_seconds": usage.ru_utime + usage.ru_stime,
+        # Kilobytes on Linux
+        "peak_rss_mb": usage.ru_maxrss / 1024,
+    }
+
+
+def find_regressions(results, baselines, tolerance=TOLERANCE):
+    """Stages whose time or memory exceed their baseline by more than
+    `tolerance`"""
+    regressions = []
+    for stage, result in results.items():
+        baseline = baselines.get(stage)
+        if baseline is None:
+            continue
+        for metric in METRICS:
+            if result[metric] > baseline[metric] * (1 + tolerance):
+                regressions.append((stage, metric, result[metric], baseline[metric]))
+    return regressions
+
+
+@click.group()
+def bench():
+    pass
+
+
+@bench.command()
+@click.option(
+    '--n-events',
+    type=click.IntRange(min=1),
+    default=N_EVENTS,
+    help='Number of synthetic events, default is {}'.format(
+        N_EVENTS
+    )
+)
+@click.option(
+    '--workdir',
+    type=str,
+    default=None,
+    help='Directory of the benchmark data, kept at the end. Default is a temporary directory'
+)
+@click.option(
+    '--baselines-path',
+    type=str,
+    default=BASELINES_PATH,
+    help='Path of the baselines, default is {}'.format(
+        BASELINES_PATH
+    )
+)
+@click.option(
+    '--tolerance',
+    type=float,
+    default=TOLERANCE,
+    help='Allowed relative increase over the baselines, default is {}'.format(
+        TOLERANCE
+    )
+)
+@click.option(
+    '--save-baseline',
+    is_flag=True,
+    default=False,
+    help='Save the results as the baselines of this number of events'
+)
+def benchmark(n_events, workdir, baselines_path, tolerance, save_baseline):
+    """Time every stage of the pipeline on synthetic data"""
+    keep = workdir is not None
+    workdir = os.path.abspath(workdir or tempfile.mkdtemp(prefix="wemoms_benchmark_"))
+    os.makedirs(os.path.join(workdir, "logs"), exist_ok=True)
+    write_config(workdir, EPOCHS)
+
+    try:
+        logging.info(f"Generating {n_events} events in {workdir}")
+        run_stage(
+            # The stages of the scratch directory read it as the raw data
+            command("generate-data", "--n-events", str(n_events), "--output-path", DATA_PATH, "--force"),
+            workdir,
+            os.path.join(workdir, "logs", "generate_data.log")
+        )
+
+        results = {}
+        for name, args in stages():
+            result = run_stage(args, workdir, os.path.join(workdir, "logs", f"{name}.log"))
+            result["events_per_second"] = n_events / result["seconds"]
+            results[name] = result
+            logging.info(
+                f"{name:<40} {result['seconds']:8.2f}s "
+                f"{result['events_per_second']:12.0f} events/s "
+                f"{result['peak_rss_mb']:8.0f} MB"
+            )
+    except click.ClickException:
+        # Keep the logs of the failed stage
+        keep = True
+        raise
+    finally:
+        if not keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    baselines = {}
+    if os.path.exists(baselines_path):
+        with open(baselines_path, "r") as f:
+            baselines = json.load(f)
+
+    if save_baseline:
+        baselines[str(n_events)] = results
+        os.makedirs(os.path.dirname(baselines_path) or ".", exist_ok=True)
+        with open(baselines_path, "w") as f:
+            json.dump(baselines, f, indent=2)
+        logging.info(f"Baselines of {n_events} events saved to {baselines_path}")
+        return
+
+    if str(n_events) not in baselines:
+        logging.info(f"No baselines for {n_events} events, use --save-baseline to create them")
+        return
+
+    regressions = find_regressions(results, baselines[str(n_events)], tolerance)
+    for stage, metric, value, baseline in regressions:
+        logging.warning(f"Regression in {stage}: {metric} {value:.2f} > {baseline:.2f}")
+    if regressions:
+        raise click.ClickException(f"{len(regressions)} regressions against {baselines_path}")
+    logging.info("No regression")
@@ -1,10 +1,23 @@
+import functools
 import yaml
 
 
+def window_file(feature_group, window):
+    """Name of the feature file of one window of a windowed group"""
+    return f"{feature_group}_{window}"
+
+
+@functools.lru_cache(maxsize=None)
 def load_config():
+    """Load `config.yml` once per process. The files of the windowed
+    feature groups are derived from their windows"""
     with open("config.yml", 'r') as f:
         try:
             data = yaml.safe_load(f)
         except yaml.YAMLError as exc:
             print(exc)
+    for feature_group, windows in data.get("windows", {}).items():
+        data["feature_definitions"][feature_group] = [
+            window_file(feature_group, window) for window in windows
+        ]
     return data
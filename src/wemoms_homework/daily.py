@@ -0,0 +1,169 @@
+import click
+import logging
+import os
+import pandas as pd
+
+from wemoms_homework.config import load_config
+from wemoms_homework.data.ingest_data import EVENT_ID_DAY_SHIFT
+from wemoms_homework.data.ingest_data import ingest_day
+from wemoms_homework.data.ingest_data import partition_files
+from wemoms_homework.features.build_features import FEATURE_DICT
+from wemoms_homework.features.build_features import feature_tasks
+from wemoms_homework.features.build_features import input_columns
+from wemoms_homework.features.feature_store import FeatureStore
+from wemoms_homework.features.merge_features import merge_files
+from wemoms_homework.instrumentation import measure
+from wemoms_homework.schema import partition_path
+from wemoms_homework.schema import read_parquet
+from wemoms_homework.schema import write_partition
+
+CONF = load_config()
+CACHE_ROOT = CONF["path"]["raw_cache_root"]
+FEATURE_DEFINITIONS = CONF["feature_definitions"]
+SPARSE_FEATURES = CONF["sparse_features"]
+DAILY_RAW_PATH = CONF["daily"]["raw_path"]
+DAILY_CACHE_ROOT = CONF["daily"]["cache_root"]
+DAILY_INTERIM_ROOT = CONF["daily"]["interim_root"]
+DAILY_FEATURES_ROOT = CONF["daily"]["features_root"]
+
+
+def history_files(start_date, end_date, cache_root=DAILY_CACHE_ROOT):
+    """Event partitions from `start_date` to `end_date`: the daily ones, or
+    else the ones of the full ingestion. The daily days have their own
+    root, a full ingestion rebuilds its cache without deleting them"""
+    files = {}
+    for root in [CACHE_ROOT, cache_root]:
+        if os.path.isdir(root):
+            for path in partition_files(root, start_date=start_date, end_date=end_date):
+                files[os.path.basename(os.path.dirname(path))] = path
+    return [files[day] for day in sorted(files)]
+
+
+def lookback(kwargs):
+    """History needed before the first event of a day: the longest window
+    of the task, nothing for the features of the event alone"""
+    windows = kwargs.get("windows") or []
+    return max([pd.Timedelta(w) for w in windows], default=pd.Timedelta(0))
+
+
+def daily_tasks():
+    """Feature tasks with the name of the file each one writes. With one
+    task per window, only the 28d windows read 28 days of history"""
+    tasks = []
+    for feature_group, features in FEATURE_DEFINITIONS.items():
+        group_tasks = feature_tasks([feature_group])
+        if len(group_tasks) != len(features):
+            raise ValueError(
+                f"feature_definitions of {feature_group} must list one file "
+                f"per window, not {features}"
+            )
+        tasks += [
+            (feature_group, kwargs, feature)
+            for (_, kwargs), feature in zip(group_tasks, features)
+        ]
+    return tasks
+
+
+def build_day_features(day, cache_root=DAILY_CACHE_ROOT, interim_root=DAILY_INTERIM_ROOT):
+    """Compute the features of the events of `day` from the partitions of
+    `day` and of its lookback, and write one partition per feature file"""
+    tasks = daily_tasks()
+    day_start = pd.Timestamp(day, tz="UTC")
+    start = day_start - max(lookback(kwargs) for _, kwargs, _ in tasks)
+
+    paths = history_files(start.date(), day, cache_root)
+    expected = pd.date_range(start.normalize(), day_start, freq="D")
+    if len(paths) < len(expected):
+        logging.warning(
+            f"Only {len(paths)} of the {len(expected)} days from {start.date()} "
+            f"to {day} are in {cache_root} or {CACHE_ROOT}, the windows miss the other days"
+        )
+
+    df = read_parquet(paths, columns=input_columns(list(FEATURE_DEFINITIONS)))
+    day_number = (day_start.tz_localize(None) - pd.Timestamp("1970-01-01")).days
+
+    for feature_group, kwargs, feature in tasks:
+        history = df[df["tracker_created_at"] >= day_start - lookback(kwargs)]
+        res = FEATURE_DICT[feature_group].extract_feature(history, save=False, **kwargs)
+        # Only the events of the day, the history is in the previous partitions
+        res = res[(res["event_id"].to_numpy() >> EVENT_ID_DAY_SHIFT) == day_number]
+        if feature_group in SPARSE_FEATURES:
+            values = res.drop(columns="event_id")
+            res = res[(values != 0).any(axis=1).to_numpy()]
+        write_partition(res.reset_index(drop=True), os.path.join(interim_root, feature), day)
+
+
+def merge_day_features(day, interim_root=DAILY_INTERIM_ROOT, features_root=DAILY_FEATURES_ROOT):
+    """Merge the feature partitions of `day` into the partition of the
+    merged features"""
+    table = merge_files({
+        feature_group: {
+            feature: partition_path(os.path.join(interim_root, feature), day)
+            for feature in features
+        }
+        for feature_group, features in FEATURE_DEFINITIONS.items()
+    })
+    write_partition(table, features_root, day)
+    return table
+
+
+@click.group()
+def daily():
+    pass
+
+
+@daily.command()
+@click.option(
+    '--date',
+    type=click.DateTime(formats=["%Y-%m-%d"]),
+    required=True,
+    help='Day to process'
+)
+@click.option(
+    '--data-path',
+    type=str,
+    default=None,
+    help='Raw events of the day, default is {}'.format(
+        DAILY_RAW_PATH
+    )
+)
+@click.option(
+    '--cache-root',
+    type=str,
+    default=DAILY_CACHE_ROOT,
+    help='Path of the parquet cache of the daily events, default is {}'.format(
+        DAILY_CACHE_ROOT
+    )
+)
+def run_daily(date, data_path, cache_root):
+    """Ingest one day, append its features partitions and update the
+    feature store"""
+    day = date.strftime("%Y-%m-%d")
+    data_path = data_path or DAILY_RAW_PATH.format(date=day)
+
+    if os.path.exists(data_path):
+        logging.info(f"Ingesting {day} from {data_path}")
+        with measure("run_daily.ingest", day=day) as current:
+            current.rows_out = ingest_day(data_path, day, cache_root)
+    elif history_files(day, day, cache_root):
+        logging.info(f"No raw file {data_path}, using the partition of {day} already ingested")
+    else:
+        raise click.ClickException(
+            f"No raw file {data_path} nor partition of {day} in {cache_root} or {CACHE_ROOT}"
+        )
+
+    logging.info(f"Computing the features of {day}")
+    with measure("run_daily.build_features", day=day):
+        build_day_features(day, cache_root)
+
+    logging.info(f"Merging the features of {day}")
+    with measure("run_daily.merge_features", day=day) as current:
+        table = merge_day_features(day)
+        current.rows_out = table.num_rows
+    logging.info(f"Features of {day} saved to {partition_path(DAILY_FEATURES_ROOT, day)}")
+
+    # The predictions and the serving read the day from the feature store,
+    # only its partitions are written
+    logging.info(f"Adding the features of {day} to the feature store")
+    with measure("run_daily.feature_store", day=day, rows_in=table.num_rows):
+        FeatureStore.replace_day(table.to_pandas(), day)
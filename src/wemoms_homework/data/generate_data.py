@@ -0,0 +1,294 @@
+import click
+import gzip
+import logging
+import os
+import numpy as np
+import pandas as pd
+
+from wemoms_homework.config import load_config
+
+CONF = load_config()
+SYNTHETIC_DATA_PATH = CONF["path"]["synthetic_data_path"]
+SEED = CONF["dataset"]["seed"]
+
+START_DATE = "2023-01-01"
+DAYS = 32
+
+# Events generated and written at once
+CHUNKSIZE = 200000
+
+# Posts are created from a few days before the first event
+POSTS_BEFORE_DAYS = 3
+
+STAGES = np.array(["Mom", "Pregnant", "TTC"])
+DEPARTMENTS = np.array([f"{i:02d}" for i in range(1, 96)], dtype=object)
+COUNTRIES = np.array(["FR", "BE", "CH", "CA", "LU"])
+
+
+def age_lists(rng, counts, low, high):
+    """One list of random ages (in months) per count"""
+    ages = rng.integers(low, high, size=counts.sum())
+    res = np.empty(len(counts), dtype=object)
+    res[:] = [a.tolist() for a in np.split(ages, np.cumsum(counts)[:-1])]
+    return res
+
+
+def iso_format(times, unit):
+    """ISO 8601 UTC strings of naive UTC datetime64 values"""
+    return np.char.add(
+        np.datetime_as_string(times.astype(f"datetime64[{unit}]"), unit=unit),
+        "Z"
+    ).astype(object)
+
+
+def nullable(values, mask):
+    """Object array of `values` with None where `mask` is False"""
+    res = np.asarray(values).astype(object)
+    res[~mask] = None
+    return res
+
+
+def make_users(rng, n_users, start):
+    """Users with a maternity stage, children, activity and click propensity"""
+    stage = rng.choice(3, size=n_users, p=[0.6, 0.25, 0.15])
+    is_mom = (stage == 0) | (rng.random(n_users) < 0.1)
+    is_pregnant = stage == 1
+    n_children = np.where(is_mom, rng.poisson(0.6, n_users) + 1, 0)
+    pregnancy_day = rng.integers(1, 281, size=n_users)
+    created_at = start - pd.to_timedelta(rng.exponential(400, n_users), unit="D")
+
+    children_age_month = age_lists(rng, n_children, 0, 144)
+    children_age_year = np.empty(n_users, dtype=object)
+    children_age_year[:] = [[m // 12 for m in ages] for ages in children_age_month]
+
+    return {
+        "id": np.array([f"u{i}" for i in range(n_users)], dtype=object),
+        "stage": stage,
+        "is_mom": is_mom,
+        "is_pregnant": is_pregnant,
+        "is_trying": stage == 2,
+        "country": rng.choice(COUNTRIES, size=n_users, p=[0.85, 0.06, 0.04, 0.04, 0.01]),
+        "department": nullable(rng.choice(DEPARTMENTS, size=n_users), rng.random(n_users) < 0.8),
+        "age": np.clip(rng.normal(31, 5, n_users), 18, 50).round(),
+        "trying_since": nullable(rng.exponential(200, n_users).astype(int), stage == 2),
+        "pregnancy_day": nullable(pregnancy_day, is_pregnant),
+        "pregnancy_week": nullable(pregnancy_day // 7, is_pregnant),
+        "pregnancy_month": nullable(pregnancy_day // 30 + 1, is_pregnant),
+        "pregnancy_trimester": nullable(pregnancy_day // 94 + 1, is_pregnant),
+        "amenorrhea_week": nullable(pregnancy_day // 7 + 2, is_pregnant),
+        "n_children": n_children,
+        "children_age_month": children_age_month,
+        "children_age_year": children_age_year,
+        "created_at": created_at,
+        "created_at_iso": iso_format(created_at.values, "s"),
+        "followings": rng.geometric(0.05, n_users),
+        "posts": rng.geometric(0.1, n_users) - 1,
+        "received_comments": rng.geometric(0.02, n_users) - 1,
+        "pictures": rng.geometric(0.2, n_users) - 1,
+        "likes": rng.geometric(0.01, n_users) - 1,
+        "platform": rng.choice(np.array(["ios", "android"]), size=n_users, p=[0.55, 0.45]),
+        # Heavy tailed activity, most events come from a few users
+        "activity": rng.lognormal(0, 1.5, n_users),
+        "propensity": rng.beta(2, 8, n_users),
+    }
+
+
+def make_posts(rng, n_posts, n_users, start, days):
+    """Posts with an author, a creation time and a popularity. Some posts
+    are created in the days before `start` so the first events have posts"""
+    created_at = start + pd.to_timedelta(
+        np.sort(rng.random(n_posts)) * (days + POSTS_BEFORE_DAYS) - POSTS_BEFORE_DAYS,
+        unit="D"
+    )
+    return {
+        "id": np.array([f"p{i}" for i in range(n_posts)], dtype=object),
+        "author": rng.integers(0, n_users, size=n_posts),
+        "created_at": created_at.values.astype("datetime64[ns]").view("int64"),
+        "has_picture": rng.random(n_posts) < 0.4,
+        "has_text": rng.random(n_posts) < 0.95,
+        "has_video": rng.random(n_posts) < 0.05,
+        "is_survey": rng.random(n_posts) < 0.1,
+        "popularity": rng.beta(0.7, 3, n_posts),
+        "comment_rate": rng.exponential(0.5, n_posts),
+        "like_rate": rng.exponential(1.5, n_posts),
+    }
+
+
+def sample_posts(rng, posts, times):
+    """For each event time, a post created shortly before it. The age of the
+    post is exponential and popular posts are accepted more often"""
+    n = len(times)
+    chosen = np.empty(n, dtype="int64")
+    todo = np.arange(n)
+    max_popularity = posts["popularity"].max()
+    while len(todo):
+        age = rng.exponential(8 * 3600e9, len(todo)).astype("int64")
+        candidate = np.searchsorted(posts["created_at"], times[todo] - age, side="right") - 1
+        candidate = np.maximum(candidate - (rng.geometric(0.3, len(todo)) - 1), 0)
+        accepted = rng.random(len(todo)) * max_popularity < posts["popularity"][candidate]
+        chosen[todo[accepted]] = candidate[accepted]
+        todo = todo[~accepted]
+    return chosen
+
+
+def make_events(rng, users, posts, n_events, start_ns, end_ns, user_weights):
+    times = np.sort(rng.integers(start_ns, end_ns, size=n_events))
+    post = sample_posts(rng, posts, times)
+    user = rng.choice(len(user_weights), size=n_events, p=user_weights)
+    author = posts["author"][post]
+
+    age_minutes = (times - posts["created_at"][post]) // 60_000_000_000
+    age_hours = age_minutes / 60
+    survey = posts["is_survey"][post]
+
+    # Clicks depend on the user, the post and decrease with the age of the post
+    click_probability = np.clip(
+        users["propensity"][user]
+        * (0.5 + posts["popularity"][post])
+        * np.exp(-age_hours / 48)
+        * np.where(users["stage"][user] == users["stage"][author], 1.5, 1.0),
+        0, 1
+    )
+
+    tracker_created_at = pd.to_datetime(times, utc=True)
+
+    return pd.DataFrame({
+        "trackable_id": posts["id"][post],
+        "user_id": users["id"][user],
+        "tracker_created_at": iso_format(times.view("datetime64[ns]"), "us"),
+        "user_is_mom": users["is_mom"][user],
+        "user_is_pregnant": users["is_pregnant"][user],
+        "user_is_trying": users["is_trying"][user],
+        "user_country_code": users["country"][user],
+        "days_since_user_account_creation": (
+            (tracker_created_at - users["created_at"][user]).days
+        ),
+        "user_pregnancy_current_day": users["pregnancy_day"][user],
+        "user_pregnancy_current_week": users["pregnancy_week"][user],
+        "user_pregnancy_current_month": users["pregnancy_month"][user],
+        "user_pregnancy_current_trimester": users["pregnancy_trimester"][user],
+        "user_age": users["age"][user],
+        "user_is_trying_since_days": users["trying_since"][user],
+        "user_department": users["department"][user],
+        "user_followings_count": users["followings"][user],
+        "user_posts_count": users["posts"][user],
+        "user_received_comments_count": users["received_comments"][user],
+        "user_pictures_count": users["pictures"][user],
+        "user_likes_count": users["likes"][user],
+        "user_children_count": users["n_children"][user],
+        "user_children_age_month": users["children_age_month"][user],
+        "user_created_at": users["created_at_iso"][user],
+        "post_age_in_minutes": age_minutes,
+        "author_children_count": users["n_children"][author],
+        "author_maternity_stage": STAGES[users["stage"][author]],
+        "author_amenorrhea_week": users["amenorrhea_week"][author],
+        "post_comments_count": rng.poisson(posts["comment_rate"][post] * age_hours),
+        "post_likes_count": rng.poisson(posts["like_rate"][post] * age_hours),
+        "survey_answers_count": np.where(survey, rng.poisson(2 * age_hours), 0),
+        "has_picture": posts["has_picture"][post],
+        "has_text": posts["has_text"][post],
+        "has_video": posts["has_video"][post],
+        "direct_reports_count": rng.poisson(0.01, n_events),
+        "author_children_age_month": users["children_age_month"][author],
+        "author_children_age_year": users["children_age_year"][author],
+        "author_department": users["department"][author],
+        "author_age": users["age"][author],
+        "first_comment_at": None,
+        "platform": users["platform"][user],
+        "has_been_opened": rng.random(n_events) < click_probability,
+    })
+
+
+def generate(output_path, n_events, start_date=START_DATE, days=DAYS,
+             duplicate_rate=0.01, seed=SEED, chunksize=CHUNKSIZE):
+    """Write `n_events` synthetic events (plus duplicates) as gzip JSON lines
+    with the schema of the raw data, in time order"""
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp(start_date, tz="UTC")
+    n_users = max(100, n_events // 50)
+    n_posts = max(50, n_events // 30)
+
+    users = make_users(rng, n_users, start)
+    posts = make_posts(rng, n_posts, n_users, start, days)
+    user_weights = users["activity"] / users["activity"].sum()
+
+    start_ns = start.value
+    end_ns = (start + pd.Timedelta(days=days)).value
+    n_chunks = max(1, -(-n_events // chunksize))
+    bounds = np.linspace(start_ns, end_ns, n_chunks + 1).astype("int64")
+
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    n_lines = 0
+    # Fast compression, the file is read much more often than written
+    with gzip.open(output_path, "wt", compresslevel=1) as f:
+        for i in range(n_chunks):
+            size = min(chunksize, n_events - i * chunksize)
+            events = make_events(rng, users, posts, size, bounds[i], bounds[i + 1], user_weights)
+            # The raw data has a few exact duplicates
+            duplicates = events[rng.random(len(events)) < duplicate_rate]
+            events = pd.concat([events, duplicates]).sort_index(kind="stable")
+            text = events.to_json(orient="records", lines=True)
+            f.write(text if text.endswith("\n") else text + "\n")
+            n_lines += len(events)
+            logging.info(f"\tChunk {i} ({n_lines} lines)")
+
+    return n_lines
+
+
+@click.group()
+def generation():
+    pass
+
+
+@generation.command()
+@click.option(
+    '--output-path',
+    type=str,
+    default=SYNTHETIC_DATA_PATH,
+    help='Path of the generated raw data, default is {}'.format(
+        SYNTHETIC_DATA_PATH
+    )
+)
+@click.option(
+    '--n-events',
+    type=click.IntRange(min=1),
+    default=100000,
+    help='Number of events, default is 100000'
+)
+@click.option(
+    '--start-date',
+    type=str,
+    default=START_DATE,
+    help='First day of the events, default is {}'.format(
+        START_DATE
+    )
+)
+@click.option(
+    '--days',
+    type=click.IntRange(min=1),
+    default=DAYS,
+    help='Number of days of events, default is {}'.format(
+        DAYS
+    )
+)
+@click.option(
+    '--seed',
+    type=int,
+    default=SEED,
+    help='Random seed, default is {}'.format(
+        SEED
+    )
+)
+@click.option(
+    '--force',
+    is_flag=True,
+    default=False,
+    help='Overwrite the output file if it exists'
+)
+def generate_data(output_path, n_events, start_date, days, seed, force):
+    """Generate a synthetic raw data file"""
+    if os.path.exists(output_path) and not force:
+        raise click.ClickException(f"{output_path} already exists, use --force to overwrite it")
+    logging.info(f"Generating {n_events} events in {output_path}")
+    n_lines = generate(output_path, n_events, start_date=start_date, days=days, seed=seed)
+    logging.info(f"Generated {n_lines} lines")
@@ -0,0 +1,329 @@
+import click
+import glob
+import json
+import logging
+import os
+import shutil
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from concurrent.futures import ProcessPoolExecutor
+
+from wemoms_homework.config import load_config
+from wemoms_homework.features.age_bitmask import add_age_bitmasks
+from wemoms_homework.instrumentation import measure
+from wemoms_homework.schema import BOOL_COLUMNS
+from wemoms_homework.schema import CATEGORY_COLUMNS
+from wemoms_homework.schema import DATE_COLUMNS
+from wemoms_homework.schema import FLOAT_COLUMNS
+from wemoms_homework.schema import INT_COLUMNS
+from wemoms_homework.schema import LIST_COLUMNS
+from wemoms_homework.schema import dtype_of
+from wemoms_homework.schema import read_parquet
+from wemoms_homework.schema import to_table
+from wemoms_homework.schema import write_parquet
+
+CONF = load_config()
+DATA_PATH = CONF["path"]["input_data_path"]
+CACHE_ROOT = CONF["path"]["raw_cache_root"]
+CHUNKSIZE = CONF["ingest"]["chunksize"]
+JOBS = CONF["ingest"]["jobs"]
+
+# Event ids are `day number << EVENT_ID_DAY_SHIFT | position in the day`, so
+# they are stable when a new day is ingested and sorted by time
+EVENT_ID_DAY_SHIFT = 32
+
+# Bump it each time the layout or the dtypes of the cache change
+CACHE_VERSION = 6
+MANIFEST = "_manifest.json"
+
+KEYS = [
+    "trackable_id",
+    "user_id",
+    "tracker_created_at"
+]
+
+def fill_missing(column, value):
+    """Missing values of a column without nulls in the schema, counted in
+    the logs"""
+    n_missing = column.isna().sum()
+    if n_missing:
+        logging.warning(f"{n_missing} missing values of {column.name} read as {value}")
+    return column.fillna(value)
+
+
+def fix_dtypes(df):
+    """Cast a raw chunk to the dtypes of the schema, whatever the chunk
+    contains. The missing booleans and integers are read as False and 0
+    (see `schema.py`)"""
+    for col in DATE_COLUMNS:
+        if col in df:
+            df[col] = pd.to_datetime(df[col], utc=True)
+    for col in BOOL_COLUMNS:
+        if col in df:
+            df[col] = fill_missing(df[col], False).astype(bool).astype(dtype_of(col))
+    for col in INT_COLUMNS:
+        if col in df:
+            df[col] = fill_missing(df[col], 0).astype(dtype_of(col))
+    for col in FLOAT_COLUMNS:
+        if col in df:
+            df[col] = df[col].astype(dtype_of(col))
+    for col in CATEGORY_COLUMNS:
+        if col in df:
+            df[col] = df[col].where(df[col].isna(), df[col].astype(str)).astype("category")
+    for col in LIST_COLUMNS:
+        if col in df:
+            df[col] = df[col].apply(lambda x: x if isinstance(x, list) else [])
+    return df
+
+
+def add_event_id(df, day):
+    """Sort the events of one day and give them an integer id"""
+    df = df.sort_values("tracker_created_at", kind="stable", ignore_index=True)
+    day_number = (pd.Timestamp(day) - pd.Timestamp("1970-01-01")).days
+    event_id = (day_number << EVENT_ID_DAY_SHIFT) + np.arange(len(df), dtype="int64")
+    df.insert(0, "event_id", event_id)
+    return df
+
+
+def fingerprints(df):
+    """64-bit hash of the keys of each row, the same for a key whatever
+    the chunk or the categories it comes from"""
+    return pd.util.hash_pandas_object(df[KEYS], index=False).to_numpy()
+
+
+def deduplicate(df):
+    """Keep the first row of each key. The keys are compared by their
+    fingerprints, 8 bytes per row instead of three object columns: two
+    different keys among n rows collide with a probability of n^2 / 2^65"""
+    _, first = np.unique(fingerprints(df), return_index=True)
+    return df.take(np.sort(first))
+
+
+def expand_paths(data_paths):
+    """Raw files of `data_paths`, with the glob patterns expanded. Sorted,
+    so the event ids do not depend on the order of the arguments"""
+    if isinstance(data_paths, str):
+        data_paths = [data_paths]
+    return sorted({
+        path
+        for pattern in data_paths
+        for path in (glob.glob(pattern) or [pattern])
+    })
+
+
+def source_signature(data_paths):
+    sources = []
+    for path in expand_paths(data_paths):
+        stat = os.stat(path)
+        sources.append({
+            "source": os.path.abspath(path),
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns
+        })
+    return {"version": CACHE_VERSION, "sources": sources}
+
+
+def cache_is_fresh(data_paths=DATA_PATH, cache_root=CACHE_ROOT):
+    """The cache is valid as long as the raw files did not change"""
+    manifest_path = os.path.join(cache_root, MANIFEST)
+    if not os.path.exists(manifest_path):
+        return False
+    if not any(os.path.exists(path) for path in expand_paths(data_paths)):
+        # No raw file to compare with: trust the cache we have
+        return True
+    with open(manifest_path, "r") as f:
+        manifest = json.load(f)
+    return manifest.get("signature") == source_signature(data_paths)
+
+
+def partition_files(cache_root=CACHE_ROOT, start_date=None, end_date=None):
+    """List the day partitions of the cache, optionally within a date range"""
+    days = sorted(
+        d for d in os.listdir(cache_root)
+        if d.startswith("day=")
+    )
+    files = []
+    for day in days:
+        date = day[len("day="):]
+        if start_date is not None and date < str(start_date)[:10]:
+            continue
+        if end_date is not None and date > str(end_date)[:10]:
+            continue
+        files.append(os.path.join(cache_root, day, "data.parquet"))
+    return files
+
+
+def spill_file(index, data_path, tmp_root, chunksize=CHUNKSIZE):
+    """First pass over one raw file: parse it by chunks and spill each
+    chunk per day. The parts are named after the file, the days of
+    several files are spilled at the same time"""
+    n_rows = 0
+    with measure("ingest.parse", file=os.path.basename(data_path)) as current:
+        with pd.read_json(
+                path_or_buf=data_path,
+                lines=True,
+                compression="gzip",
+                chunksize=chunksize,
+                dtype=False,
+                convert_dates=False) as reader:
+            for i, chunk in enumerate(reader):
+                logging.info(f"\t{os.path.basename(data_path)}: chunk {i} ({len(chunk)} lines)")
+                n_rows += len(chunk)
+                chunk = add_age_bitmasks(fix_dtypes(chunk))
+                days = chunk["tracker_created_at"].dt.strftime("%Y-%m-%d")
+                for day, part in chunk.groupby(days, sort=False):
+                    day_root = os.path.join(tmp_root, f"day={day}")
+                    os.makedirs(day_root, exist_ok=True)
+                    write_parquet(part, os.path.join(day_root, f"part-{index:05d}-{i:05d}.parquet"))
+        current.rows_out = n_rows
+    return n_rows
+
+
+def merge_day(day_root):
+    """Second pass over one day: deduplicate the parts of every file and
+    write the partition. The keys contain `tracker_created_at`, so the
+    duplicates are always in the same day and the fingerprints of one day
+    only are in memory"""
+    parts = sorted(p for p in os.listdir(day_root) if p.startswith("part-"))
+    with measure("ingest.deduplicate", day=os.path.basename(day_root)) as current:
+        df = read_parquet([os.path.join(day_root, p) for p in parts])
+        current.rows_in = len(df)
+        df = add_event_id(deduplicate(df), os.path.basename(day_root)[len("day="):])
+        write_parquet(df, os.path.join(day_root, "data.parquet"))
+        current.rows_out = len(df)
+    for p in parts:
+        os.remove(os.path.join(day_root, p))
+    return len(df)
+
+
+def run_all(function, tasks, jobs=JOBS):
+    """Results of `function` on each tuple of arguments of `tasks`, in a
+    process pool if `jobs` > 1"""
+    if jobs == 1 or len(tasks) <= 1:
+        return [function(*task) for task in tasks]
+    with ProcessPoolExecutor(max_workers=min(jobs, len(tasks))) as executor:
+        return list(executor.map(function, *zip(*tasks)))
+
+
+def ingest(data_paths=DATA_PATH, cache_root=CACHE_ROOT, chunksize=CHUNKSIZE, jobs=JOBS):
+    """Convert raw gzip JSON lines files into a Parquet dataset partitioned
+    by day (`day=YYYY-MM-DD/data.parquet`). The files are parsed, then the
+    days deduplicated, by `jobs` processes. The events repeated within or
+    across files are kept once"""
+    paths = expand_paths(data_paths)
+    tmp_root = cache_root.rstrip("/") + ".tmp"
+    shutil.rmtree(tmp_root, ignore_errors=True)
+    os.makedirs(tmp_root)
+
+    logging.info(f"Parsing {len(paths)} files with {min(jobs, len(paths))} processes")
+    n_rows = sum(run_all(
+        spill_file,
+        [(i, path, tmp_root, chunksize) for i, path in enumerate(paths)],
+        jobs
+    ))
+
+    days = sorted(d for d in os.listdir(tmp_root) if d.startswith("day="))
+    logging.info(f"Deduplicating {len(days)} days")
+    n_kept = sum(run_all(merge_day, [(os.path.join(tmp_root, day),) for day in days], jobs))
+
+    duplicate_rate = (n_rows - n_kept) / max(n_rows, 1)
+    with open(os.path.join(tmp_root, MANIFEST), "w") as f:
+        json.dump({
+            "signature": source_signature(paths),
+            "rows": n_rows,
+            "rows_deduplicated": n_kept,
+            "duplicate_rate": duplicate_rate
+        }, f, indent=2)
+
+    shutil.rmtree(cache_root, ignore_errors=True)
+    os.rename(tmp_root, cache_root)
+    logging.info(
+        f"Ingested {n_kept} lines of {len(paths)} files "
+        f"({n_rows - n_kept} duplicates removed, {duplicate_rate:.2%})"
+    )
+
+
+def ingest_day(data_path, day, cache_root=CACHE_ROOT, chunksize=CHUNKSIZE):
+    """Ingest the events of one day of a raw file into the partition
+    `day=<day>` of the cache, the other partitions are not read nor
+    rewritten. Events of other days in the file are ignored"""
+    parts = []
+    n_rows = 0
+    with pd.read_json(
+            path_or_buf=data_path,
+            lines=True,
+            compression="gzip",
+            chunksize=chunksize,
+            dtype=False,
+            convert_dates=False) as reader:
+        for chunk in reader:
+            n_rows += len(chunk)
+            chunk = fix_dtypes(chunk)
+            chunk = chunk[chunk["tracker_created_at"].dt.strftime("%Y-%m-%d") == day]
+            if len(chunk):
+                parts.append(to_table(add_age_bitmasks(chunk)))
+
+    if not parts:
+        raise ValueError(f"{data_path} has no event on {day}")
+    df = add_event_id(deduplicate(pa.concat_tables(parts).to_pandas()), day)
+
+    day_root = os.path.join(cache_root, f"day={day}")
+    os.makedirs(day_root, exist_ok=True)
+    # Replaced at once, the readers never see a partial partition
+    tmp_path = os.path.join(day_root, "data.parquet.tmp")
+    write_parquet(df, tmp_path)
+    os.replace(tmp_path, os.path.join(day_root, "data.parquet"))
+    logging.info(
+        f"Ingested {len(df)} lines of {day} "
+        f"({n_rows - len(df)} duplicates or lines of other days)"
+    )
+    return len(df)
+
+
+@click.group()
+def ingestion():
+    pass
+
+
+@ingestion.command()
+@click.option(
+    '--data-path',
+    'data_paths',
+    type=str,
+    multiple=True,
+    default=[DATA_PATH],
+    help='Raw gzip files or glob patterns, can be repeated, default is {}'.format(
+        DATA_PATH
+    )
+)
+@click.option(
+    '--cache-root',
+    type=str,
+    default=CACHE_ROOT,
+    help='Path of the parquet cache, default is {}'.format(
+        CACHE_ROOT
+    )
+)
+@click.option(
+    '--force',
+    is_flag=True,
+    default=False,
+    help='Rebuild the cache even if it is up to date'
+)
+@click.option(
+    '--jobs',
+    type=click.IntRange(min=1),
+    default=JOBS,
+    help='Number of processes parsing the files and deduplicating the days, default is {}'.format(
+        JOBS
+    )
+)
+def ingest_data(data_paths, cache_root, force, jobs):
+    """Convert the raw data into a day partitioned parquet cache"""
+    if not force and cache_is_fresh(data_paths, cache_root):
+        logging.info(f"Cache {cache_root} is up to date")
+        return
+    logging.info(f"Ingesting {', '.join(data_paths)}")
+    ingest(data_paths, cache_root, jobs=jobs)
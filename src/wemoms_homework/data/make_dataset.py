@@ -5,6 +5,8 @@ import os
 import pandas as pd
 
 from wemoms_homework.config import load_config
+from wemoms_homework.schema import apply_schema
+from wemoms_homework.schema import write_parquet
 from wemoms_homework.utils import load_data
 
 CONF = load_config()
@@ -20,6 +22,67 @@ EVAL_END_DATE = CONF["dataset"]["eval_end_date"]
 TEST_START_DATE = CONF["dataset"]["test_start_date"]
 TEST_END_DATE = CONF["dataset"]["test_end_date"]
 
+TEST_MAX_NEGATIVES = CONF["dataset"]["test_max_negatives"]
+TEST_NEGATIVE_RATIO = CONF["dataset"]["test_negative_ratio"]
+SEED = CONF["dataset"]["seed"]
+
+
+def generate_candidates(testset, max_negatives=None, negative_ratio=None, seed=SEED):
+    """Expand each positive of the testset with the posts published the day
+    before it as synthetic negatives.
+
+    The list of yesterday's posts is built once per day and joined to the
+    positives on the day, instead of being filtered again for every positive.
+    `negative_ratio` keeps a random fraction of the negatives and
+    `max_negatives` caps the number of negatives per positive.
+
+    The synthetic negatives are not real events, their `event_id` is -1.
+    Every post of the day before is a negative, the opened one included.
+    """
+    event_day = testset.tracker_created_at.dt.normalize()
+    post_creation_day = (
+        testset.tracker_created_at
+        - pd.to_timedelta(testset.post_age_in_minutes, unit="m")
+    ).dt.normalize()
+    candidate_day = post_creation_day + pd.Timedelta(days=1)
+
+    # Keep only line with has_been_opened == 1 and post is from last day
+    positives = testset[
+        testset.has_been_opened.astype(bool) &
+        (event_day == candidate_day)
+    ][["event_id", "trackable_id", "user_id", "tracker_created_at"]]
+    positives = positives.assign(
+        positive_id=range(len(positives)),
+        candidate_day=event_day[positives.index]
+    )
+
+    # All the posts seen in the testset, by day of candidacy
+    candidates = pd.DataFrame({
+        "candidate_day": candidate_day,
+        "candidate_id": testset.trackable_id
+    }).drop_duplicates()
+
+    # As in the original loop, the opened post is also one of the negatives
+    negatives = positives.merge(candidates, on="candidate_day", how="inner")
+
+    if negative_ratio is not None:
+        negatives = negatives.sample(frac=negative_ratio, random_state=seed)
+    if max_negatives is not None:
+        negatives = negatives.sample(frac=1, random_state=seed)
+        negatives = negatives[
+            negatives.groupby("positive_id").cumcount() < max_negatives
+        ]
+
+    negatives = (negatives[["candidate_id", "user_id", "tracker_created_at"]]
+        .rename(columns={"candidate_id": "trackable_id"})
+        .assign(event_id=-1, has_been_opened=0))
+    positives = positives[["event_id", "trackable_id", "user_id", "tracker_created_at"]].assign(
+        has_been_opened=1
+    )
+
+    return apply_schema(pd.concat([positives, negatives], axis=0, ignore_index=True))
+
+
 @click.group()
 def dataset():
     pass
@@ -90,6 +153,22 @@ def dataset():
         TEST_END_DATE
     )
 )
+@click.option(
+    '--max-negatives',
+    type=int,
+    default=TEST_MAX_NEGATIVES,
+    help='Maximum number of negatives per positive in the testset, default is {}'.format(
+        TEST_MAX_NEGATIVES
+    )
+)
+@click.option(
+    '--negative-ratio',
+    type=click.FloatRange(0, 1),
+    default=TEST_NEGATIVE_RATIO,
+    help='Fraction of the negatives kept in the testset, default is {}'.format(
+        TEST_NEGATIVE_RATIO
+    )
+)
 def make_dataset(
         data_path,
         output_root,
@@ -98,17 +177,26 @@ def make_dataset(
         eval_start_date,
         eval_end_date,
         test_start_date,
-        test_end_date):
+        test_end_date,
+        max_negatives,
+        negative_ratio):
     logging.info("Making Dataset")
     logging.info(data_path)
     logging.info(output_root)
 
     logging.info("Loading raw data")
-    df = load_data()
+    df = load_data(columns=[
+        "event_id",
+        "trackable_id",
+        "user_id",
+        "tracker_created_at",
+        "has_been_opened",
+        "post_age_in_minutes"
+    ])
 
     logging.info("Saving Files")
 
-    col_to_keep = ["trackable_id", "user_id", "tracker_created_at", "has_been_opened"]
+    col_to_keep = ["event_id", "trackable_id", "user_id", "tracker_created_at", "has_been_opened"]
 
     # TRAINSET
     logging.info("\tTrainset")
@@ -133,17 +221,17 @@ def make_dataset(
     trainset = trainset[~trainset.user_id.isin(few_signal_users_negative)]
 
     # Saving the data to parquet
-    trainset.to_parquet(train_path, index=False)
+    write_parquet(trainset, train_path)
 
     # VALIDATION SET
     logging.info("\tValidation set")
     eval_path = os.path.join(output_root, "eval.parquet")
     
     # Saving the data to parquet
-    df[(
+    write_parquet(df[(
         (df["tracker_created_at"] >= EVAL_START_DATE) &
         (df["tracker_created_at"] <= EVAL_END_DATE)
-    )][col_to_keep].to_parquet(eval_path, index=False)
+    )][col_to_keep], eval_path)
 
     # TESTSET
     logging.info("\tTestset")
@@ -155,43 +243,18 @@ def make_dataset(
         (df["tracker_created_at"] <= TEST_END_DATE)
     )]
 
-    # Keep only last day articles
-    testset["post_creation_date"] = (testset.tracker_created_at - testset.post_age_in_minutes.apply(lambda x: pd.Timedelta(minutes=x))).dt.date
-    testset["post_creation_date_plus_one"] = testset["post_creation_date"].apply(lambda x: x + pd.Timedelta(days=1))
-    testset["post_from_yesterday"] = testset.tracker_created_at.dt.date == testset.post_creation_date_plus_one
-
-    ## Keep only line with has_been_opened == 1 and post is from last day
-    ## => Divide by 8 the number of post
-    pos_testset = testset[
-        (testset.has_been_opened) &
-        (testset.post_from_yesterday)
-    ]
-
-    ## Add all other posts from the day before as negative
-    pos_and_neg = []
-    for i, row in pos_testset.iterrows():
-        current_user_id = row["user_id"]
-        current_pos_date = row["tracker_created_at"]
-        yesterdays_posts = testset[
-            testset.post_creation_date_plus_one == current_pos_date.date()
-        ].trackable_id.unique()
-
-        for post_id in yesterdays_posts:
-            pos_and_neg.append({
-                "user_id": current_user_id,
-                "tracker_created_at": current_pos_date,
-                "trackable_id": post_id,
-                "has_been_opened": 0
-            })
-
-    testset = pd.concat([pos_testset[col_to_keep], pd.DataFrame(pos_and_neg)], axis=0)
-    
+    testset = generate_candidates(
+        testset,
+        max_negatives=max_negatives,
+        negative_ratio=negative_ratio
+    )
+
     testset = testset[(
         testset["tracker_created_at"] >= TEST_START_DATE
     )]
 
     # Saving the data to parquet
-    testset[col_to_keep].to_parquet(test_path, index=False)
+    write_parquet(testset[col_to_keep], test_path)
     
     # Sanity Check
     train_users = pd.read_parquet(train_path)
@@ -0,0 +1,158 @@
+import json
+import logging
+import os
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from wemoms_homework.config import load_config
+from wemoms_homework.features.age_bitmask import AGE_PROFILE_COLUMNS
+
+CONF = load_config()
+OUTPUT_ROOT = CONF["path"]["output_data_root"]
+
+MATRIX_FILE = "features.npy"
+EVENT_ID_FILE = "features.event_id.npy"
+MANIFEST_FILE = "features.columns.json"
+
+# Rows converted at once when writing the matrix
+WRITE_ROWS = 65536
+
+
+def is_model_input(data_type):
+    """Numbers and booleans are model inputs, not strings nor dates"""
+    return (
+        pa.types.is_integer(data_type)
+        or pa.types.is_floating(data_type)
+        or pa.types.is_boolean(data_type)
+    )
+
+
+def to_float32(batch, start=0):
+    """Columns `start:` of a record batch as a float32 matrix, booleans are
+    0/1 and missing values 0"""
+    X = np.empty((batch.num_rows, batch.num_columns - start), dtype="float32")
+    for i in range(start, batch.num_columns):
+        column = pc.fill_null(batch.column(i).cast(pa.float32()), 0)
+        X[:, i - start] = column.to_numpy(zero_copy_only=False)
+    X[np.isnan(X)] = 0
+    return X
+
+
+def source_stamp(path):
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def write_feature_matrix(table, source_path, root=OUTPUT_ROOT):
+    """Write the model inputs of the merged features `table` (sorted by
+    `event_id`) as a float32 `.npy` matrix, with the `event_id` of each row
+    and a manifest of the columns. `source_path` is the parquet file of
+    the same table, a matrix older than it is not used"""
+    columns = [
+        field.name for field in table.schema
+        if field.name != "event_id"
+        and field.name not in AGE_PROFILE_COLUMNS
+        and is_model_input(field.type)
+    ]
+    matrix_path = os.path.join(root, MATRIX_FILE)
+    event_id_path = os.path.join(root, EVENT_ID_FILE)
+    manifest_path = os.path.join(root, MANIFEST_FILE)
+
+    # Filled by blocks of rows in the memory map, the whole matrix is never
+    # in memory
+    X = np.lib.format.open_memmap(
+        matrix_path + ".tmp",
+        mode="w+",
+        dtype="float32",
+        shape=(table.num_rows, len(columns))
+    )
+    n_rows = 0
+    for batch in table.select(columns).to_batches(max_chunksize=WRITE_ROWS):
+        X[n_rows:n_rows + batch.num_rows] = to_float32(batch)
+        n_rows += batch.num_rows
+    X.flush()
+    del X
+
+    with open(event_id_path + ".tmp", "wb") as f:
+        np.save(f, table.column("event_id").to_numpy())
+
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump({
+            "columns": columns,
+            "rows": table.num_rows,
+            "dtype": "float32",
+            "source": source_stamp(source_path),
+        }, f, indent=2)
+
+    # The manifest last: a matrix is complete if its manifest exists
+    os.replace(matrix_path + ".tmp", matrix_path)
+    os.replace(event_id_path + ".tmp", event_id_path)
+    os.replace(manifest_path + ".tmp", manifest_path)
+    return matrix_path
+
+
+class FeatureMatrix():
+    """Memory-mapped float32 model inputs of the merged features.
+
+    The rows follow the sorted `event_id` of `features.parquet`, booleans
+    are 0/1 and missing values 0. Opening it reads the manifest and the
+    event ids only, the pages of the matrix are read on access and shared
+    in the page cache by all the processes opening it.
+    """
+
+    def __init__(self, X, event_ids, columns, source):
+        self.X = X
+        self.event_ids = event_ids
+        self.columns = list(columns)
+        self.source = source
+        self.column_index = {c: i for i, c in enumerate(self.columns)}
+
+    @classmethod
+    def open(cls, root=OUTPUT_ROOT):
+        with open(os.path.join(root, MANIFEST_FILE), "r") as f:
+            manifest = json.load(f)
+        X = np.load(os.path.join(root, MATRIX_FILE), mmap_mode="r")
+        event_ids = np.load(os.path.join(root, EVENT_ID_FILE))
+        if X.shape != (manifest["rows"], len(manifest["columns"])) or len(event_ids) != len(X):
+            raise ValueError(f"The feature matrix in {root} is incomplete, merge the features again")
+        return cls(X, event_ids, manifest["columns"], manifest["source"])
+
+    def is_fresh(self, source_path):
+        """Written from the current version of `source_path`"""
+        return os.path.exists(source_path) and source_stamp(source_path) == self.source
+
+    def rows(self, event_ids):
+        """Row of each event, they must all have features"""
+        event_ids = np.asarray(event_ids)
+        positions = np.searchsorted(self.event_ids, event_ids)
+        found = positions < len(self.event_ids)
+        found[found] = self.event_ids[positions[found]] == event_ids[found]
+        if not found.all():
+            raise ValueError(f"{(~found).sum()} events have no features, rebuild the features")
+        return positions
+
+    def column_indices(self, columns):
+        missing = [c for c in columns if c not in self.column_index]
+        if missing:
+            raise KeyError(f"{missing} are not in the feature matrix")
+        return [self.column_index[c] for c in columns]
+
+    def take(self, event_ids, columns):
+        """Float32 features `columns` of the events, only their pages are
+        read"""
+        return self.X[np.ix_(self.rows(event_ids), self.column_indices(columns))]
+
+
+def open_feature_matrix(features_path):
+    """Matrix written next to `features_path` by the merge, None if it is
+    missing or older than the parquet file"""
+    root = os.path.dirname(features_path)
+    if not os.path.exists(os.path.join(root, MANIFEST_FILE)):
+        logging.info(f"No feature matrix in {root}, reading {features_path}")
+        return None
+    matrix = FeatureMatrix.open(root)
+    if not matrix.is_fresh(features_path):
+        logging.info(f"The feature matrix is older than {features_path}, reading the parquet file")
+        return None
+    return matrix
@@ -1,3 +1,18 @@
+from wemoms_homework.config import load_config
+
+CONF = load_config()
+WINDOWS = CONF["windows"]
+
+
+def popularity_columns(prefix, windows):
+    """Views, clicks and click ratio of each window"""
+    return [
+        f"{prefix}_last_{window}_{name}"
+        for window in windows
+        for name in ["views_count", "clicks_count", "ratio"]
+    ]
+
+
 USER_FEATURES = [
        'user_is_mom',
        'user_is_pregnant',
@@ -18,17 +33,7 @@ USER_FEATURES = [
        'user_children_count',
 ]
 
-USER_POST_FEATURES = [
-       'user_post_last_1d_views_count',
-       'user_post_last_1d_clicks_count',
-       'user_post_last_1d_ratio',
-       'user_post_last_7d_views_count',
-       'user_post_last_7d_clicks_count',
-       'user_post_last_7d_ratio',
-       'user_post_last_28d_views_count',
-       'user_post_last_28d_clicks_count',
-       'user_post_last_28d_ratio'
-]
+USER_POST_FEATURES = popularity_columns("user_post", WINDOWS["user_post_popularity"])
 
 POST_FEATURES = [
        'post_age_in_minutes',
@@ -42,16 +47,12 @@ POST_FEATURES = [
        'author_department',
        'author_age',
        'author_amenorrhea_week',
+] + popularity_columns("post", WINDOWS["post_popularity"])
+
+# Depend on both the user and the post author, computed for each pair from
+# their children ages
+USER_AUTHOR_FEATURES = [
        'author_has_same_age_children',
        'author_has_same_age_month_children',
-       'author_has_older_children',
-       'post_last_1d_views_count',
-       'post_last_1d_clicks_count',
-       'post_last_1d_ratio',
-       'post_last_7d_views_count',
-       'post_last_7d_clicks_count',
-       'post_last_7d_ratio',
-       'post_last_28d_views_count',
-       'post_last_28d_clicks_count',
-       'post_last_28d_ratio'
+       'author_has_older_children'
 ]
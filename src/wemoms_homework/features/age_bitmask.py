@@ -0,0 +1,161 @@
+import numpy as np
+import pandas as pd
+
+# Ages are stored as bits of uint64 words: 4 words cover 0 to 255 months and
+# 1 word covers 0 to 63 years. The other ages (out of range, negative, not
+# whole) have no bit, the `_outside` flag of their list tells to compare
+# the raw lists instead (see `any_common`).
+MONTH_WORDS = 4
+YEAR_WORDS = 1
+WORD_BITS = 64
+
+# Encoded age lists: the raw list they come from, the divisor of their unit
+# and their number of words
+AGE_LISTS = {
+    "user_children_age_month": ("user_children_age_month", 1, MONTH_WORDS),
+    "user_children_age_year": ("user_children_age_month", 12, YEAR_WORDS),
+    "author_children_age_month": ("author_children_age_month", 1, MONTH_WORDS),
+    "author_children_age_year": ("author_children_age_year", 1, YEAR_WORDS),
+}
+
+
+def mask_columns(name, n_words):
+    if n_words == 1:
+        return [f"{name}_mask"]
+    return [f"{name}_mask_{i}" for i in range(n_words)]
+
+
+def encoded_columns(name):
+    """Bitmasks, max age and `_outside` flag of an encoded age list"""
+    return mask_columns(name, AGE_LISTS[name][2]) + [f"{name}_max", f"{name}_outside"]
+
+
+# Children ages of the user and of the post author: the raw lists and their
+# encodings, enough to match the ages of any user with any author
+USER_AGE_COLUMNS = (
+    ["user_children_age_month"]
+    + encoded_columns("user_children_age_month")
+    + encoded_columns("user_children_age_year")
+)
+AUTHOR_AGE_COLUMNS = (
+    ["author_children_age_month", "author_children_age_year"]
+    + encoded_columns("author_children_age_month")
+    + encoded_columns("author_children_age_year")
+)
+AGE_PROFILE_COLUMNS = USER_AGE_COLUMNS + AUTHOR_AGE_COLUMNS
+
+
+def encode_ages(ages, units):
+    """Encode a Series of age lists as (n, n_words) uint64 bitmask arrays,
+    the max age of each list (-1 if empty) and whether some of its ages have
+    no bit. The lists are exploded once and encoded for each
+    `divisor: n_words` of `units`, e.g. `{1: 4, 12: 1}` for the months and
+    the years of ages in months. Returns a dict
+    `divisor -> (masks, max_age, outside)`"""
+    n = len(ages)
+    lengths = ages.map(len).to_numpy()
+    rows = np.repeat(np.arange(n), lengths)
+    exploded = ages.reset_index(drop=True).explode()
+    # An empty list explodes to one missing value
+    exploded = exploded[np.repeat(lengths > 0, np.maximum(lengths, 1))]
+    values = pd.to_numeric(exploded, errors="coerce").to_numpy(dtype="float64")
+
+    res = {}
+    for divisor, n_words in units.items():
+        # The raw values are compared as they are, the other units floored
+        unit_values = values if divisor == 1 else np.floor_divide(values, divisor)
+
+        # Ages without a bit are left out of the mask, clipping them to the
+        # last bit would make different ages equal
+        in_range = (
+            (unit_values >= 0)
+            & (unit_values < n_words * WORD_BITS)
+            & (unit_values == np.floor(unit_values))
+        )
+        bits = unit_values[in_range].astype("int64")
+        masks = np.zeros((n, n_words), dtype="uint64")
+        np.bitwise_or.at(
+            masks,
+            (rows[in_range], bits // WORD_BITS),
+            np.left_shift(np.uint64(1), (bits % WORD_BITS).astype("uint64"))
+        )
+
+        outside = np.zeros(n, dtype=bool)
+        outside[rows[~in_range]] = True
+
+        known = ~np.isnan(unit_values)
+        max_age = np.full(n, -1, dtype="int64")
+        np.maximum.at(max_age, rows[known], np.floor(unit_values[known]).astype("int64"))
+        res[divisor] = (masks, max_age, outside)
+
+    return res
+
+
+def add_age_bitmasks(df):
+    """Add the bitmask, max age and `_outside` columns of the children age
+    lists"""
+    user = encode_ages(df["user_children_age_month"], {1: MONTH_WORDS, 12: YEAR_WORDS})
+
+    encoded = {
+        "user_children_age_month": user[1],
+        "author_children_age_month": encode_ages(df["author_children_age_month"], {1: MONTH_WORDS})[1],
+        "user_children_age_year": user[12],
+        "author_children_age_year": encode_ages(df["author_children_age_year"], {1: YEAR_WORDS})[1],
+    }
+    for name, (masks, max_age, outside) in encoded.items():
+        for i, col in enumerate(mask_columns(name, masks.shape[1])):
+            df[col] = masks[:, i]
+        df[f"{name}_max"] = max_age.astype("int16")
+        df[f"{name}_outside"] = outside
+
+    return df
+
+
+def age_keys(ages, divisor):
+    """Set of the ages of a raw list in the unit of `divisor`"""
+    return {age if divisor == 1 else age // divisor for age in ages if age is not None}
+
+
+def any_common(left, left_name, right, right_name):
+    """True where the encoded age lists `left_name` of `left` and
+    `right_name` of `right` share at least one age. `left` and `right` are
+    DataFrames of the same rows, or mappings of arrays which broadcast
+    (e.g. users x posts). The bitmasks decide when both lists are whole
+    ages in the range of the bits, the raw lists are compared otherwise"""
+    left_list, left_divisor, n_words = AGE_LISTS[left_name]
+    right_list, right_divisor, _ = AGE_LISTS[right_name]
+    left_masks = [np.asarray(left[c]) for c in mask_columns(left_name, n_words)]
+    right_masks = [np.asarray(right[c]) for c in mask_columns(right_name, n_words)]
+    outside = np.asarray(left[f"{left_name}_outside"], dtype=bool) | np.asarray(right[f"{right_name}_outside"], dtype=bool)
+
+    common = np.zeros(outside.shape, dtype=bool)
+    for left_mask, right_mask in zip(left_masks, right_masks):
+        common |= (left_mask & right_mask) != 0
+
+    rows = np.nonzero(outside)
+    if len(rows[0]):
+        left_ages = np.broadcast_to(np.asarray(left[left_list]), outside.shape)[rows]
+        right_ages = np.broadcast_to(np.asarray(right[right_list]), outside.shape)[rows]
+        common[rows] = [
+            bool(age_keys(l, left_divisor) & age_keys(r, right_divisor))
+            for l, r in zip(left_ages, right_ages)
+        ]
+    return common
+
+
+def age_match_features(user, author):
+    """Features of the children ages of a user and of a post author, from
+    their `USER_AGE_COLUMNS` and `AUTHOR_AGE_COLUMNS` (see `any_common` for
+    the shapes)"""
+    return {
+        "author_has_same_age_children": any_common(
+            author, "author_children_age_year", user, "user_children_age_year"
+        ),
+        "author_has_same_age_month_children": any_common(
+            author, "author_children_age_month", user, "user_children_age_month"
+        ),
+        "author_has_older_children": (
+            np.asarray(author["author_children_age_year_max"])
+            > np.asarray(user["user_children_age_year_max"])
+        ),
+    }
@@ -4,8 +4,11 @@ import pandas as pd
 
 from wemoms_homework.config import load_config
 from wemoms_homework.features.feature import Feature
+from wemoms_homework.schema import apply_schema
+from wemoms_homework.schema import write_parquet
 
 IDS = [
+    "event_id",
     "trackable_id",
     "user_id",
     "tracker_created_at"
@@ -55,15 +58,16 @@ OUTPUT_ROOT = CONF["path"]["interim_data_root"]
 
 class BaseFeatures(Feature):
 
+    columns = IDS + USER_FEATURES + POST_FEATURES
+
     @classmethod
     def extract_feature(cls, df, save=False):          
         logging.info("Keeping the base features")
 
+        df = apply_schema(cls.sort_events(df)[IDS + USER_FEATURES + POST_FEATURES])
+
         if save:
             os.makedirs(OUTPUT_ROOT, exist_ok=True)
-            df[IDS + USER_FEATURES + POST_FEATURES].to_parquet(
-                os.path.join(OUTPUT_ROOT, f"base_features.parquet"),
-                index=False
-            )
+            write_parquet(df, os.path.join(OUTPUT_ROOT, f"base_features.parquet"))
 
-        return df[IDS + USER_FEATURES + POST_FEATURES]
\ No newline at end of file
+        return df
\ No newline at end of file
@@ -4,6 +4,10 @@ import json
 import logging
 import os
 import pandas as pd
+import tempfile
+import pyarrow.feather as feather
+
+from concurrent.futures import ProcessPoolExecutor
 
 from wemoms_homework.config import load_config
 from wemoms_homework.utils import load_data
@@ -15,6 +19,8 @@ from wemoms_homework.features.user_post_popularity import UserPostPopularity
 CONF = load_config()
 DATA_PATH = CONF["path"]["input_data_path"]
 OUTPUT_ROOT = CONF["path"]["output_data_root"]
+INTERIM_ROOT = CONF["path"]["interim_data_root"]
+JOBS = CONF["build"]["jobs"]
 
 FEATURE_DICT = {
     "base_features": BaseFeatures,
@@ -23,6 +29,46 @@ FEATURE_DICT = {
     "user_post_popularity": UserPostPopularity
 }
 
+
+def feature_tasks(feature_groups, split_windows=True):
+    """Split the feature groups in independent tasks, one per window for
+    the windowed features if `split_windows`. A whole group computes all
+    its windows in one pass over the sorted events"""
+    tasks = []
+    for feature_group in feature_groups:
+        feature = FEATURE_DICT[feature_group]
+        if feature.windows and split_windows:
+            tasks += [(feature_group, {"windows": [w]}) for w in feature.windows]
+        else:
+            tasks.append((feature_group, {}))
+    return tasks
+
+
+def input_columns(feature_groups):
+    """Union of the columns read by the feature groups (None means all)"""
+    columns = []
+    for feature_group in feature_groups:
+        feature = FEATURE_DICT[feature_group]
+        if feature.columns is None:
+            return None
+        columns += [c for c in feature.columns if c not in columns]
+    return columns
+
+
+def run_task(input_path, feature_group, kwargs):
+    """Compute one task in a worker process. The input is an uncompressed
+    Arrow file, memory mapped so the workers share the same pages instead
+    of receiving a pickled copy of the data"""
+    feature = FEATURE_DICT[feature_group]
+    df = feather.read_table(
+        input_path,
+        columns=feature.columns,
+        memory_map=True
+    ).to_pandas()
+    feature.extract_feature(df, save=True, **kwargs)
+    return feature_group, kwargs
+
+
 @click.group()
 def build():
     pass
@@ -45,10 +91,53 @@ def build():
         OUTPUT_ROOT
     )
 )
-def build_features(data_path, output_root):
+@click.option(
+    '--jobs',
+    type=click.IntRange(min=1),
+    default=JOBS,
+    help='Number of processes computing the features, default is {}'.format(
+        JOBS
+    )
+)
+@click.option(
+    '--features',
+    type=click.Choice(list(FEATURE_DICT.keys())),
+    multiple=True,
+    default=list(FEATURE_DICT.keys()),
+    help='Feature groups to compute, default is {}'.format(
+        list(FEATURE_DICT.keys())
+    )
+)
+def build_features(data_path, output_root, jobs, features):
     logging.info("Loading Data")
 
-    df = load_data()
+    feature_groups = list(features)
+    df = load_data(columns=input_columns(feature_groups))
+
+    if jobs == 1:
+        for feature_group, kwargs in feature_tasks(feature_groups, split_windows=False):
+            FEATURE_DICT[feature_group].extract_feature(df, save=True, **kwargs)
+        return
+
+    # The windows are split only to spread them over the processes
+    tasks = feature_tasks(feature_groups)
+
+    # One input file per build, concurrent builds do not share it
+    os.makedirs(INTERIM_ROOT, exist_ok=True)
+    fd, input_path = tempfile.mkstemp(prefix="build_input_", suffix=".arrow", dir=INTERIM_ROOT)
+    os.close(fd)
+    try:
+        df.to_feather(input_path, compression="uncompressed")
+        del df
 
-    for feature in FEATURE_DICT.values():
-        feature.extract_feature(df, save=True)
\ No newline at end of file
+        logging.info(f"Computing {len(tasks)} tasks with {jobs} processes")
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [
+                executor.submit(run_task, input_path, feature_group, kwargs)
+                for feature_group, kwargs in tasks
+            ]
+            for future in futures:
+                feature_group, kwargs = future.result()
+                logging.info(f"\tDone {feature_group} {kwargs.get('windows', '')}")
+    finally:
+        os.remove(input_path)
@@ -3,12 +3,14 @@ import os
 import pandas as pd
 
 from wemoms_homework.config import load_config
+from wemoms_homework.features.age_bitmask import AGE_PROFILE_COLUMNS
+from wemoms_homework.features.age_bitmask import age_match_features
 from wemoms_homework.features.feature import Feature
+from wemoms_homework.schema import apply_schema
+from wemoms_homework.schema import write_parquet
 
 IDS = [
-    "trackable_id",
-    "user_id",
-    "tracker_created_at"
+    "event_id"
 ]
 
 CONF = load_config()
@@ -18,45 +20,39 @@ OUTPUT_ROOT = CONF["path"]["interim_data_root"]
 
 class ExtraFeatures(Feature):
 
+    columns = IDS + AGE_PROFILE_COLUMNS
+
     @classmethod
     def extract_feature(cls, df, save=False):
-        """Compute extra features"""
-        logging.info("Adding extra features")
+        """Compute extra features
 
-        # User children age in year to match with `author_children_age_year`
-        df["user_children_age_year"] = df.user_children_age_month.apply(lambda x: [i//12 for i in x])
+        The children ages are encoded as bitmasks at ingestion (see
+        `age_bitmask`), so matching ages is a bitwise AND on whole columns.
+        Only the lists with ages out of the bits are compared one by one.
+
+        The children ages of the user and of the author are saved too, the
+        feature store computes the same features for any pair with them.
+        They are not model inputs.
+        """
+        logging.info("Adding extra features")
 
-        # Author has same age children
-        df["author_has_same_age_children"] = df.apply(
-            lambda x: len(set(x.author_children_age_year).intersection(set(x.user_children_age_year))) > 0,
-            axis=1
-        )
+        df = cls.sort_events(df)
+        extra = df[IDS].reset_index(drop=True)
 
-        # Author has same age children
-        df["author_has_same_age_month_children"] = df.apply(
-            lambda x: len(set(x.author_children_age_month).intersection(set(x.user_children_age_month))) > 0,
-            axis=1
-        )
+        # Author has same age children (in years and in months) and has
+        # older children than user
+        for name, values in age_match_features(df, df).items():
+            extra[name] = values
 
-        # Author has older children than user
-        df["author_has_older_children"] = df.apply(
-            lambda x: max(x.author_children_age_year, default=-1) > max(x.user_children_age_year, default=-1),
-            axis=1
-        )
+        for col in AGE_PROFILE_COLUMNS:
+            extra[col] = df[col].to_numpy()
 
         # Time since first commit
 
-        EXTRA_COLS = [
-            "author_has_same_age_children",
-            "author_has_same_age_month_children",
-            "author_has_older_children"
-        ]
+        extra = apply_schema(extra)
 
         if save:
             os.makedirs(OUTPUT_ROOT, exist_ok=True)
-            df[IDS + EXTRA_COLS].to_parquet(
-                os.path.join(OUTPUT_ROOT, f"extra_features.parquet"),
-                index=False
-            )
+            write_parquet(extra, os.path.join(OUTPUT_ROOT, f"extra_features.parquet"))
 
-        return df[IDS + EXTRA_COLS]
\ No newline at end of file
+        return extra
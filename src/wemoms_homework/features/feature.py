@@ -1,7 +1,35 @@
+from wemoms_homework.instrumentation import instrument_feature
+
+
 class Feature():
 
     data = None
 
+    # Input columns needed by `extract_feature` (None means all of them)
+    columns = None
+
+    # Windows computed by `extract_feature`, each one can be computed
+    # separately with `extract_feature(df, windows=[window])`
+    windows = None
+
+    def __init_subclass__(cls, **kwargs):
+        """Every `extract_feature` of a subclass is measured (see
+        `instrumentation`)"""
+        super().__init_subclass__(**kwargs)
+        if "extract_feature" in cls.__dict__:
+            cls.extract_feature = classmethod(instrument_feature(
+                cls.__name__,
+                cls.__dict__["extract_feature"].__func__
+            ))
+
     @classmethod
     def extract_feature(cls, df, save):
-        pass
\ No newline at end of file
+        pass
+
+    @staticmethod
+    def sort_events(df):
+        """Every feature file has one row per event sorted by `event_id`, so
+        the files are row-aligned and can be merged without a join"""
+        if df["event_id"].is_monotonic_increasing:
+            return df
+        return df.sort_values("event_id", kind="stable", ignore_index=True)
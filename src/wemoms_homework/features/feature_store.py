@@ -0,0 +1,233 @@
+import os
+import shutil
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from wemoms_homework.features import USER_FEATURES
+from wemoms_homework.features import POST_FEATURES
+from wemoms_homework.features import USER_AUTHOR_FEATURES
+from wemoms_homework.features import USER_POST_FEATURES
+
+from wemoms_homework.config import load_config
+from wemoms_homework.data.ingest_data import partition_files
+from wemoms_homework.features.age_bitmask import AGE_PROFILE_COLUMNS
+from wemoms_homework.features.age_bitmask import AUTHOR_AGE_COLUMNS
+from wemoms_homework.features.age_bitmask import USER_AGE_COLUMNS
+from wemoms_homework.features.age_bitmask import age_match_features
+from wemoms_homework.features.window_counts import to_nanoseconds
+from wemoms_homework.schema import read_parquet
+from wemoms_homework.schema import write_partition
+
+CONF = load_config()
+FEATURE_STORE_ROOT = CONF["path"]["feature_store_root"]
+
+# The children ages of the users and of the authors are kept to compute the
+# `USER_AUTHOR_FEATURES` of any pair, they are not features themselves
+ENTITIES = {
+    "user": (["user_id"], USER_FEATURES + USER_AGE_COLUMNS),
+    "post": (["trackable_id"], POST_FEATURES + AUTHOR_AGE_COLUMNS),
+    "user_post": (["user_id", "trackable_id"], USER_POST_FEATURES),
+}
+
+MINUTE = pd.Timedelta(minutes=1).value
+
+
+def post_age_at(ages, snapshot_times, times):
+    """Age in minutes of posts at `times` from their age at the time of
+    their snapshot, to the minute"""
+    elapsed = (to_nanoseconds(times) - to_nanoseconds(snapshot_times)) // MINUTE
+    return np.asarray(ages, dtype="float64") + elapsed
+
+
+class EntitySnapshots():
+    """Time-sorted snapshots of the features of one entity.
+
+    The rows are sorted by (entity, time) with `offsets[code]` the first row
+    of the entity `code`. Every row also has a sorted int64 key combining the
+    entity code and the rank of its timestamp, so an as-of lookup is a
+    `searchsorted` on that key without sorting anything.
+
+    On disk the rows are partitioned by day (`<name>/day=YYYY-MM-DD/`), a
+    day is replaced without reading the others. They are sorted again when
+    loaded.
+    """
+
+    def __init__(self, keys, rows, offsets, unique_times):
+        self.keys = keys
+        self.rows = rows
+        self.offsets = offsets
+        self.unique_times = unique_times
+
+        self.features = [c for c in rows.columns if c not in keys + ["tracker_created_at"]]
+        codes = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+        self.span = len(unique_times) + 1
+        self.composite = codes * self.span + np.searchsorted(
+            unique_times,
+            to_nanoseconds(rows["tracker_created_at"]),
+            side="left"
+        )
+        # Plain values: the categories of the queries can differ
+        key_rows = rows[keys].iloc[offsets[:-1]]
+        if len(keys) == 1:
+            self.index = pd.Index(np.asarray(key_rows[keys[0]]))
+        else:
+            self.index = pd.MultiIndex.from_arrays([np.asarray(key_rows[k]) for k in keys])
+
+    @classmethod
+    def build(cls, data, keys, features):
+        features = [c for c in features if c in data.columns]
+        rows = data[keys + ["tracker_created_at"] + features]
+        codes = rows.groupby(keys, sort=False, observed=True).ngroup().to_numpy()
+        times = to_nanoseconds(rows["tracker_created_at"])
+        order = np.lexsort((times, codes))
+        rows = rows.iloc[order].reset_index(drop=True)
+
+        # Renumber the entities in sorted order
+        sorted_codes = codes[order]
+        starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+        offsets = np.r_[starts, len(rows)] if len(rows) else np.array([0])
+        return cls(keys, rows, offsets, np.unique(times))
+
+    def codes(self, df):
+        if len(self.keys) == 1:
+            return self.index.get_indexer(np.asarray(df[self.keys[0]]))
+        return self.index.get_indexer(
+            pd.MultiIndex.from_arrays([np.asarray(df[k]) for k in self.keys])
+        )
+
+    def positions(self, df, times):
+        """Row of the last snapshot at or before `times` for each entity of
+        `df` (-1 if none), like `merge_asof(direction="backward")`"""
+        codes = self.codes(df)
+        n_times = np.searchsorted(self.unique_times, to_nanoseconds(times), side="right")
+        query = codes * self.span + n_times - 1
+        positions = np.searchsorted(self.composite, query, side="right") - 1
+        valid = (codes >= 0) & (positions >= self.offsets[np.maximum(codes, 0)])
+        return np.where(valid, positions, -1)
+
+    def take(self, positions, features=None):
+        """Features of the rows at `positions`, NaN where -1"""
+        features = self.features if features is None else features
+        res = self.rows[features].iloc[np.maximum(positions, 0)].reset_index(drop=True)
+        return res.where(pd.Series(positions >= 0, index=res.index), axis=0)
+
+    def asof(self, df, times):
+        """Features of the entities of `df` as of `times`, NaN if unknown"""
+        return self.take(self.positions(df, times))
+
+    def latest(self, before):
+        """Keys and features of the last snapshot of each entity strictly
+        before `before`"""
+        entities = self.rows[self.keys].iloc[self.offsets[:-1]].reset_index(drop=True)
+        times = pd.Series(pd.Timestamp(before) - pd.Timedelta(1, unit="ns"), index=entities.index)
+        positions = self.positions(entities, times)
+        found = positions >= 0
+        return pd.concat([
+            entities[found].reset_index(drop=True),
+            self.rows[["tracker_created_at"] + self.features].iloc[positions[found]].reset_index(drop=True)
+        ], axis=1)
+
+    def save(self, root, name):
+        """Write one partition per day"""
+        os.makedirs(os.path.join(root, name), exist_ok=True)
+        days = self.rows["tracker_created_at"].dt.strftime("%Y-%m-%d")
+        for day, rows in self.rows.groupby(days, sort=False):
+            write_partition(rows, os.path.join(root, name), day)
+
+    @classmethod
+    def load(cls, root, name, keys, columns=None):
+        files = partition_files(os.path.join(root, name))
+        rows = read_parquet(files, columns=columns)
+        features = [c for c in rows.columns if c not in keys + ["tracker_created_at"]]
+        return cls.build(rows, keys, features)
+
+
+class FeatureStore():
+    """Point-in-time features of the users, posts and user/post pairs"""
+
+    def __init__(self, entities):
+        self.entities = entities
+
+    @classmethod
+    def build(cls, data):
+        return cls({
+            name: EntitySnapshots.build(data, keys, features)
+            for name, (keys, features) in ENTITIES.items()
+        })
+
+    def save(self, root=FEATURE_STORE_ROOT):
+        """Write the whole store, it replaces the previous one at once"""
+        tmp_root = root.rstrip("/") + ".tmp"
+        shutil.rmtree(tmp_root, ignore_errors=True)
+        for name, snapshots in self.entities.items():
+            snapshots.save(tmp_root, name)
+        shutil.rmtree(root, ignore_errors=True)
+        os.rename(tmp_root, root)
+
+    @classmethod
+    def load(cls, root=FEATURE_STORE_ROOT, columns=None):
+        """Load the snapshots, only the features in `columns` if given"""
+        if columns is not None and any(c in USER_AUTHOR_FEATURES for c in columns):
+            columns = list(columns) + AGE_PROFILE_COLUMNS
+        entities = {}
+        for name, (keys, features) in ENTITIES.items():
+            entity_columns = None
+            files = partition_files(os.path.join(root, name))
+            if columns is not None and files:
+                names = pq.read_schema(files[0]).names
+                entity_columns = keys + ["tracker_created_at"] + [
+                    c for c in names if c in features and c in columns
+                ]
+            entities[name] = EntitySnapshots.load(root, name, keys, entity_columns)
+        return cls(entities)
+
+    @staticmethod
+    def replace_day(data, day, root=FEATURE_STORE_ROOT):
+        """Replace the snapshots of `day` by the events of `data`, so a day
+        is appended (or processed again) by writing its partitions only"""
+        for name, (keys, features) in ENTITIES.items():
+            columns = keys + ["tracker_created_at"] + [c for c in features if c in data.columns]
+            write_partition(data[columns], os.path.join(root, name), day)
+
+    def lookup(self, df):
+        """Features of every entity of `df` as of its `tracker_created_at`,
+        aligned on the rows of `df`.
+
+        The age of the post is the one at the time of the query, and the
+        features of the user and the post author are computed for each
+        known pair from their children ages, as in the training data."""
+        times = df["tracker_created_at"]
+        positions = {name: snapshots.positions(df, times) for name, snapshots in self.entities.items()}
+        res = pd.concat(
+            [
+                snapshots.take(
+                    positions[name],
+                    [c for c in snapshots.features if c not in AGE_PROFILE_COLUMNS]
+                )
+                for name, snapshots in self.entities.items()
+            ],
+            axis=1
+        )
+
+        users, posts = self.entities["user"], self.entities["post"]
+        user_positions, post_positions = positions["user"], positions["post"]
+        if "post_age_in_minutes" in res.columns:
+            found = post_positions >= 0
+            snapshot_times = posts.rows["tracker_created_at"].iloc[post_positions[found]]
+            ages = res["post_age_in_minutes"].to_numpy(dtype="float64", copy=True)
+            ages[found] = post_age_at(ages[found], snapshot_times, times[found])
+            res["post_age_in_minutes"] = ages
+
+        if set(AGE_PROFILE_COLUMNS) <= set(users.features + posts.features):
+            known = (user_positions >= 0) & (post_positions >= 0)
+            features = age_match_features(
+                users.rows.iloc[user_positions[known]],
+                posts.rows.iloc[post_positions[known]]
+            )
+            for name, values in features.items():
+                column = np.full(len(df), np.nan)
+                column[known] = values
+                res[name] = column
+
+        return res
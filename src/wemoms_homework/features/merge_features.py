@@ -3,13 +3,20 @@ import functools as ft
 import json
 import logging
 import os
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 
 from wemoms_homework.config import load_config
+from wemoms_homework.feature_matrix import write_feature_matrix
 from wemoms_homework.features.base_features import BaseFeatures
 from wemoms_homework.features.extra_features import ExtraFeatures
+from wemoms_homework.features.feature_store import FeatureStore
 from wemoms_homework.features.post_popularity import PostPopularity
 from wemoms_homework.features.user_post_popularity import UserPostPopularity
+from wemoms_homework.instrumentation import measure
+from wemoms_homework.schema import write_parquet
 
 CONF = load_config()
 DATA_PATH = CONF["path"]["input_data_path"]
@@ -24,7 +31,50 @@ FEATURE_DICT = {
 }
 
 FEATURE_DEFINITIONS = CONF["feature_definitions"]
-FEATURES = CONF["features"]
+SPARSE_FEATURES = CONF["sparse_features"]
+
+
+def merge_files(paths):
+    """Merge the feature files `paths` (`{feature_group: {feature: path}}`)
+    into one Arrow table, the first file giving the events"""
+    table = None
+
+    for feature_group, features in paths.items():
+        logging.info(f"Merging {feature_group}")
+        for feature, path in features.items():
+            logging.info(f" - {feature}")
+            with measure("merge_features.file", feature_group=feature_group, file=feature) as current:
+                temp_table = pq.read_table(path)
+                current.rows_in = temp_table.num_rows
+                if table is None:
+                    table = temp_table
+                    event_ids = table.column("event_id").to_numpy()
+                    current.rows_out = table.num_rows
+                    continue
+
+                temp_event_ids = temp_table.column("event_id").to_numpy()
+                value_cols = [c for c in temp_table.column_names if c != "event_id"]
+
+                if feature_group in SPARSE_FEATURES:
+                    # Only the rows with a non-zero history have been saved
+                    positions = np.searchsorted(event_ids, temp_event_ids)
+                    for col in value_cols:
+                        values = temp_table.column(col).to_numpy()
+                        dense = np.zeros(len(event_ids), dtype=values.dtype)
+                        dense[positions] = values
+                        table = table.append_column(col, pa.array(dense))
+                else:
+                    if not np.array_equal(event_ids, temp_event_ids):
+                        raise ValueError(
+                            f"{feature} is not aligned with the other features, "
+                            "the features must be built from the same data"
+                        )
+                    for col in value_cols:
+                        table = table.append_column(temp_table.field(col), temp_table.column(col))
+                current.rows_out = table.num_rows
+
+    return table
+
 
 @click.group()
 def merge():
@@ -49,24 +99,34 @@ def merge():
     )
 )
 def merge_features(data_path, output_root):
-    """ Merge all parquet file into one big parquet file"""
-    df = pd.DataFrame()
+    """ Merge all parquet file into one big parquet file
+
+    Every feature file is sorted by `event_id` with one row per event, so the
+    merge is a concatenation of columns. Sparse files only hold some of the
+    events, their rows are scattered with the event ids and the missing rows
+    are filled with zeros.
+
+    The model inputs are also saved as a float32 matrix memory-mapped by the
+    training, and the point-in-time feature store used by the predictions
+    is built from the merged features.
+    """
+    table = merge_files({
+        feature_group: {
+            feature: os.path.join(INTERIM_ROOT, f"{feature}.parquet")
+            for feature in features
+        }
+        for feature_group, features in FEATURE_DEFINITIONS.items()
+    })
 
-    for feature_group, features in FEATURE_DEFINITIONS.items():
-        key = FEATURES[feature_group]
-        logging.info(f"Merging {feature_group}")
-        for feature in features:
-            logging.info(f" - {feature}")
-            temp_df = pd.read_parquet(os.path.join(INTERIM_ROOT, f"{feature}.parquet"))
-            if len(df) == 0:
-                df = temp_df
-            else:
-                df = pd.merge(
-                    left=df,
-                    right=temp_df,
-                    on=key,
-                    how="left")
-    
     path = os.path.join(OUTPUT_ROOT, f"features.parquet")
     logging.info(f"Saving features to {path}")
-    df.to_parquet(path, index=False)
+    with measure("merge_features.write", rows_in=table.num_rows):
+        write_parquet(table, path)
+
+    logging.info("Saving the feature matrix")
+    with measure("merge_features.matrix", rows_in=table.num_rows):
+        write_feature_matrix(table, path, OUTPUT_ROOT)
+
+    logging.info("Building the feature store")
+    with measure("merge_features.feature_store", rows_in=table.num_rows):
+        FeatureStore.build(table.to_pandas()).save()
@@ -0,0 +1,340 @@
+import click
+import json
+import logging
+import os
+import signal
+import time
+import numpy as np
+import pandas as pd
+
+from wemoms_homework.config import load_config
+from wemoms_homework.features.window_counts import to_nanoseconds
+from wemoms_homework.schema import apply_schema
+
+CONF = load_config()
+WINDOWS = CONF["windows"]["post_popularity"]
+BUCKET = CONF["streaming"]["bucket"]
+EVENT_LOG_PATH = CONF["streaming"]["event_log_path"]
+STATE_PATH = CONF["streaming"]["state_path"]
+POLL_SECONDS = CONF["streaming"]["poll_seconds"]
+SNAPSHOT_SECONDS = CONF["streaming"]["snapshot_seconds"]
+
+EVENT_COLUMNS = ["trackable_id", "tracker_created_at", "has_been_opened"]
+
+# Bytes of the event log parsed at once
+READ_BYTES = 64 * 2 ** 20
+
+# Requests whose buckets are gathered at once
+QUERY_ROWS = 4096
+
+
+class PopularityCounters():
+    """Views and clicks of each post in time buckets, for the features of
+    `PostPopularity` on fresh events.
+
+    Each post has a ring buffer of buckets (hourly by default) covering the
+    longest window. A query at `t` sums the buckets from the one of
+    `t - window` to the one of `t`, so the features are exact when `t` is
+    on a bucket boundary. Otherwise the oldest bucket is counted whole: the
+    counts may include the events of less than one bucket before
+    `t - window`, they never miss an event of the window.
+    As in the batch features (`closed='left'`), the events at `t` itself
+    are not counted. The queries must not be older than the events already
+    added, the counters only move forward.
+    """
+
+    def __init__(self, windows=WINDOWS, bucket=BUCKET, capacity=1024):
+        self.windows = list(windows)
+        self.bucket_ns = pd.Timedelta(bucket).value
+        self.window_buckets = {}
+        for window in self.windows:
+            n_buckets, remainder = divmod(pd.Timedelta(window).value, self.bucket_ns)
+            if remainder:
+                raise ValueError(f"The window {window} is not a multiple of the bucket {bucket}")
+            self.window_buckets[window] = n_buckets
+        # The bucket of `t - window` to the bucket of `t` included
+        self.ring = max(self.window_buckets.values()) + 1
+
+        self.post_index = {}
+        self.post_ids = []
+        self.views = np.zeros((capacity, self.ring), dtype="int32")
+        self.clicks = np.zeros((capacity, self.ring), dtype="int32")
+        # Last bucket written, last event time and the events at that time
+        # (excluded from a query at the same time) of each post
+        self.head = np.full(capacity, np.iinfo("int64").min, dtype="int64")
+        self.last_time = np.full(capacity, np.iinfo("int64").min, dtype="int64")
+        self.tie_views = np.zeros(capacity, dtype="int32")
+        self.tie_clicks = np.zeros(capacity, dtype="int32")
+        self.watermark = np.iinfo("int64").min
+        self.offset = 0
+
+    def rows(self, post_ids, create=False):
+        """Row of each post, -1 for an unknown post unless `create`"""
+        res = np.empty(len(post_ids), dtype="int64")
+        for i, post_id in enumerate(post_ids):
+            row = self.post_index.get(post_id, -1)
+            if row < 0 and create:
+                row = len(self.post_ids)
+                self.post_index[post_id] = row
+                self.post_ids.append(post_id)
+            res[i] = row
+        if len(self.post_ids) > len(self.head):
+            self.grow(len(self.post_ids))
+        return res
+
+    def grow(self, n_rows):
+        capacity = max(n_rows, 2 * len(self.head))
+        extra = capacity - len(self.head)
+        self.views = np.vstack([self.views, np.zeros((extra, self.ring), dtype="int32")])
+        self.clicks = np.vstack([self.clicks, np.zeros((extra, self.ring), dtype="int32")])
+        self.head = np.concatenate([self.head, np.full(extra, np.iinfo("int64").min)])
+        self.last_time = np.concatenate([self.last_time, np.full(extra, np.iinfo("int64").min)])
+        self.tie_views = np.concatenate([self.tie_views, np.zeros(extra, dtype="int32")])
+        self.tie_clicks = np.concatenate([self.tie_clicks, np.zeros(extra, dtype="int32")])
+
+    def add(self, post_ids, times, clicks):
+        """Count a batch of events: one view of `post_ids[i]` at `times[i]`
+        (nanoseconds), clicked if `clicks[i]`"""
+        times = np.asarray(times, dtype="int64")
+        clicks = np.asarray(clicks, dtype="int64")
+        if not len(times):
+            return
+        rows = self.rows(post_ids, create=True)
+        buckets = times // self.bucket_ns
+
+        # Move the head of the posts with newer buckets, the slots of the
+        # buckets between the old and the new head are emptied
+        new_head = self.head.copy()
+        np.maximum.at(new_head, rows, buckets)
+        moved = np.flatnonzero(new_head > self.head)
+        slots = np.arange(self.ring)
+        slot_buckets = new_head[moved, None] - (new_head[moved, None] - slots) % self.ring
+        expired = slot_buckets > self.head[moved, None]
+        self.views[moved] = np.where(expired, 0, self.views[moved])
+        self.clicks[moved] = np.where(expired, 0, self.clicks[moved])
+        self.head = new_head
+
+        # Events older than the ring of their post are dropped
+        kept = buckets > self.head[rows] - self.ring
+        np.add.at(self.views, (rows[kept], buckets[kept] % self.ring), 1)
+        np.add.at(self.clicks, (rows[kept], buckets[kept] % self.ring), clicks[kept])
+
+        # Events at the last time of their post
+        new_last_time = self.last_time.copy()
+        np.maximum.at(new_last_time, rows, times)
+        same = new_last_time == self.last_time
+        self.tie_views[~same] = 0
+        self.tie_clicks[~same] = 0
+        ties = times == new_last_time[rows]
+        np.add.at(self.tie_views, rows[ties], 1)
+        np.add.at(self.tie_clicks, rows[ties], clicks[ties])
+        self.last_time = new_last_time
+        self.watermark = max(self.watermark, int(times.max()))
+
+    def add_events(self, df):
+        """Count the events of a DataFrame with the raw columns, a missing
+        `has_been_opened` is not a click"""
+        opened = df["has_been_opened"]
+        self.add(
+            df["trackable_id"].astype(str).to_numpy(),
+            to_nanoseconds(pd.to_datetime(df["tracker_created_at"], utc=True)),
+            opened.where(opened.notna(), False).astype(bool).to_numpy()
+        )
+
+    def counts(self, post_ids, times):
+        """Views and clicks of each window, as dicts `window -> array`"""
+        times = np.asarray(times, dtype="int64")
+        rows = self.rows(post_ids)
+        views = {window: np.zeros(len(times)) for window in self.windows}
+        clicks = {window: np.zeros(len(times)) for window in self.windows}
+
+        for start in range(0, len(times), QUERY_ROWS):
+            block_rows = rows[start:start + QUERY_ROWS]
+            block_times = times[start:start + QUERY_ROWS]
+            known = block_rows >= 0
+            r = np.where(known, block_rows, 0)
+            head = self.head[r]
+
+            # Buckets of the query, then 1, 2, ... before it, only the ones
+            # still in the ring and already written count
+            buckets = (block_times // self.bucket_ns)[:, None] - np.arange(self.ring)
+            valid = known[:, None] & (buckets <= head[:, None]) & (buckets > head[:, None] - self.ring)
+            slots = buckets % self.ring
+            block_views = np.cumsum(np.where(valid, self.views[r[:, None], slots], 0), axis=1)
+            block_clicks = np.cumsum(np.where(valid, self.clicks[r[:, None], slots], 0), axis=1)
+
+            # closed='left': the events at the time of the query are excluded
+            tie = known & (self.last_time[r] == block_times)
+            for window, n_buckets in self.window_buckets.items():
+                views[window][start:start + QUERY_ROWS] = (
+                    block_views[:, n_buckets] - np.where(tie, self.tie_views[r], 0)
+                )
+                clicks[window][start:start + QUERY_ROWS] = (
+                    block_clicks[:, n_buckets] - np.where(tie, self.tie_clicks[r], 0)
+                )
+        return views, clicks
+
+    def features(self, post_ids, times):
+        """`post_last_{window}_views_count`, `_clicks_count` and `_ratio` of
+        each post at each time, with the columns and dtypes of
+        `PostPopularity`"""
+        views, clicks = self.counts(post_ids, to_nanoseconds(times))
+        res = {}
+        for window in self.windows:
+            ratio = np.divide(
+                clicks[window],
+                views[window],
+                out=np.zeros(len(views[window])),
+                where=views[window] > 0
+            )
+            res[f"post_last_{window}_views_count"] = views[window]
+            res[f"post_last_{window}_clicks_count"] = clicks[window]
+            res[f"post_last_{window}_ratio"] = ratio
+        return apply_schema(pd.DataFrame(res))
+
+    def compact(self):
+        """Forget the posts without an event in the ring of the watermark,
+        all their windows are empty"""
+        watermark_bucket = self.watermark // self.bucket_ns
+        live = np.flatnonzero(self.head[:len(self.post_ids)] > watermark_bucket - self.ring)
+        self.post_ids = [self.post_ids[i] for i in live]
+        self.post_index = {post_id: row for row, post_id in enumerate(self.post_ids)}
+        for name in ["views", "clicks", "head", "last_time", "tie_views", "tie_clicks"]:
+            setattr(self, name, getattr(self, name)[live])
+        if not len(live):
+            self.grow(1)
+
+    def save(self, path=STATE_PATH):
+        """Snapshot the counters and the offset of the event log, replaced
+        at once"""
+        self.compact()
+        n_rows = len(self.post_ids)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path + ".tmp", "wb") as f:
+            np.savez(
+                f,
+                windows=np.array(self.windows),
+                bucket_ns=self.bucket_ns,
+                post_ids=np.array(self.post_ids, dtype=str),
+                views=self.views[:n_rows],
+                clicks=self.clicks[:n_rows],
+                head=self.head[:n_rows],
+                last_time=self.last_time[:n_rows],
+                tie_views=self.tie_views[:n_rows],
+                tie_clicks=self.tie_clicks[:n_rows],
+                watermark=self.watermark,
+                offset=self.offset
+            )
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path=STATE_PATH, windows=WINDOWS, bucket=BUCKET):
+        """Counters of a snapshot, with the same windows and bucket"""
+        with np.load(path) as state:
+            if list(state["windows"]) != list(windows) or int(state["bucket_ns"]) != pd.Timedelta(bucket).value:
+                raise ValueError(
+                    f"The snapshot {path} has other windows or buckets than the config, "
+                    "remove it to replay the event log"
+                )
+            counters = cls(windows, bucket, capacity=max(1, len(state["post_ids"])))
+            counters.post_ids = state["post_ids"].tolist()
+            counters.post_index = {post_id: row for row, post_id in enumerate(counters.post_ids)}
+            n_rows = len(counters.post_ids)
+            for name in ["views", "clicks", "head", "last_time", "tie_views", "tie_clicks"]:
+                getattr(counters, name)[:n_rows] = state[name]
+            counters.watermark = int(state["watermark"])
+            counters.offset = int(state["offset"])
+        return counters
+
+
+def read_events(path, offset, max_bytes=READ_BYTES):
+    """Events of the complete JSON lines appended to the log after `offset`
+    and the offset of the next line"""
+    if os.path.getsize(path) < offset:
+        raise ValueError(f"{path} is shorter than the offset {offset} of the snapshot, it was rotated")
+    with open(path, "rb") as f:
+        f.seek(offset)
+        data = f.read(max_bytes)
+    # A partial last line is read again with the next events
+    end = data.rfind(b"\n") + 1
+    records = [json.loads(line) for line in data[:end].splitlines() if line.strip()]
+    return pd.DataFrame.from_records(records, columns=EVENT_COLUMNS), offset + end
+
+
+@click.group()
+def streaming():
+    pass
+
+
+@streaming.command()
+@click.option(
+    '--event-log',
+    type=str,
+    default=EVENT_LOG_PATH,
+    help='JSON lines file the events are appended to, default is {}'.format(
+        EVENT_LOG_PATH
+    )
+)
+@click.option(
+    '--state-path',
+    type=str,
+    default=STATE_PATH,
+    help='Snapshot of the counters, default is {}'.format(
+        STATE_PATH
+    )
+)
+@click.option(
+    '--follow',
+    is_flag=True,
+    default=False,
+    help='Keep reading the events appended to the log, until interrupted'
+)
+@click.option(
+    '--snapshot-seconds',
+    type=click.FloatRange(min=0),
+    default=SNAPSHOT_SECONDS,
+    help='Time between two snapshots when following the log, default is {}'.format(
+        SNAPSHOT_SECONDS
+    )
+)
+def stream_popularity(event_log, state_path, follow, snapshot_seconds):
+    """Update the post popularity counters with the new events of the log
+
+    The counts of a window are exact at the start of a bucket
+    (`streaming.bucket`). Between two starts, they may also count the
+    events of less than one bucket before the window.
+    """
+    if os.path.exists(state_path):
+        counters = PopularityCounters.load(state_path)
+        logging.info(f"Restored {len(counters.post_ids)} posts at offset {counters.offset} of {event_log}")
+    else:
+        counters = PopularityCounters()
+        logging.info(f"No snapshot {state_path}, reading {event_log} from the start")
+
+    if follow:
+        # Stopped by a service manager like by Ctrl-C: snapshot and exit
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+    last_snapshot = time.monotonic()
+    n_events = 0
+    try:
+        while True:
+            df, offset = read_events(event_log, counters.offset)
+            counters.add_events(df)
+            counters.offset = offset
+            n_events += len(df)
+            if len(df):
+                continue
+            if not follow:
+                break
+            if time.monotonic() - last_snapshot >= snapshot_seconds:
+                counters.save(state_path)
+                last_snapshot = time.monotonic()
+            time.sleep(POLL_SECONDS)
+    except KeyboardInterrupt:
+        logging.info("Interrupted")
+    finally:
+        counters.save(state_path)
+        logging.info(
+            f"Counted {n_events} events, {len(counters.post_ids)} posts saved to {state_path}"
+        )
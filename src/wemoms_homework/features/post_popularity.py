@@ -3,45 +3,50 @@ import os
 import pandas as pd
 
 from wemoms_homework.config import load_config
+from wemoms_homework.config import window_file
 from wemoms_homework.features.feature import Feature
+from wemoms_homework.schema import apply_schema
+from wemoms_homework.schema import write_parquet
+from wemoms_homework.features.window_counts import rolling_counts
+from wemoms_homework.features.window_counts import to_nanoseconds
 
 CONF = load_config()
 DATA_PATH = CONF["path"]["input_data_path"]
 OUTPUT_ROOT = CONF["path"]["interim_data_root"]
+WINDOWS = CONF["windows"]["post_popularity"]
 
 
 class PostPopularity(Feature):
 
+    columns = ["event_id", "trackable_id", "tracker_created_at", "has_been_opened"]
+    windows = WINDOWS
+
     @classmethod
-    def extract_feature(cls, df, save=False, windows=["1d", "7d", "28d"]):
+    def extract_feature(cls, df, save=False, windows=WINDOWS):
         """Compute the popularity of a post using windows"""
         logging.info("Computing the features PostPopularity")
 
-        def add_post_past_popularity(window):
-            logging.info(f"\tComputing past {window} popularity")
-            return (df[["tracker_created_at", "trackable_id", "has_been_opened"]]
-                      .set_index('tracker_created_at')
-                      .sort_index()
-                      .groupby('trackable_id', sort=False)
-                      .has_been_opened
-                      .rolling(window, closed='left')
-                      .agg({
-                          f"post_last_{window}_views_count": len,
-                          f"post_last_{window}_clicks_count": sum,
-                          f"post_last_{window}_ratio": lambda x: sum(x)/len(x)
-                      })
-                      .fillna(0)
-                      .reset_index())
-        
-        df_res = pd.DataFrame()
+        df = cls.sort_events(df)
+        counts = rolling_counts(
+            keys=pd.factorize(df["trackable_id"])[0],
+            times=to_nanoseconds(df["tracker_created_at"]),
+            labels=df["has_been_opened"].to_numpy(),
+            windows=windows
+        )
+        ids = df[["event_id"]].reset_index(drop=True)
+
+        df_res = ids.copy()
         for window in windows:
-            df_temp = add_post_past_popularity(window)
-            df_res = pd.concat([df_res, df_temp], axis=0)
+            logging.info(f"\tComputing past {window} popularity")
+            views, clicks, ratio = counts[window]
+            df_temp = apply_schema(ids.assign(**{
+                f"post_last_{window}_views_count": views,
+                f"post_last_{window}_clicks_count": clicks,
+                f"post_last_{window}_ratio": ratio
+            }))
+            df_res = df_res.join(df_temp.drop(columns=ids.columns))
             if save:
                 os.makedirs(OUTPUT_ROOT, exist_ok=True)
-                df_temp.to_parquet(
-                    os.path.join(OUTPUT_ROOT, f"post_popularity_{window}.parquet"),
-                    index=False
-                )
+                write_parquet(df_temp, os.path.join(OUTPUT_ROOT, f"{window_file('post_popularity', window)}.parquet"))
 
-        return df_res
\ No newline at end of file
+        return df_res
@@ -3,46 +3,62 @@ import os
 import pandas as pd
 
 from wemoms_homework.config import load_config
+from wemoms_homework.config import window_file
 from wemoms_homework.features.feature import Feature
+from wemoms_homework.schema import apply_schema
+from wemoms_homework.schema import write_parquet
+from wemoms_homework.features.window_counts import rolling_counts
+from wemoms_homework.features.window_counts import to_nanoseconds
 
 CONF = load_config()
 DATA_PATH = CONF["path"]["input_data_path"]
 OUTPUT_ROOT = CONF["path"]["interim_data_root"]
+WINDOWS = CONF["windows"]["user_post_popularity"]
+SPARSE = "user_post_popularity" in CONF["sparse_features"]
 
 
 class UserPostPopularity(Feature):
 
+    columns = ["event_id", "trackable_id", "user_id", "tracker_created_at", "has_been_opened"]
+    windows = WINDOWS
+
     @classmethod
-    def extract_feature(cls, df, save=False, windows=["1d", "7d", "28d"]):
-        """Compute the popularity of a post for each user using windows"""
+    def extract_feature(cls, df, save=False, windows=WINDOWS, sparse=SPARSE):
+        """Compute the popularity of a post for each user using windows
 
+        Most (post, user) pairs have one or two events, so the pair is hashed
+        into a single 64 bits key and all the pairs are processed as segments
+        of one sorted array instead of one rolling window per group. With
+        `sparse`, only the rows with a non-zero history are kept.
+        """
         logging.info("Computing the features UserPostPopularity")
 
-        def add_post_past_popularity(window):
-            logging.info(f"\tComputing user's past {window} popularity")
-            return (df[["tracker_created_at", "trackable_id", "user_id", "has_been_opened"]]
-              .set_index('tracker_created_at')
-              .sort_index()
-              .groupby(['trackable_id', "user_id"], sort=False)
-              .has_been_opened
-              .rolling(window, closed='left')
-              .agg({
-                  f"user_post_last_{window}_views_count": len,
-                  f"user_post_last_{window}_clicks_count": sum,
-                  f"user_post_last_{window}_ratio": lambda x: sum(x)/len(x)
-              })
-              .fillna(0)
-              .reset_index())
-         
-        df_res = pd.DataFrame()
+        df = cls.sort_events(df)
+        counts = rolling_counts(
+            keys=pd.util.hash_pandas_object(
+                df[["trackable_id", "user_id"]],
+                index=False
+            ).to_numpy(),
+            times=to_nanoseconds(df["tracker_created_at"]),
+            labels=df["has_been_opened"].to_numpy(),
+            windows=windows
+        )
+        ids = df[["event_id"]].reset_index(drop=True)
+
+        df_res = ids.copy()
         for window in windows:
-            df_temp = add_post_past_popularity(window)
-            df_res = pd.concat([df_res, df_temp], axis=0)
+            logging.info(f"\tComputing user's past {window} popularity")
+            views, clicks, ratio = counts[window]
+            df_temp = apply_schema(ids.assign(**{
+                f"user_post_last_{window}_views_count": views,
+                f"user_post_last_{window}_clicks_count": clicks,
+                f"user_post_last_{window}_ratio": ratio
+            }))
+            df_res = df_res.join(df_temp.drop(columns=ids.columns))
+            if sparse:
+                df_temp = df_temp[views > 0]
             if save:
                 os.makedirs(OUTPUT_ROOT, exist_ok=True)
-                df_temp.to_parquet(
-                    os.path.join(OUTPUT_ROOT, f"user_post_popularity_{window}.parquet"),
-                    index=False
-                )
+                write_parquet(df_temp, os.path.join(OUTPUT_ROOT, f"{window_file('user_post_popularity', window)}.parquet"))
 
         return df_res
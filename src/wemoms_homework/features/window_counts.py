@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+
+
+def to_nanoseconds(times):
+    """Timestamps (tz-aware or not) as int64 nanoseconds since epoch"""
+    times = pd.DatetimeIndex(times)
+    if times.tz is not None:
+        times = times.tz_convert("UTC").tz_localize(None)
+    return times.values.astype("datetime64[ns]").view("int64")
+
+
+def rolling_counts(keys, times, labels, windows):
+    """Count the past events and clicks of each key for several windows.
+
+    Same semantics as `groupby(key).rolling(window, closed='left')`: the
+    window of an event at `t` is `[t - window, t)`. Events are sorted once
+    by (key, time), the clicks are cumulated and every window only costs a
+    binary search for its lower bound.
+
+    Returns a dict `window -> (views, clicks, ratio)` aligned on the input.
+    """
+    keys = np.asarray(keys)
+    times = np.asarray(times, dtype="int64")
+    labels = np.asarray(labels, dtype="int64")
+
+    order = np.lexsort((times, keys))
+    keys, times, labels = keys[order], times[order], labels[order]
+
+    # Dense group id in sorted order and rank of the timestamps, combined in
+    # one sorted int64 so a search stays inside the group of the event
+    group = np.concatenate([[0], np.cumsum(keys[1:] != keys[:-1])]).astype("int64")
+    unique_times = np.unique(times)
+    base = group * (len(unique_times) + 1)
+    composite = base + np.searchsorted(unique_times, times, side="left")
+
+    clicks_cumsum = np.concatenate([[0], np.cumsum(labels)])
+
+    # closed='left': events at the same timestamp are excluded
+    end = np.searchsorted(composite, composite, side="left")
+
+    res = {}
+    for window in windows:
+        delta = pd.Timedelta(window).value
+        lower = base + np.searchsorted(unique_times, times - delta, side="left")
+        start = np.searchsorted(composite, lower, side="left")
+
+        views = (end - start).astype("float64")
+        clicks = (clicks_cumsum[end] - clicks_cumsum[start]).astype("float64")
+        ratio = np.divide(clicks, views, out=np.zeros_like(views), where=views > 0)
+        res[window] = tuple(unsort(order, values) for values in (views, clicks, ratio))
+
+    return res
+
+
+def unsort(order, values):
+    """Put back values computed on `x[order]` in the order of `x`"""
+    res = np.empty_like(values)
+    res[order] = values
+    return res
@@ -0,0 +1,189 @@
+import cProfile
+import contextlib
+import datetime
+import functools
+import json
+import logging
+import os
+import resource
+import time
+
+from wemoms_homework.config import load_config
+
+CONF = load_config()
+METRICS_PATH = CONF["instrumentation"]["metrics_path"]
+PROFILE_ROOT = CONF["instrumentation"]["profile_root"]
+
+# Measures running in this process, the innermost last
+_STACK = []
+
+# `active` is the pid of the process running a profiler, the workers forked
+# by a profiled stage profile their own stages
+_PROFILING = {"enabled": CONF["instrumentation"]["profile"], "active": None}
+
+
+def enable_profiling(enabled=True):
+    """Save a cProfile of each outermost stage in `PROFILE_ROOT`"""
+    _PROFILING["enabled"] = enabled
+
+
+def read_proc(name):
+    """`key: value` lines of /proc/self/<name> as a dict of ints (empty if
+    /proc is not available)"""
+    try:
+        with open(f"/proc/self/{name}", "r") as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return {}
+    res = {}
+    for line in lines:
+        key, _, value = line.partition(":")
+        value = value.split()
+        if value and value[0].isdigit():
+            res[key] = int(value[0])
+    return res
+
+
+def peak_rss_mb():
+    """Peak resident memory since the last reset (VmHWM), or of the whole
+    process if it cannot be reset"""
+    status = read_proc("status")
+    if "VmHWM" in status:
+        return status["VmHWM"] / 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def reset_peak_rss():
+    """Reset VmHWM to the current RSS (Linux only)"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+class Measure():
+    """Resources used by one stage. `rows_in` and `rows_out` can be set
+    while the stage runs"""
+
+    def __init__(self, stage, rows_in=None, **tags):
+        self.stage = stage
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.tags = tags
+        self.peak_rss_mb = 0.
+
+    def start(self):
+        # The peak of the enclosing stage so far must survive the reset
+        if _STACK:
+            _STACK[-1].peak_rss_mb = max(_STACK[-1].peak_rss_mb, peak_rss_mb())
+        reset_peak_rss()
+        self.started_at = datetime.datetime.now(datetime.timezone.utc)
+        self.io = read_proc("io")
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+
+    def stop(self, status):
+        wall = time.perf_counter() - self.wall
+        cpu = time.process_time() - self.cpu
+        io = read_proc("io")
+        self.peak_rss_mb = max(self.peak_rss_mb, peak_rss_mb())
+        if _STACK:
+            _STACK[-1].peak_rss_mb = max(_STACK[-1].peak_rss_mb, self.peak_rss_mb)
+
+        return {
+            "stage": self.stage,
+            "status": status,
+            "started_at": self.started_at.isoformat(),
+            "pid": os.getpid(),
+            "wall_seconds": round(wall, 6),
+            "cpu_seconds": round(cpu, 6),
+            "peak_rss_mb": round(self.peak_rss_mb, 1),
+            "rows_in": self.rows_in,
+            "rows_out": self.rows_out,
+            # Bytes through read/write calls, and to/from the disk
+            "read_bytes": io.get("rchar", 0) - self.io.get("rchar", 0) if io else None,
+            "written_bytes": io.get("wchar", 0) - self.io.get("wchar", 0) if io else None,
+            "disk_read_bytes": io.get("read_bytes", 0) - self.io.get("read_bytes", 0) if io else None,
+            "disk_written_bytes": io.get("write_bytes", 0) - self.io.get("write_bytes", 0) if io else None,
+            **self.tags
+        }
+
+
+def emit(record, path=METRICS_PATH):
+    """Append a metrics record as one JSON line"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    line = json.dumps(record, default=str) + "\n"
+    # One write per line in append mode, so the processes of a pool can
+    # share the file
+    with open(path, "a") as f:
+        f.write(line)
+
+
+@contextlib.contextmanager
+def measure(stage, rows_in=None, **tags):
+    """Measure the block and emit its metrics, even if it fails"""
+    current = Measure(stage, rows_in=rows_in, **tags)
+    profiler = None
+    if _PROFILING["enabled"] and _PROFILING["active"] != os.getpid():
+        profiler = cProfile.Profile()
+        _PROFILING["active"] = os.getpid()
+
+    current.start()
+    _STACK.append(current)
+    status = "error"
+    try:
+        if profiler is not None:
+            profiler.enable()
+        yield current
+        status = "ok"
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            _PROFILING["active"] = None
+        _STACK.pop()
+        record = current.stop(status)
+        if profiler is not None:
+            os.makedirs(PROFILE_ROOT, exist_ok=True)
+            record["profile"] = os.path.join(
+                PROFILE_ROOT,
+                f"{stage}-{current.started_at:%Y%m%dT%H%M%S}-{os.getpid()}.prof"
+            )
+            profiler.dump_stats(record["profile"])
+        emit(record)
+        logging.info(
+            f"{stage}: {record['wall_seconds']:.2f}s wall, "
+            f"{record['cpu_seconds']:.2f}s CPU, {record['peak_rss_mb']:.0f} MB peak"
+        )
+
+
+def instrument_command(name, command):
+    """Measure each invocation of a click command"""
+    if getattr(command, "instrumented", False):
+        return command
+    callback = command.callback
+
+    @functools.wraps(callback)
+    def wrapper(*args, **kwargs):
+        with measure(name, kind="command"):
+            return callback(*args, **kwargs)
+
+    command.callback = wrapper
+    command.instrumented = True
+    return command
+
+
+def instrument_feature(feature, extract_feature):
+    """Measure each call of `extract_feature` with its rows in and out"""
+
+    @functools.wraps(extract_feature)
+    def wrapper(cls, df, *args, **kwargs):
+        tags = {"kind": "feature", "feature": feature}
+        if kwargs.get("windows") is not None:
+            tags["windows"] = list(kwargs["windows"])
+        with measure(f"extract_feature.{feature}", rows_in=len(df), **tags) as current:
+            res = extract_feature(cls, df, *args, **kwargs)
+            current.rows_out = len(res) if res is not None else None
+            return res
+
+    return wrapper
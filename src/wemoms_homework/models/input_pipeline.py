@@ -0,0 +1,187 @@
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from wemoms_homework.config import load_config
+from wemoms_homework.feature_matrix import is_model_input
+from wemoms_homework.feature_matrix import to_float32
+
+CONF = load_config()
+BATCH_SIZE = CONF["model"]["batch_size"]
+SHUFFLE_BUFFER = CONF["model"]["shuffle_buffer"]
+SEED = CONF["dataset"]["seed"]
+
+# Rows read at once from the features file
+READ_ROWS = 65536
+
+# Batch size used to predict, the result does not depend on it
+PREDICT_BATCH_SIZE = 8192
+
+
+def numeric_columns(path, columns):
+    """Columns of the parquet file usable as model inputs (numbers and
+    booleans), in the order of `columns`"""
+    schema = pq.read_schema(path)
+    return [
+        c for c in columns
+        if c in schema.names and is_model_input(schema.field(c).type)
+    ]
+
+
+def moments(blocks, n_columns):
+    """Mean and variance of each column of a stream of matrices, merging
+    the moments of each block (Chan et al.) in float64"""
+    count = 0
+    mean = np.zeros(n_columns)
+    m2 = np.zeros(n_columns)
+    for X in blocks:
+        n = len(X)
+        if n == 0:
+            continue
+        block_mean = X.mean(axis=0, dtype="float64")
+        block_m2 = ((X - block_mean) ** 2).sum(axis=0)
+        delta = block_mean - mean
+        total = count + n
+        mean = mean + delta * n / total
+        m2 = m2 + block_m2 + delta ** 2 * count * n / total
+        count = total
+    return mean, m2 / max(count, 1)
+
+
+class EventBatches():
+    """Float32 batches of the features and labels of a dataset.
+
+    The features file is sorted by `event_id` and read lazily by record
+    batches of the selected columns and of the row groups of the dataset's
+    events. The rows of the events are kept and their labels found with a
+    binary search. The memory used only depends on the size of
+    the record batches and of the shuffle buffer, not on the size of the
+    features file.
+
+    With a `FeatureMatrix` of the same features, the rows are taken from
+    the memory map instead, without decoding the parquet file.
+    """
+
+    def __init__(self, path, columns, events, label="has_been_opened",
+                 batch_size=BATCH_SIZE, shuffle_buffer=0, seed=SEED, feature_matrix=None):
+        events = events.sort_values("event_id")
+        self.path = path
+        self.feature_matrix = feature_matrix
+        self.columns = list(columns)
+        self.event_ids = events["event_id"].to_numpy()
+        self.labels = events[label].astype("float32").to_numpy()
+        self.batch_size = batch_size
+        self.shuffle_buffer = shuffle_buffer
+        self.rng = np.random.default_rng(seed)
+
+    def row_groups(self, parquet_file):
+        """Row groups holding some of the dataset's events, from the min and
+        max `event_id` of each row group. The events of a date window are in
+        a few row groups, the others are never decoded"""
+        metadata = parquet_file.metadata
+        column = parquet_file.schema_arrow.get_field_index("event_id")
+        selected = []
+        for i in range(metadata.num_row_groups):
+            statistics = metadata.row_group(i).column(column).statistics
+            if statistics is None or not statistics.has_min_max:
+                selected.append(i)
+                continue
+            lower = np.searchsorted(self.event_ids, statistics.min, side="left")
+            upper = np.searchsorted(self.event_ids, statistics.max, side="right")
+            if lower < upper:
+                selected.append(i)
+        return selected
+
+    def blocks(self):
+        """Features and labels of the dataset's events of each record batch,
+        in `event_id` order"""
+        if self.feature_matrix is not None:
+            yield from self.matrix_blocks()
+            return
+
+        parquet_file = pq.ParquetFile(self.path)
+        n_found = 0
+        for batch in parquet_file.iter_batches(
+                batch_size=READ_ROWS,
+                row_groups=self.row_groups(parquet_file),
+                columns=["event_id"] + self.columns):
+            ids = batch.column(0).to_numpy()
+            positions = np.searchsorted(self.event_ids, ids)
+            found = positions < len(self.event_ids)
+            found[found] = self.event_ids[positions[found]] == ids[found]
+            if not found.any():
+                continue
+            n_found += found.sum()
+            yield to_float32(batch.filter(pa.array(found)), start=1), self.labels[positions[found]]
+
+        if n_found != len(self.event_ids):
+            raise ValueError(
+                f"{len(self.event_ids) - n_found} events have no features, rebuild the features"
+            )
+
+    def matrix_blocks(self):
+        """Same blocks as `blocks`, from the rows of the memory-mapped
+        matrix. The rows are sorted, so the pages are read in order"""
+        rows = self.feature_matrix.rows(self.event_ids)
+        columns = self.feature_matrix.column_indices(self.columns)
+        for start in range(0, len(rows), READ_ROWS):
+            yield (
+                self.feature_matrix.X[np.ix_(rows[start:start + READ_ROWS], columns)],
+                self.labels[start:start + READ_ROWS]
+            )
+
+    def __iter__(self):
+        buffer_X, buffer_y, n_rows = [], [], 0
+        for X, y in self.blocks():
+            buffer_X.append(X)
+            buffer_y.append(y)
+            n_rows += len(y)
+            if n_rows < max(self.shuffle_buffer, self.batch_size):
+                continue
+            X, y = self.shuffle(np.concatenate(buffer_X), np.concatenate(buffer_y))
+            n_full = len(y) // self.batch_size * self.batch_size
+            for start in range(0, n_full, self.batch_size):
+                yield X[start:start + self.batch_size], y[start:start + self.batch_size]
+            buffer_X, buffer_y, n_rows = [X[n_full:]], [y[n_full:]], len(y) - n_full
+
+        if n_rows:
+            X, y = self.shuffle(np.concatenate(buffer_X), np.concatenate(buffer_y))
+            for start in range(0, len(y), self.batch_size):
+                yield X[start:start + self.batch_size], y[start:start + self.batch_size]
+
+    def shuffle(self, X, y):
+        if not self.shuffle_buffer:
+            return X, y
+        order = self.rng.permutation(len(y))
+        return X[order], y[order]
+
+    def moments(self):
+        """Mean and variance of each column in one streaming pass"""
+        return moments((X for X, _ in self.blocks()), len(self.columns))
+
+    def matrix(self, X=None, y=None):
+        """All the features and labels as one float32 matrix and vector,
+        filled block by block without an intermediate copy. `X` and `y` can
+        be preallocated, e.g. in shared memory"""
+        if X is None:
+            X = np.empty((len(self.event_ids), len(self.columns)), dtype="float32")
+        if y is None:
+            y = np.empty(len(self.event_ids), dtype="float32")
+        n_rows = 0
+        for X_block, y_block in self.blocks():
+            X[n_rows:n_rows + len(y_block)] = X_block
+            y[n_rows:n_rows + len(y_block)] = y_block
+            n_rows += len(y_block)
+        return X, y
+
+    def to_dataset(self):
+        """`tf.data.Dataset` of the batches, prefetched in the background"""
+        import tensorflow as tf
+
+        return tf.data.Dataset.from_generator(
+            lambda: iter(self),
+            output_signature=(
+                tf.TensorSpec(shape=(None, len(self.columns)), dtype=tf.float32),
+                tf.TensorSpec(shape=(None,), dtype=tf.float32),
+            )
+        ).prefetch(tf.data.AUTOTUNE)
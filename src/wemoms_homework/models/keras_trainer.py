@@ -0,0 +1,132 @@
+import logging
+import os
+
+# Remove TensorFlow 2 Info/ Warning logs, before TensorFlow is imported
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
+
+import absl.logging  # noqa: E402
+import tensorflow as tf  # noqa: E402
+
+from tensorflow.keras import layers  # noqa: E402
+
+from wemoms_homework.config import load_config  # noqa: E402
+from wemoms_homework.models.linear_scorer import fold_normalization  # noqa: E402
+from wemoms_homework.models.metrics import ranking_metrics  # noqa: E402
+from wemoms_homework.models.trainer import Trainer  # noqa: E402
+
+CONF = load_config()
+EPOCH = CONF["model"]["epoch"]
+PATIENCE = CONF["model"]["early_stopping_patience"]
+MONITOR = CONF["model"]["early_stopping_monitor"]
+RANKING_KS = CONF["model"]["ranking_ks"]
+TENSORBOARD = CONF["model"]["tensorboard"]
+
+absl.logging.set_verbosity(absl.logging.ERROR)
+
+
+class RankingMetrics(tf.keras.callbacks.Callback):
+    """Add the ranking metrics of the validation set (`val_map@10`, ...) to
+    the logs of each epoch so the next callbacks can monitor them"""
+
+    def __init__(self, dataset, y, groups, ks=RANKING_KS):
+        super().__init__()
+        self.dataset = dataset
+        self.y = y
+        self.groups = groups
+        self.ks = ks
+
+    def on_epoch_end(self, epoch, logs=None):
+        scores = self.model.predict(self.dataset, verbose=0).ravel()
+        _, metrics = ranking_metrics(self.groups, scores, self.y, ks=self.ks)
+        if logs is not None:
+            logs.update({f"val_{name}": value for name, value in metrics.items()})
+
+
+class KerasTrainer(Trainer):
+    """Mini-batch Adam on a Normalization and a Dense layer, with early
+    stopping on the validation set and a TensorBoard"""
+
+    def __init__(self, feature_names, epochs=EPOCH, **kwargs):
+        super().__init__(feature_names, **kwargs)
+        self.epochs = epochs
+
+    def fit(self, train_batches, validation_batches, validation_groups):
+        logging.info("Computing the normalization statistics")
+        mean, variance = train_batches.moments()
+
+        # Define the model
+        # Normalize the numerical features
+        normalizer = tf.keras.layers.Normalization(axis=-1, mean=mean, variance=variance)
+
+        # Simple Logistic regression
+        self.model = tf.keras.Sequential([
+            normalizer,
+            layers.Dense(
+                units=1,
+                activation='sigmoid',
+                input_dim=len(self.feature_names)
+            )
+        ])
+        self.model.compile(
+            optimizer=tf.keras.optimizers.Adam(learning_rate=0.001),
+            loss="binary_crossentropy",
+        )
+
+        # Add callbacks to be able to restart if a process fail, to
+        # save the best model and to create a TensorBoard
+        callbacks = []
+
+        # First, so the other callbacks see the ranking metrics
+        callbacks.append(RankingMetrics(
+            validation_batches.to_dataset(),
+            validation_batches.labels,
+            validation_groups
+        ))
+        mode = "min" if MONITOR.endswith("loss") or MONITOR.endswith("rank") else "max"
+
+        os.makedirs(self.models_root, exist_ok=True)
+        os.makedirs(self.logs_root, exist_ok=True)
+        tensorboard = tf.keras.callbacks.TensorBoard(
+            log_dir=self.logs_root,
+            histogram_freq=TENSORBOARD["histogram_freq"],
+            write_graph=TENSORBOARD["write_graph"],
+            write_images=False,
+            update_freq=100,
+            profile_batch=TENSORBOARD["profile_batch"]
+        )
+        callbacks.append(tensorboard)
+
+        self.best_model_file = os.path.join(self.models_root, "best_model_so_far")
+        best_model_checkpoint = tf.keras.callbacks.ModelCheckpoint(
+            self.best_model_file,
+            monitor=MONITOR,
+            mode=mode,
+            verbose=1,
+            save_best_only=True
+        )
+        callbacks.append(best_model_checkpoint)
+
+        early_stopping = tf.keras.callbacks.EarlyStopping(
+            patience=PATIENCE,
+            monitor=MONITOR,
+            mode=mode
+        )
+        callbacks.append(early_stopping)
+
+        # Launch the train and save the loss evolution in `history`
+        self.history = self.model.fit(
+            train_batches.to_dataset(),
+            callbacks=callbacks,
+            epochs=self.epochs,
+            validation_data=validation_batches.to_dataset()
+        )
+        self.model.load_weights(self.best_model_file)
+        return self
+
+    def linear_weights(self):
+        return fold_normalization(self.model)
+
+    def save(self):
+        logging.info("Saving Model")
+        self.model.save(os.path.join(self.models_root, "final_model"))
+        super().save()
@@ -0,0 +1,99 @@
+import click
+import json
+import logging
+import os
+import numpy as np
+
+from wemoms_homework.config import load_config
+
+CONF = load_config()
+MODELS_ROOT = CONF["path"]["models_root"]
+
+LINEAR_MODEL_FILE = "linear_model.json"
+
+# Same value as `tf.keras.backend.epsilon()` used by the Normalization layer
+EPSILON = 1e-7
+
+
+def fold(mean, variance, kernel, bias):
+    """Fold a standardization into the weights of a linear model:
+    w.(x - mean)/std + b = (w/std).x + (b - w.mean/std)"""
+    # In float64: with a small variance the folded terms are large and
+    # cancel each other
+    mean = np.asarray(mean, dtype="float64").ravel()
+    std = np.maximum(np.sqrt(np.asarray(variance, dtype="float64").ravel()), EPSILON)
+    weights = np.asarray(kernel, dtype="float64").ravel() / std
+    return weights, float(np.asarray(bias).ravel()[0] - np.dot(weights, mean))
+
+
+def fold_normalization(model):
+    """Fold the Normalization layer into the Dense layer of the model"""
+    normalizer, dense = model.layers[0], model.layers[-1]
+    kernel, bias = dense.get_weights()
+    return fold(normalizer.mean, normalizer.variance, kernel, bias)
+
+
+def save_linear_model(feature_names, weights, bias, path):
+    """Save the weights of the raw features with their ordered names"""
+    with open(path, "w") as f:
+        json.dump({
+            "feature_names": list(feature_names),
+            "weights": np.asarray(weights, dtype="float64").tolist(),
+            "bias": float(bias)
+        }, f, indent=2)
+
+
+def export_linear_model(model, feature_names, path):
+    """Save the folded weights of a Keras model with the ordered names of
+    its inputs"""
+    weights, bias = fold_normalization(model)
+    save_linear_model(feature_names, weights, bias, path)
+
+
+class LinearScorer():
+    """Logistic regression scorer in pure NumPy"""
+
+    def __init__(self, feature_names, weights, bias):
+        self.feature_names = list(feature_names)
+        self.weights = np.asarray(weights, dtype="float64")
+        self.bias = float(bias)
+
+    @classmethod
+    def load(cls, models_root=MODELS_ROOT):
+        with open(os.path.join(models_root, LINEAR_MODEL_FILE), "r") as f:
+            return cls(**json.load(f))
+
+    def logits(self, X):
+        """X is a matrix whose columns follow `feature_names`"""
+        return np.asarray(X, dtype="float64") @ self.weights + self.bias
+
+    def predict(self, X):
+        return 1 / (1 + np.exp(-self.logits(X)))
+
+
+@click.group()
+def export():
+    pass
+
+
+@export.command()
+@click.option(
+    '--models-root',
+    type=str,
+    default=MODELS_ROOT,
+    help='Path of models folder, default is {}'.format(
+        MODELS_ROOT
+    )
+)
+def export_model(models_root):
+    """Export the saved Keras model to a NumPy scorer"""
+    # TensorFlow with its logs silenced
+    from wemoms_homework.models.keras_trainer import tf
+
+    model = tf.keras.models.load_model(os.path.join(models_root, "final_model"))
+    with open(os.path.join(models_root, "feature_names.json"), "r") as f:
+        feature_names = json.load(f)
+
+    path = os.path.join(models_root, LINEAR_MODEL_FILE)
+    logging.info(f"Exporting model to {path}")
+    export_linear_model(model, feature_names, path)
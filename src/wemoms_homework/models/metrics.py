@@ -0,0 +1,117 @@
+import numpy as np
+import pandas as pd
+
+
+def group_ids(df, keys):
+    """Integer id of the ranking group of each row"""
+    return df.groupby(keys, sort=False, observed=True).ngroup().to_numpy()
+
+
+def sort_groups(groups, scores):
+    """Sort the rows by group then by decreasing score, returns the order,
+    the start of each group in the sorted rows and the 1-based rank of each
+    sorted row in its group.
+
+    The rows of a group are usually contiguous (the candidates of an event),
+    they are then only sorted by score inside their group: one argsort of
+    the (groups, largest group) padded scores, O(n log(group size)). Groups
+    of very different sizes fall back to a full `np.lexsort`."""
+    groups = np.asarray(groups)
+    scores = np.asarray(scores, dtype="float64")
+    n = len(groups)
+
+    runs = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+    if np.all(groups[runs[1:]] > groups[runs[:-1]]):
+        by_group = np.arange(n)
+        starts = runs
+    else:
+        by_group = np.argsort(groups, kind="stable")
+        sorted_groups = groups[by_group]
+        starts = np.flatnonzero(np.r_[True, sorted_groups[1:] != sorted_groups[:-1]])
+
+    sizes = np.diff(np.r_[starts, n])
+    ranks = np.arange(n) - np.repeat(starts, sizes) + 1
+    if n == 0 or len(sizes) * sizes.max() > 2 * n:
+        order = np.lexsort((-scores, groups))
+        return order, starts, ranks
+
+    # The padding is NaN, sorted after the scores (NaN ones included, the
+    # sort is stable)
+    padded = np.full((len(sizes), sizes.max()), np.nan)
+    padded[np.repeat(np.arange(len(sizes)), sizes), ranks - 1] = -scores[by_group]
+    within = np.argsort(padded, axis=1, kind="stable")
+    in_group = np.arange(padded.shape[1]) < sizes[:, None]
+    order = by_group[(starts[:, None] + within)[in_group]]
+    return order, starts, ranks
+
+
+def rank_in_group(groups, scores):
+    """Rank of each row in its group (1 is the best score), in input order"""
+    order, _, ranks = sort_groups(groups, scores)
+    res = np.empty_like(ranks)
+    res[order] = ranks
+    return res
+
+
+def ranking_metrics(groups, scores, labels, ks=(10,)):
+    """MAP@K, NDCG@K, Recall@K for every K in `ks` and MRR of each group.
+
+    The rows are sorted once by group and score, then every metric is a
+    segment sum (`np.add.reduceat`) over the sorted rows. Groups without any
+    relevant row have NaN metrics and are left out of the aggregates.
+
+    Returns a DataFrame with one row per group and a dict of the means.
+    """
+    order, starts, ranks = sort_groups(groups, scores)
+    if len(order) == 0:
+        return pd.DataFrame(), {}
+    relevant = (np.asarray(labels)[order] > 0).astype("float64")
+
+    n_items = np.diff(np.r_[starts, len(order)])
+    n_relevant = np.add.reduceat(relevant, starts)
+    has_relevant = n_relevant > 0
+
+    # Number of relevant rows up to each rank, inside the group
+    cum_relevant = np.cumsum(relevant)
+    cum_relevant -= np.repeat(cum_relevant[starts] - relevant[starts], n_items)
+
+    discounts = 1 / np.log2(ranks + 1)
+    ideal_dcg = np.cumsum(1 / np.log2(np.arange(2, max(ks) + 2)))
+
+    metrics = {
+        "n_items": n_items,
+        "n_relevant": n_relevant,
+    }
+    for k in ks:
+        in_k = relevant * (ranks <= k)
+        hits = np.add.reduceat(in_k, starts)
+        n_ideal = np.minimum(n_relevant, k)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            metrics[f"map@{k}"] = np.where(
+                has_relevant,
+                np.add.reduceat(in_k * cum_relevant / ranks, starts) / n_ideal,
+                np.nan
+            )
+            metrics[f"ndcg@{k}"] = np.where(
+                has_relevant,
+                np.add.reduceat(in_k * discounts, starts)
+                / ideal_dcg[np.maximum(n_ideal, 1).astype("int64") - 1],
+                np.nan
+            )
+            metrics[f"recall@{k}"] = np.where(has_relevant, hits / n_relevant, np.nan)
+
+    first_relevant = np.minimum.reduceat(np.where(relevant > 0, ranks, np.inf), starts)
+    metrics["mrr"] = np.where(has_relevant, 1 / first_relevant, np.nan)
+
+    per_group_metrics = pd.DataFrame(
+        metrics,
+        index=pd.Index(np.asarray(groups)[order][starts], name="group")
+    )
+    aggregates = {
+        name: float(np.nanmean(values)) if has_relevant.any() else float("nan")
+        for name, values in metrics.items()
+        if name not in ("n_items", "n_relevant")
+    }
+    aggregates["mean_rank"] = float(ranks[relevant > 0].mean()) if has_relevant.any() else float("nan")
+
+    return per_group_metrics, aggregates
@@ -1,24 +1,21 @@
 import click
-import fastparquet
 import functools as ft
 import json
 import logging
 import os
 import pandas as pd
 
-from tensorflow.keras.models import load_model
-
-from wemoms_homework.features import USER_FEATURES
-from wemoms_homework.features import POST_FEATURES
-from wemoms_homework.features import USER_POST_FEATURES
-
 from wemoms_homework.config import load_config
-from wemoms_homework.utils import load_data
+from wemoms_homework.models.metrics import group_ids
+from wemoms_homework.models.metrics import rank_in_group
+from wemoms_homework.models.metrics import ranking_metrics
+from wemoms_homework.models.trainer import Trainer
+from wemoms_homework.utils import feature_columns
 from wemoms_homework.utils import load_datasets
-from wemoms_homework.utils import load_features
 
 from wemoms_homework.features.base_features import BaseFeatures
 from wemoms_homework.features.extra_features import ExtraFeatures
+from wemoms_homework.features.feature_store import FeatureStore
 from wemoms_homework.features.post_popularity import PostPopularity
 from wemoms_homework.features.user_post_popularity import UserPostPopularity
 
@@ -39,6 +36,8 @@ FEATURE_DICT = {
 FEATURE_DEFINITIONS = CONF["feature_definitions"]
 FEATURES = CONF["features"]
 
+RANKING_KS = CONF["model"]["ranking_ks"]
+
 
 @click.group()
 def predict():
@@ -84,86 +83,53 @@ def make_predictions(testset_path, models_root, output_root, features, evaluate=
 
     logging.info("Reading test data")
     _, _, X_test = load_datasets()
-    y_test = X_test.pop("has_been_opened")
-
-
-    logging.info("Create features")
-    data = load_features()
 
     # Select the feature to use based on the `features` param
-    features_names = [f
-        for feature_group in features
-        for f in FEATURE_DEFINITIONS[feature_group]
-        if FEATURE_DICT.get(feature_group)
-    ]
-
-    cols = []
-    for filename in features_names:
-        path = os.path.join(INTERIM_ROOT, f"{filename}.parquet")
-        cols += fastparquet.ParquetFile(path).columns
-
-    cols = set([c for c in cols if not c.startswith("__")])
-
-    # Merge the "user based" features
-    X_test = pd.merge_asof(
-        X_test.sort_values(by="tracker_created_at"),
-        data[["user_id", "tracker_created_at"] + USER_FEATURES].sort_values(by="tracker_created_at"),
-        on="tracker_created_at",
-        by="user_id",
-        direction="backward"
-    )
+    cols = feature_columns([g for g in features if FEATURE_DICT.get(g)])
 
-    # Merge the "post based" features
-    X_test = pd.merge_asof(
-        X_test.sort_values(by="tracker_created_at"),
-        data[["trackable_id", "tracker_created_at"] + POST_FEATURES].sort_values(by="tracker_created_at"),
-        on="tracker_created_at",
-        by="trackable_id",
-        direction="backward"
-    )
+    logging.info("Loading model")
+    scorer = Trainer.load(models_root)
 
-    # Merge the "user/post based" features
-    X_test = pd.merge_asof(
-        X_test.sort_values(by="tracker_created_at"),
-        data[["user_id", "trackable_id", "tracker_created_at"] + USER_POST_FEATURES].sort_values(by="tracker_created_at"),
-        on="tracker_created_at",
-        by=["user_id", "trackable_id"],
-        direction="backward"
-    )
+    # Features of the users, posts and user/post pairs as of each test event,
+    # only the model inputs are read from the feature store
+    X_test = X_test.reset_index(drop=True)
+    store = FeatureStore.load(columns=[c for c in cols if c in scorer.feature_names])
+    X_test = pd.concat([X_test, store.lookup(X_test)], axis=1)
+
+    y_test = X_test.pop("has_been_opened")
 
-    # Clean the dataset (bool to int, filter on numerical, fillna)
-    X_test = (X_test[cols]
+    # Clean the dataset (same inputs, in the same order, as the training,
+    # fillna), the booleans are already uint8
+    X_test = (X_test[["user_id", "trackable_id", "tracker_created_at"] + scorer.feature_names]
         .set_index(["user_id", "trackable_id", "tracker_created_at"])
-        .replace({False: 0, True: 1})
-        .select_dtypes(['number'])
         .fillna(0)
     )
 
-    logging.info("Loading model")
-    model = load_model(os.path.join(models_root, "final_model"))
-
     logging.info("Making predictions")
     raw_predictions = pd.DataFrame(
-        model.predict(X_test),
+        scorer.predict(X_test),
         index=X_test.index,
         columns=["predictions"]
     )
 
     # Add columns to compute the metrics (Mean Rank, MAP@10, etc.)
     X_test["predictions"] = raw_predictions
-    X_test["rank"] = (X_test
-        .groupby(["user_id", "tracker_created_at"])['predictions']
-        .rank(ascending=False)
-    )
     X_test["has_been_opened"] = y_test.values
 
-    # Print the mean rank
-    mean_rank = X_test.loc[X_test['has_been_opened'] == 1, ["has_been_opened", "predictions", "rank"]]["rank"].mean()
-    map_10 = 0
-    
-    logging.info(f"Mean Rank: {mean_rank}")
-    logging.info(f"MAP@10: {map_10}")
+    groups = group_ids(X_test.reset_index(), ["user_id", "tracker_created_at"])
+    X_test["rank"] = rank_in_group(groups, X_test["predictions"].values)
+    per_group_metrics, metrics = ranking_metrics(
+        groups,
+        X_test["predictions"].values,
+        X_test["has_been_opened"].values,
+        ks=RANKING_KS
+    )
+
+    # Print the metrics
+    for name, value in metrics.items():
+        logging.info(f"{name}: {value}")
 
     # Saving the predictions
     logging.info("Saving predictions")
     X_test.to_parquet(os.path.join(OUTPUT_ROOT, "raw_predictions.parquet"))
+    per_group_metrics.to_parquet(os.path.join(OUTPUT_ROOT, "ranking_metrics.parquet"))
@@ -0,0 +1,120 @@
+import click
+import logging
+import os
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from wemoms_homework.config import load_config
+from wemoms_homework.features.feature_store import FeatureStore
+from wemoms_homework.models.linear_scorer import LinearScorer
+from wemoms_homework.models.serve_model import Ranker
+from wemoms_homework.models.serve_model import default_date
+
+CONF = load_config()
+MODELS_ROOT = CONF["path"]["models_root"]
+OUTPUT_ROOT = CONF["path"]["output_data_root"]
+TOP_K = CONF["serving"]["top_k"]
+BLOCK_MB = CONF["serving"]["rank_block_mb"]
+COMPRESSION = CONF["parquet"]["compression"]
+
+SCHEMA = pa.schema([
+    ("user_id", pa.string()),
+    ("rank", pa.uint16()),
+    ("trackable_id", pa.string()),
+    ("score", pa.float32()),
+])
+
+# Bytes per candidate of a user in a block: the logits, their negation and
+# the indices of `argpartition`, or the logits, the children age features of
+# the pairs and their weighted sum
+BYTES_PER_CANDIDATE = 32
+
+
+def block_size(n_candidates, block_mb=BLOCK_MB):
+    """Number of users scored at once so a block uses about `block_mb`"""
+    return max(1, int(block_mb * 2 ** 20) // max(1, n_candidates * BYTES_PER_CANDIDATE))
+
+
+def write_top_k(ranker, user_ids, path, users_per_block):
+    """Rank the users by blocks and stream the top k rows of each block to
+    `path`, the scores of all the candidates are never kept"""
+    n_rows = 0
+    with pq.ParquetWriter(path, SCHEMA, compression=COMPRESSION) as writer:
+        for start in range(0, len(user_ids), users_per_block):
+            block = user_ids[start:start + users_per_block]
+            top, scores = ranker.top_posts(block)
+            k = top.shape[1]
+            writer.write_table(pa.table({
+                "user_id": pa.array(np.repeat(block, k), type=pa.string()),
+                "rank": pa.array(np.tile(np.arange(1, k + 1, dtype="uint16"), len(block))),
+                "trackable_id": pa.array(ranker.post_ids[top.ravel()].astype(str), type=pa.string()),
+                "score": pa.array(scores.ravel().astype("float32")),
+            }, schema=SCHEMA))
+            n_rows += top.size
+    return n_rows
+
+
+@click.group()
+def ranking():
+    pass
+
+
+@ranking.command()
+@click.option(
+    '--models-root',
+    type=str,
+    default=MODELS_ROOT,
+    help='Path of models folder, default is {}'.format(
+        MODELS_ROOT
+    )
+)
+@click.option(
+    '--output-path',
+    type=str,
+    default=os.path.join(OUTPUT_ROOT, "top_k.parquet"),
+    help='Path of the top k posts of each user, default is {}'.format(
+        os.path.join(OUTPUT_ROOT, "top_k.parquet")
+    )
+)
+@click.option(
+    '--date',
+    type=click.DateTime(formats=["%Y-%m-%d"]),
+    default=None,
+    help='Day of the ranking, the candidates are the posts of the day before. '
+         'Default is the day after the last event'
+)
+@click.option(
+    '--top-k',
+    type=click.IntRange(min=1),
+    default=TOP_K,
+    help='Number of posts kept per user, default is {}'.format(
+        TOP_K
+    )
+)
+@click.option(
+    '--block-mb',
+    type=click.FloatRange(min=0, min_open=True),
+    default=BLOCK_MB,
+    help='Memory of the scores of a block of users, default is {}'.format(
+        BLOCK_MB
+    )
+)
+def rank_users(models_root, output_path, date, top_k, block_mb):
+    """Write the top k of yesterday's posts of every known user"""
+    logging.info("Loading model")
+    scorer = LinearScorer.load(models_root)
+
+    logging.info("Loading the feature store")
+    store = FeatureStore.load()
+    if date is None:
+        date = default_date(store)
+
+    ranker = Ranker(store, scorer, date, top_k=top_k)
+    user_ids = np.asarray(ranker.user_index)
+    users_per_block = block_size(len(ranker.post_ids), block_mb)
+
+    logging.info(f"Ranking {len(user_ids)} users by blocks of {users_per_block}")
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    n_rows = write_top_k(ranker, user_ids, output_path, users_per_block)
+    logging.info(f"Saved {n_rows} rows to {output_path}")
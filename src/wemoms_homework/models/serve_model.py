@@ -0,0 +1,404 @@
+import asyncio
+import click
+import json
+import logging
+import os
+import numpy as np
+import pandas as pd
+
+from urllib.parse import parse_qs
+from urllib.parse import urlparse
+
+from wemoms_homework.features import USER_FEATURES
+from wemoms_homework.features import USER_AUTHOR_FEATURES
+from wemoms_homework.features import USER_POST_FEATURES
+from wemoms_homework.features import popularity_columns
+
+from wemoms_homework.config import load_config
+from wemoms_homework.features.age_bitmask import AUTHOR_AGE_COLUMNS
+from wemoms_homework.features.age_bitmask import USER_AGE_COLUMNS
+from wemoms_homework.features.age_bitmask import age_match_features
+from wemoms_homework.features.feature_store import FeatureStore
+from wemoms_homework.features.feature_store import post_age_at
+from wemoms_homework.features.popularity_counters import PopularityCounters
+from wemoms_homework.models.linear_scorer import LinearScorer
+
+CONF = load_config()
+MODELS_ROOT = CONF["path"]["models_root"]
+
+HOST = CONF["serving"]["host"]
+PORT = CONF["serving"]["port"]
+TOP_K = CONF["serving"]["top_k"]
+MAX_BATCH_SIZE = CONF["serving"]["max_batch_size"]
+BATCH_WAIT_MS = CONF["serving"]["batch_wait_ms"]
+SNAPSHOT_SECONDS = CONF["streaming"]["snapshot_seconds"]
+STATE_PATH = CONF["streaming"]["state_path"]
+
+def clean(df, columns):
+    """Same cleaning as the training: fillna"""
+    return (df[columns]
+        .apply(pd.to_numeric, errors="coerce")
+        .fillna(0)
+        .to_numpy(dtype="float64"))
+
+
+class Ranker():
+    """Rank yesterday's posts for a user with a `LinearScorer`.
+
+    The logit of a (user, post) pair is the sum of a user part, a post part
+    and a pair part. The post parts of all the candidates are computed once
+    with a matrix-vector product, the user parts once per known user, and
+    the user/post parts are only stored for the pairs with a history.
+    Ranking a batch of users is then a broadcast sum and a partial sort.
+
+    The terms which change with the pair or the time of the request are
+    computed for each batch: the age of the posts at that time and the
+    features matching the children ages of the user and of the author.
+    With the `PopularityCounters` of `stream-popularity`, the popularity
+    features of the posts are also the ones at the time of the request.
+    """
+
+    def __init__(self, store, scorer, day, top_k=TOP_K, counters=None):
+        self.top_k = top_k
+        self.counters = counters
+        feature_names = scorer.feature_names
+        weights = pd.Series(scorer.weights, index=feature_names)
+        bias = scorer.bias
+        user_cols = [c for c in feature_names if c in USER_FEATURES]
+        user_post_cols = [c for c in feature_names if c in USER_POST_FEATURES]
+        user_author_cols = [c for c in feature_names if c in USER_AUTHOR_FEATURES]
+        popularity_cols = [
+            c for c in feature_names
+            if counters is not None and c in popularity_columns("post", counters.windows)
+        ]
+        post_cols = [
+            c for c in feature_names
+            if c not in user_cols + user_post_cols + user_author_cols + popularity_cols + ["post_age_in_minutes"]
+        ]
+
+        self.day = pd.Timestamp(day, tz="UTC")
+
+        # Candidates: the posts created yesterday, with their last features
+        posts = store.entities["post"].latest(self.day)
+        post_creation_day = (
+            posts.tracker_created_at
+            - pd.to_timedelta(posts.post_age_in_minutes, unit="m")
+        ).dt.normalize()
+        posts = posts[post_creation_day == self.day - pd.Timedelta(days=1)]
+        self.post_ids = np.asarray(posts.trackable_id)
+        self.post_logits = clean(posts, post_cols) @ weights[post_cols].to_numpy() + bias
+
+        # Age of the posts at their snapshot, moved to the time of a request
+        self.age_weight = weights.get("post_age_in_minutes", 0.0)
+        self.post_ages = posts.post_age_in_minutes.to_numpy(dtype="float64")
+        self.post_times = pd.DatetimeIndex(posts.tracker_created_at)
+        self.popularity_weights = weights[popularity_cols]
+
+        # User part of the logit for every known user
+        users = store.entities["user"].latest(self.day)
+        self.user_index = pd.Index(np.asarray(users.user_id))
+        self.user_logits = clean(users, user_cols) @ weights[user_cols].to_numpy()
+
+        # Children ages of the users (one row each) and of the authors of
+        # the candidates (one column each), matched by batch of users
+        self.user_author_weights = weights[user_author_cols]
+        self.user_ages = {c: users[c].to_numpy() for c in USER_AGE_COLUMNS if c in users.columns}
+        self.author_ages = {c: posts[c].to_numpy()[None, :] for c in AUTHOR_AGE_COLUMNS if c in posts.columns}
+
+        # User/post part for the pairs with a history on the candidates
+        pairs = store.entities["user_post"].latest(self.day)
+        pairs = pairs[pairs.trackable_id.isin(self.post_ids)]
+        pair_logits = clean(pairs, user_post_cols) @ weights[user_post_cols].to_numpy()
+        pairs = pd.DataFrame({
+            "user": self.user_index.get_indexer(np.asarray(pairs.user_id)),
+            "post": pd.Index(self.post_ids).get_indexer(np.asarray(pairs.trackable_id)),
+            "logit": pair_logits
+        }).query("logit != 0").sort_values("user", kind="stable")
+        self.pair_offsets = np.searchsorted(pairs.user.to_numpy(), np.arange(len(self.user_index) + 1))
+        self.pair_posts = pairs.post.to_numpy()
+        self.pair_logits = pairs.logit.to_numpy()
+
+        logging.info(
+            f"Ranking {len(self.post_ids)} candidates for {len(self.user_index)} users "
+            f"({len(self.pair_posts)} user/post histories)"
+        )
+
+    def request_time(self, time=None):
+        """Time of a request within the ranked day, its start by default"""
+        if time is None:
+            return self.day
+        return min(max(pd.Timestamp(time), self.day), self.day + pd.Timedelta(days=1))
+
+    def top_posts(self, user_ids, time=None):
+        """Positions in `post_ids` and scores of the top k posts of each
+        user at `time` (see `request_time`), best first, as two (users, k)
+        arrays. All the candidates of the users are scored at once, as a
+        matrix"""
+        users = self.user_index.get_indexer(user_ids)
+        known = users >= 0
+
+        # Unknown users have all their user features at 0, only the known
+        # ones are looked up (there may be no known user at all)
+        user_logits = np.zeros(len(users))
+        user_logits[known] = self.user_logits[users[known]]
+        times = pd.DatetimeIndex([self.request_time(time)]).repeat(len(self.post_ids))
+        post_logits = self.post_logits + self.age_weight * post_age_at(self.post_ages, self.post_times, times)
+        if len(self.popularity_weights):
+            popularity = self.counters.features(self.post_ids.astype(str), times)
+            post_logits = post_logits + (
+                popularity[self.popularity_weights.index].to_numpy(dtype="float64")
+                @ self.popularity_weights.to_numpy()
+            )
+        logits = user_logits[:, None] + post_logits[None, :]
+
+        if len(self.user_author_weights) and known.any():
+            user_ages = {c: values[users[known]][:, None] for c, values in self.user_ages.items()}
+            features = age_match_features(user_ages, self.author_ages)
+            for name, weight in self.user_author_weights.items():
+                logits[known] += weight * features[name]
+
+        for row in np.flatnonzero(known):
+            start, end = self.pair_offsets[users[row]], self.pair_offsets[users[row] + 1]
+            logits[row, self.pair_posts[start:end]] += self.pair_logits[start:end]
+
+        k = min(self.top_k, logits.shape[1])
+        if k == 0:
+            return np.empty((len(users), 0), dtype="int64"), np.empty((len(users), 0))
+        top = np.argpartition(-logits, k - 1, axis=1)[:, :k]
+        top_logits = np.take_along_axis(logits, top, axis=1)
+        order = np.argsort(-top_logits, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        scores = 1 / (1 + np.exp(-np.take_along_axis(top_logits, order, axis=1)))
+        return top, scores
+
+    def rank(self, user_ids, time=None):
+        """Top k posts and scores of each user, in one scoring call"""
+        top, scores = self.top_posts(user_ids, time)
+        return [
+            [
+                {"trackable_id": str(post_id), "score": float(score)}
+                for post_id, score in zip(self.post_ids[posts], user_scores)
+            ]
+            for posts, user_scores in zip(top, scores)
+        ]
+
+
+def default_date(store):
+    """The day after the last event of the feature store"""
+    last_event = pd.Timestamp(store.entities["user"].unique_times[-1])
+    return last_event.normalize() + pd.Timedelta(days=1)
+
+
+class MicroBatcher():
+    """Group the concurrent requests into one call to `Ranker.rank`"""
+
+    def __init__(self, ranker, max_batch_size=MAX_BATCH_SIZE, batch_wait_ms=BATCH_WAIT_MS):
+        self.ranker = ranker
+        self.max_batch_size = max_batch_size
+        self.batch_wait = batch_wait_ms / 1000
+        self.queue = asyncio.Queue()
+
+    async def rank(self, user_id):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((user_id, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.batch_wait
+            while len(batch) < self.max_batch_size:
+                if not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                results = self.ranker.rank(
+                    [user_id for user_id, _ in batch],
+                    pd.Timestamp.now(tz="UTC")
+                )
+            except Exception as exc:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(exc)
+                continue
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+
+def http_response(status, body):
+    payload = json.dumps(body).encode()
+    return (
+        f"HTTP/1.1 {status}\r\n"
+        "Content-Type: application/json\r\n"
+        f"Content-Length: {len(payload)}\r\n"
+        "\r\n"
+    ).encode() + payload
+
+
+def make_handler(batcher):
+    """Minimal HTTP/1.1 handler with keep-alive:
+    `GET /rank?user_id=...` and `GET /health`"""
+
+    async def handle(reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                try:
+                    method, target, _ = request_line.decode("latin-1").split(" ", 2)
+                except ValueError:
+                    writer.write(http_response("400 Bad Request", {"error": "bad request"}))
+                    break
+                url = urlparse(target)
+                user_id = parse_qs(url.query).get("user_id", [None])[0]
+
+                if method != "GET":
+                    response = http_response("405 Method Not Allowed", {"error": "only GET"})
+                elif url.path == "/health":
+                    response = http_response("200 OK", {"status": "ok"})
+                elif url.path == "/rank" and user_id:
+                    try:
+                        posts = await batcher.rank(user_id)
+                        response = http_response("200 OK", {"user_id": user_id, "posts": posts})
+                    except Exception:
+                        logging.exception(f"Ranking failed for user {user_id}")
+                        response = http_response("500 Internal Server Error", {"error": "ranking failed"})
+                elif url.path == "/rank":
+                    response = http_response("400 Bad Request", {"error": "missing user_id"})
+                else:
+                    response = http_response("404 Not Found", {"error": "not found"})
+
+                writer.write(response)
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    return handle
+
+
+async def reload_counters(ranker, path, seconds=SNAPSHOT_SECONDS):
+    """Use each new snapshot of the popularity counters"""
+    mtime = os.stat(path).st_mtime_ns
+    while True:
+        await asyncio.sleep(seconds)
+        new_mtime = os.stat(path).st_mtime_ns
+        if new_mtime != mtime:
+            ranker.counters = PopularityCounters.load(path)
+            mtime = new_mtime
+            logging.info(f"Reloaded the popularity counters of {path}")
+
+
+async def serve(ranker, host, port, socket_path, popularity_state=None):
+    batcher = MicroBatcher(ranker)
+    batcher_task = asyncio.create_task(batcher.run())
+    if popularity_state:
+        reload_task = asyncio.create_task(reload_counters(ranker, popularity_state))
+    handler = make_handler(batcher)
+    if socket_path:
+        server = await asyncio.start_unix_server(handler, path=socket_path)
+        logging.info(f"Serving on {socket_path}")
+    else:
+        server = await asyncio.start_server(handler, host=host, port=port)
+        logging.info(f"Serving on http://{host}:{port}")
+    async with server:
+        try:
+            await server.serve_forever()
+        finally:
+            batcher_task.cancel()
+            if popularity_state:
+                reload_task.cancel()
+
+
+@click.group()
+def server():
+    pass
+
+
+@server.command()
+@click.option(
+    '--models-root',
+    type=str,
+    default=MODELS_ROOT,
+    help='Path of models folder, default is {}'.format(
+        MODELS_ROOT
+    )
+)
+@click.option(
+    '--host',
+    type=str,
+    default=HOST,
+    help='Host to listen on, default is {}'.format(
+        HOST
+    )
+)
+@click.option(
+    '--port',
+    type=int,
+    default=PORT,
+    help='Port to listen on, default is {}'.format(
+        PORT
+    )
+)
+@click.option(
+    '--socket',
+    'socket_path',
+    type=str,
+    default=None,
+    help='Listen on this Unix socket instead of host/port'
+)
+@click.option(
+    '--date',
+    type=click.DateTime(formats=["%Y-%m-%d"]),
+    default=None,
+    help='Day of the requests, the candidates are the posts of the day before. '
+         'Default is the day after the last event'
+)
+@click.option(
+    '--popularity-state',
+    type=str,
+    default=None,
+    help='Snapshot of the counters of stream-popularity (e.g. {}), the post '
+         'popularity features are then counted at the time of each request'.format(
+        STATE_PATH
+    )
+)
+def serve_model(models_root, host, port, socket_path, date, popularity_state):
+    """Serve the top 10 of yesterday's posts for a user over HTTP"""
+    logging.info("Loading model")
+    scorer = LinearScorer.load(models_root)
+
+    logging.info("Loading the feature store")
+    store = FeatureStore.load()
+    if date is None:
+        date = default_date(store)
+
+    counters = None
+    if popularity_state:
+        logging.info("Loading the popularity counters")
+        counters = PopularityCounters.load(popularity_state)
+
+    ranker = Ranker(store, scorer, date, counters=counters)
+    asyncio.run(serve(ranker, host, port, socket_path, popularity_state))
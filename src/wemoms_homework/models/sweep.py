@@ -0,0 +1,256 @@
+import click
+import itertools
+import logging
+import os
+import numpy as np
+import pandas as pd
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+
+from wemoms_homework.config import load_config
+from wemoms_homework.feature_matrix import FeatureMatrix
+from wemoms_homework.models.input_pipeline import moments
+from wemoms_homework.models.linear_scorer import EPSILON
+from wemoms_homework.models.metrics import ranking_metrics
+from wemoms_homework.models.train_model import load_batches
+from wemoms_homework.models.trainer import CHUNK_ROWS
+from wemoms_homework.models.trainer import MAX_ITER
+from wemoms_homework.models.trainer import RANKING_KS
+from wemoms_homework.models.trainer import fit_logistic
+from wemoms_homework.models.trainer import log_loss
+from wemoms_homework.models.trainer import read_block
+from wemoms_homework.models.trainer import standardize
+from wemoms_homework.utils import feature_columns
+
+CONF = load_config()
+OUTPUT_ROOT = CONF["path"]["output_data_root"]
+LOGS_ROOT = CONF["path"]["logs_root"]
+FEATURE_DEFINITIONS = CONF["feature_definitions"]
+JOBS = CONF["sweep"]["jobs"]
+L2_VALUES = CONF["sweep"]["l2"]
+
+# Arrays of the sweep attached by each worker: name -> (block, ndarray)
+_SHARED = {}
+
+
+def to_shared(shape, dtype):
+    """Array in a new shared memory block, with the block to release"""
+    dtype = np.dtype(dtype)
+    block = SharedMemory(create=True, size=max(1, int(np.prod(shape)) * dtype.itemsize))
+    return np.ndarray(shape, dtype=dtype, buffer=block.buf), block
+
+
+def attach(specs, matrix_root=None):
+    """Pool initializer: map the shared arrays of the parent and the
+    feature matrix of `matrix_root`, no copy"""
+    for name, (block_name, shape, dtype) in specs.items():
+        block = SharedMemory(name=block_name)
+        _SHARED[name] = (block, np.ndarray(shape, dtype=dtype, buffer=block.buf))
+    if matrix_root is not None:
+        _SHARED["matrix"] = (None, FeatureMatrix.open(matrix_root).X)
+
+
+def configurations(subsets, l2_values):
+    """Every (feature groups, l2) pair. Without subsets, all the groups and
+    each group left out once (ablation)"""
+    groups = list(FEATURE_DEFINITIONS)
+    if not subsets:
+        subsets = [groups] + [
+            [g for g in groups if g != left_out]
+            for left_out in groups
+        ]
+    return list(itertools.product([tuple(s) for s in subsets], l2_values))
+
+
+def fit_configuration(groups, columns, l2, max_iter=MAX_ITER, scale=None):
+    """Fit one configuration and evaluate it on the validation set. The
+    rows `train_rows` and `validation_rows` of the memory-mapped feature
+    matrix are standardized by chunk with `scale`, without a feature
+    matrix the shared matrices are already standardized"""
+    if "matrix" in _SHARED:
+        X_train = X_validation = _SHARED["matrix"][1]
+        train_rows = _SHARED["train_rows"][1]
+        validation_rows = _SHARED["validation_rows"][1]
+    else:
+        X_train = _SHARED["X_train"][1]
+        X_validation = _SHARED["X_validation"][1]
+        train_rows = validation_rows = None
+    y_train = _SHARED["y_train"][1]
+    y_validation = _SHARED["y_validation"][1]
+    validation_groups = _SHARED["validation_groups"][1]
+
+    # The selected columns are read by chunks, never copied whole
+    weights, bias, result = fit_logistic(
+        X_train,
+        y_train,
+        l2=l2,
+        max_iter=max_iter,
+        rows=train_rows,
+        columns=columns,
+        scale=scale
+    )
+    logits = np.empty(len(y_validation))
+    for start in range(0, len(logits), CHUNK_ROWS):
+        block = read_block(X_validation, start, validation_rows, columns, scale)
+        logits[start:start + CHUNK_ROWS] = block.astype("float64") @ weights + bias
+
+    _, metrics = ranking_metrics(validation_groups, logits, y_validation, ks=RANKING_KS)
+    return {
+        "features": "+".join(groups),
+        "n_features": len(columns),
+        "l2": l2,
+        "iterations": result.nit,
+        "train_loss": result.fun,
+        "val_loss": log_loss(logits, y_validation),
+        **{f"val_{name}": value for name, value in metrics.items()},
+    }
+
+
+@click.group()
+def sweeps():
+    pass
+
+
+@sweeps.command()
+@click.option(
+    '--output-root',
+    type=str,
+    default=OUTPUT_ROOT,
+    help='Path of output folder, default is {}'.format(
+        OUTPUT_ROOT
+    )
+)
+@click.option(
+    '--groups',
+    'subsets',
+    type=str,
+    multiple=True,
+    help='Comma separated feature groups of one configuration, can be repeated. '
+         'Default is all the groups and each group left out once'
+)
+@click.option(
+    '--l2',
+    'l2_values',
+    type=float,
+    multiple=True,
+    default=L2_VALUES,
+    help='L2 penalties, default is {}'.format(
+        L2_VALUES
+    )
+)
+@click.option(
+    '--jobs',
+    type=click.IntRange(min=1),
+    default=JOBS,
+    help='Number of processes fitting the configurations, default is {}'.format(
+        JOBS
+    )
+)
+@click.option(
+    '--output-path',
+    type=str,
+    default=os.path.join(LOGS_ROOT, "sweep.csv"),
+    help='Path of the results table, default is {}'.format(
+        os.path.join(LOGS_ROOT, "sweep.csv")
+    )
+)
+def sweep(output_root, subsets, l2_values, jobs, output_path):
+    """Train many feature sets and L2 penalties on data loaded once"""
+    subsets = [[g.strip() for g in subset.split(",")] for subset in subsets]
+    for group in {g for subset in subsets for g in subset}:
+        if group not in FEATURE_DEFINITIONS:
+            raise click.BadParameter(f"Unknown feature group {group}", param_hint="--groups")
+    configs = configurations(subsets, l2_values)
+
+    # Load every model input once, the configurations select their columns
+    cols, train_batches, validation_batches, validation_groups = load_batches(
+        list(FEATURE_DEFINITIONS), output_root
+    )
+    group_columns = {
+        group: [i for i, c in enumerate(cols) if c in set(feature_columns([group]))]
+        for group in FEATURE_DEFINITIONS
+    }
+
+    # A fresh feature matrix is mapped by every worker, its pages are shared
+    # in the page cache. Else the standardized matrices are loaded once in
+    # shared memory
+    matrix = train_batches.feature_matrix
+    n_train, n_validation = len(train_batches.event_ids), len(validation_batches.event_ids)
+    arrays = [
+        ("y_train", (n_train,), "float32"),
+        ("y_validation", (n_validation,), "float32"),
+        ("validation_groups", (n_validation,), "int64"),
+    ]
+    if matrix is not None:
+        arrays += [("train_rows", (n_train,), "int64"), ("validation_rows", (n_validation,), "int64")]
+    else:
+        arrays += [("X_train", (n_train, len(cols)), "float32"), ("X_validation", (n_validation, len(cols)), "float32")]
+
+    blocks = []
+    try:
+        shared = {}
+        for name, shape, dtype in arrays:
+            shared[name], block = to_shared(shape, dtype)
+            blocks.append((name, block, shape, np.dtype(dtype).str))
+        shared["validation_groups"][:] = validation_groups
+
+        if matrix is not None:
+            logging.info(f"Reading {n_train} train and {n_validation} validation rows from the feature matrix")
+            shared["train_rows"][:] = matrix.rows(train_batches.event_ids)
+            shared["validation_rows"][:] = matrix.rows(validation_batches.event_ids)
+            shared["y_train"][:] = train_batches.labels
+            shared["y_validation"][:] = validation_batches.labels
+
+            # Statistics of the trainset, each configuration standardizes
+            # its columns by chunk
+            mean, variance = train_batches.moments()
+            std = np.maximum(np.sqrt(variance), EPSILON)
+            matrix_columns = np.asarray(matrix.column_indices(cols))
+        else:
+            logging.info(f"Loading {n_train} train and {n_validation} validation rows in shared memory")
+            train_batches.matrix(shared["X_train"], shared["y_train"])
+            validation_batches.matrix(shared["X_validation"], shared["y_validation"])
+
+            # Standardized once with the statistics of the trainset, the
+            # statistics of a column do not depend on the other columns
+            X_train = shared["X_train"]
+            mean, variance = moments(
+                (X_train[start:start + CHUNK_ROWS] for start in range(0, len(X_train), CHUNK_ROWS)),
+                len(cols)
+            )
+            standardize(X_train, mean, variance)
+            standardize(shared["X_validation"], mean, variance)
+
+        tasks = []
+        for groups, l2 in configs:
+            columns = sorted(i for g in groups for i in group_columns[g])
+            if matrix is None:
+                tasks.append((groups, columns, l2))
+            else:
+                scale = (mean[columns].astype("float32"), std[columns].astype("float32"))
+                tasks.append((groups, matrix_columns[columns], l2, MAX_ITER, scale))
+
+        specs = {name: (block.name, shape, dtype) for name, block, shape, dtype in blocks}
+        matrix_root = os.path.dirname(train_batches.path) if matrix is not None else None
+        logging.info(f"Fitting {len(configs)} configurations with {jobs} processes")
+        with ProcessPoolExecutor(max_workers=jobs, initializer=attach, initargs=(specs, matrix_root)) as executor:
+            futures = [executor.submit(fit_configuration, *task) for task in tasks]
+            results = []
+            for future in futures:
+                results.append(future.result())
+                logging.info(
+                    f"\t{results[-1]['features']} l2={results[-1]['l2']}: "
+                    f"val_loss {results[-1]['val_loss']:.5f}"
+                )
+    finally:
+        for _, block, _, _ in blocks:
+            block.close()
+            block.unlink()
+
+    table = pd.DataFrame(results).sort_values("val_loss", ignore_index=True)
+    with pd.option_context("display.width", 200, "display.max_columns", None):
+        logging.info("\n" + table.to_string())
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    table.to_csv(output_path, index=False)
+    logging.info(f"Results saved to {output_path}")
@@ -1,17 +1,19 @@
 import click
-import fastparquet
-import json
 import logging
 import os
-import pandas as pd
-import tensorflow as tf
-
-from tensorflow import keras
-from tensorflow.keras import layers
 
 from wemoms_homework.config import load_config
+from wemoms_homework.feature_matrix import open_feature_matrix
+from wemoms_homework.models.input_pipeline import EventBatches
+from wemoms_homework.models.input_pipeline import PREDICT_BATCH_SIZE
+from wemoms_homework.models.input_pipeline import SHUFFLE_BUFFER
+from wemoms_homework.models.input_pipeline import numeric_columns
+from wemoms_homework.models.metrics import group_ids
+from wemoms_homework.models.trainer import TRAINER
+from wemoms_homework.models.trainer import TRAINERS
+from wemoms_homework.models.trainer import get_trainer
+from wemoms_homework.utils import feature_columns
 from wemoms_homework.utils import load_datasets
-from wemoms_homework.utils import load_features
 
 from wemoms_homework.features.base_features import BaseFeatures
 from wemoms_homework.features.extra_features import ExtraFeatures
@@ -34,8 +36,44 @@ FEATURE_DICT = {
 
 FEATURE_DEFINITIONS = CONF["feature_definitions"]
 
-EPOCH = CONF["model"]["epoch"]
-PATIENCE = CONF["model"]["early_stopping_patience"]
+
+def load_batches(features, output_root=OUTPUT_ROOT):
+    """Model inputs of the feature groups `features`, `EventBatches` of the
+    train and validation events and the ranking groups of the validation
+    set"""
+    X_train, X_validation, _ = load_datasets()
+
+    # The batches are read in `event_id` order, the validation labels and
+    # groups must follow it
+    X_validation = X_validation.sort_values("event_id").reset_index(drop=True)
+
+    # The validation set has no synthetic candidates, rank the posts seen
+    # by a user during a day
+    validation_groups = group_ids(
+        X_validation.assign(day=X_validation.tracker_created_at.dt.normalize()),
+        ["user_id", "day"]
+    )
+
+    # Select the features base on the `features` parameter
+    # Sorted so the order of the model inputs is the same in every process
+    cols = feature_columns([g for g in features if FEATURE_DICT.get(g)])
+
+    # Only the numerical and boolean features are model inputs
+    features_path = os.path.join(output_root, "features.parquet")
+    cols = numeric_columns(features_path, cols)
+
+    # Read the rows of the train and validation events from the memory-mapped
+    # matrix of the merge, or else from the features file, which is never
+    # loaded whole
+    matrix = open_feature_matrix(features_path)
+    train_batches = EventBatches(
+        features_path, cols, X_train, shuffle_buffer=SHUFFLE_BUFFER, feature_matrix=matrix
+    )
+    validation_batches = EventBatches(
+        features_path, cols, X_validation, batch_size=PREDICT_BATCH_SIZE, feature_matrix=matrix
+    )
+
+    return cols, train_batches, validation_batches, validation_groups
 
 
 @click.group()
@@ -77,108 +115,21 @@ def train():
         list(FEATURE_DICT.keys())
     )
 )
-def train_model(models_root, output_root, logs_root, features):
-    logging.info("Training Model")
-
-    X_train, X_validation, _ = load_datasets()
-    y_train = X_train.pop("has_been_opened").astype(int)
-    y_validation = X_validation.pop("has_been_opened").astype(int)
-
-    # Load all the features
-    data = load_features()
-
-    # Select the features base on the `features` parameter
-    features_names = [f
-        for feature_group in features
-        for f in FEATURE_DEFINITIONS[feature_group]
-        if FEATURE_DICT.get(feature_group)
-    ]
-    cols = []
-    for filename in features_names:
-        path = os.path.join(INTERIM_ROOT, f"{filename}.parquet")
-        cols += fastparquet.ParquetFile(path).columns
-
-    cols = set([c for c in cols if not c.startswith("__")])
-
-    # Construct the train and validation set with the features
-    X_train = pd.merge(
-        X_train,
-        data[cols],
-        on=["trackable_id", "user_id", "tracker_created_at"]
-    ).replace({False: 0, True: 1})\
-     .select_dtypes(['number']).fillna(0)
-   
-    X_validation = pd.merge(
-        X_validation,
-        data[cols],
-        on=["trackable_id", "user_id", "tracker_created_at"]
-    ).replace({False: 0, True: 1})\
-     .select_dtypes(['number']).fillna(0)
-
-    # Define the model
-    # Normalize the numerical features
-    normalizer = tf.keras.layers.Normalization(axis=-1)
-    normalizer.adapt(X_train)
-
-    # Simple Logistic regression
-    linear_model = tf.keras.Sequential([
-        normalizer,
-        layers.Dense(
-            units=1,
-            activation='sigmoid',
-            input_dim=X_train.shape[1]
-        )
-    ])
-    linear_model.compile(
-        optimizer=tf.keras.optimizers.Adam(learning_rate=0.001),
-        loss="binary_crossentropy",
-    )
-
-    # Add callbacks to be able to restart if a process fail, to
-    # save the best model and to create a TensorBoard
-    callbacks = []
-
-    os.makedirs(models_root, exist_ok=True)
-    os.makedirs(logs_root, exist_ok=True)
-    tensorboard = tf.keras.callbacks.TensorBoard(
-        log_dir=logs_root,
-        histogram_freq=1,
-        write_graph=True,
-        write_images=False,
-        update_freq=100,
-        profile_batch=2,
-        embeddings_freq=1
-    )
-    callbacks.append(tensorboard)
-
-    best_model_file = os.path.join(models_root, "best_model_so_far")
-    best_model_checkpoint = tf.keras.callbacks.ModelCheckpoint(
-        best_model_file,
-        monitor='val_loss',
-        verbose=1,
-        save_best_only=True
+@click.option(
+    '--trainer',
+    type=click.Choice(TRAINERS),
+    default=TRAINER,
+    help='Library fitting the model, default is {}'.format(
+        TRAINER
     )
-    callbacks.append(best_model_checkpoint)
+)
+def train_model(models_root, output_root, logs_root, features, trainer):
+    logging.info("Training Model")
 
-    early_stopping = tf.keras.callbacks.EarlyStopping(
-        patience=PATIENCE,
-        monitor="val_loss"
-    )
-    callbacks.append(early_stopping)
-
-    # Launch the train and save the loss evolution in `history`
-    history = linear_model.fit(
-        X_train,
-        y_train.values,
-        callbacks=callbacks,
-        epochs=EPOCH,
-        validation_data=(
-            X_validation,
-            y_validation.values
-        )
-    )
+    cols, train_batches, validation_batches, validation_groups = load_batches(features, output_root)
 
-    # Save the model
-    logging.info("Saving Model")
-    linear_model.load_weights(best_model_file)
-    linear_model.save(os.path.join(models_root, "final_model"))
+    # Keras streams shuffled mini-batches, L-BFGS loads the trainset as one
+    # float32 matrix. Both save the weights of a `LinearScorer`
+    trainer = get_trainer(trainer)(cols, models_root=models_root, logs_root=logs_root)
+    trainer.fit(train_batches, validation_batches, validation_groups)
+    trainer.save()
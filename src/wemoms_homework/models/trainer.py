@@ -0,0 +1,192 @@
+import abc
+import json
+import logging
+import os
+import numpy as np
+
+from scipy.optimize import minimize
+from scipy.special import expit
+
+from wemoms_homework.config import load_config
+from wemoms_homework.models.input_pipeline import moments
+from wemoms_homework.models.linear_scorer import LINEAR_MODEL_FILE
+from wemoms_homework.models.linear_scorer import EPSILON
+from wemoms_homework.models.linear_scorer import LinearScorer
+from wemoms_homework.models.linear_scorer import fold
+from wemoms_homework.models.linear_scorer import save_linear_model
+from wemoms_homework.models.metrics import ranking_metrics
+
+CONF = load_config()
+MODELS_ROOT = CONF["path"]["models_root"]
+LOGS_ROOT = CONF["path"]["logs_root"]
+TRAINER = CONF["model"]["trainer"]
+L2 = CONF["model"]["l2"]
+MAX_ITER = CONF["model"]["max_iter"]
+RANKING_KS = CONF["model"]["ranking_ks"]
+
+TRAINERS = ["lbfgs", "keras"]
+
+# Rows of the matrix multiplied at once, the products are summed in float64
+CHUNK_ROWS = 65536
+
+
+class Trainer(abc.ABC):
+    """Fit a logistic regression on the standardized features and save it
+    as a `LinearScorer`, whatever the library doing the fit. The
+    predictions only need the saved weights of the raw features"""
+
+    def __init__(self, feature_names, models_root=MODELS_ROOT, logs_root=LOGS_ROOT):
+        self.feature_names = list(feature_names)
+        self.models_root = models_root
+        self.logs_root = logs_root
+
+    @abc.abstractmethod
+    def fit(self, train_batches, validation_batches, validation_groups):
+        """Fit on the `EventBatches` of the trainset, the validation set
+        is only used to report (or monitor) the loss and ranking metrics"""
+
+    @abc.abstractmethod
+    def linear_weights(self):
+        """Weights and bias of the raw features"""
+
+    def save(self):
+        os.makedirs(self.models_root, exist_ok=True)
+
+        # Save the ordered names of the model inputs
+        with open(os.path.join(self.models_root, "feature_names.json"), "w") as f:
+            json.dump(self.feature_names, f, indent=2)
+
+        weights, bias = self.linear_weights()
+        save_linear_model(
+            self.feature_names,
+            weights,
+            bias,
+            os.path.join(self.models_root, LINEAR_MODEL_FILE)
+        )
+
+    @staticmethod
+    def load(models_root=MODELS_ROOT):
+        """Scorer of the saved model"""
+        return LinearScorer.load(models_root)
+
+
+def log_loss(logits, y):
+    """Mean binary cross-entropy of logits, without overflow"""
+    logits = np.asarray(logits, dtype="float64")
+    return float(np.mean(np.logaddexp(0, logits) - np.asarray(y, dtype="float64") * logits))
+
+
+def standardize(X, mean, variance):
+    """Standardize the columns of a float32 matrix in place"""
+    std = np.maximum(np.sqrt(variance), EPSILON)
+    for start in range(0, len(X), CHUNK_ROWS):
+        X[start:start + CHUNK_ROWS] -= mean.astype("float32")
+        X[start:start + CHUNK_ROWS] /= std.astype("float32")
+    return X
+
+
+def read_block(X, start, rows=None, columns=None, scale=None):
+    """Float32 rows `start:start + CHUNK_ROWS` of `X`, or of its rows
+    `rows`, restricted to `columns` and standardized with `scale` (mean,
+    std) when given. Only the block is copied"""
+    index = slice(start, start + CHUNK_ROWS) if rows is None else rows[start:start + CHUNK_ROWS]
+    if columns is None:
+        block = X[index]
+    elif rows is None:
+        block = X[index, columns]
+    else:
+        block = X[np.ix_(index, columns)]
+    if scale is not None:
+        block = (block - scale[0]) / scale[1]
+    return block
+
+
+def fit_logistic(X, y, l2=L2, max_iter=MAX_ITER, rows=None, columns=None, scale=None):
+    """Minimize `mean log loss + l2 / 2 * |w|^2` over a float32 matrix with
+    full-batch L-BFGS. The logits are float32 matrix-vector products, the
+    gradient is summed in float64 by chunks of rows. `rows`, `columns` and
+    `scale` select and standardize a part of `X` chunk by chunk (see
+    `read_block`), it is never copied whole. Returns the weights, the bias
+    and the result of the solver"""
+    n = len(X) if rows is None else len(rows)
+    d = X.shape[1] if columns is None else len(columns)
+    y = np.asarray(y, dtype="float64")
+
+    def loss_and_gradient(params):
+        w = params[:d]
+        logits = np.empty(n)
+        gradient = np.empty(d + 1)
+        gradient[:d] = l2 * w
+        gradient[d] = 0
+
+        # The residuals of a row only depend on its logit, each chunk is
+        # read once per evaluation
+        for start in range(0, n, CHUNK_ROWS):
+            block = read_block(X, start, rows, columns, scale)
+            logits[start:start + CHUNK_ROWS] = block @ w.astype("float32") + params[d]
+            residuals = (expit(logits[start:start + CHUNK_ROWS]) - y[start:start + CHUNK_ROWS]) / n
+            gradient[:d] += block.T @ residuals.astype("float32")
+            gradient[d] += residuals.sum()
+        return log_loss(logits, y) + 0.5 * l2 * np.dot(w, w), gradient
+
+    result = minimize(
+        loss_and_gradient,
+        np.zeros(d + 1),
+        jac=True,
+        method="L-BFGS-B",
+        options={"maxiter": max_iter}
+    )
+    return result.x[:d], result.x[d], result
+
+
+class LBFGSTrainer(Trainer):
+    """Full-batch L-BFGS (SciPy) on the standardized trainset loaded as
+    one float32 matrix. The loss is convex, so it converges in a few dozen
+    iterations whatever the starting point"""
+
+    def __init__(self, feature_names, l2=L2, max_iter=MAX_ITER, **kwargs):
+        super().__init__(feature_names, **kwargs)
+        self.l2 = l2
+        self.max_iter = max_iter
+
+    def fit(self, train_batches, validation_batches, validation_groups):
+        logging.info("Loading the trainset")
+        X, y = train_batches.matrix()
+
+        logging.info("Computing the normalization statistics")
+        self.mean, self.variance = moments(
+            (X[start:start + CHUNK_ROWS] for start in range(0, len(X), CHUNK_ROWS)),
+            X.shape[1]
+        )
+        standardize(X, self.mean, self.variance)
+
+        logging.info(f"Fitting {X.shape[1]} weights on {X.shape[0]} rows with L-BFGS (l2={self.l2})")
+        self.kernel, self.bias, result = fit_logistic(X, y, l2=self.l2, max_iter=self.max_iter)
+        logging.info(f"{result.nit} iterations, loss {result.fun:.6f}: {result.message}")
+        del X
+
+        # Same validation metrics as the Keras trainer, from the raw weights
+        weights, bias = self.linear_weights()
+        logits = np.concatenate([
+            X_block.astype("float64") @ weights + bias
+            for X_block, _ in validation_batches.blocks()
+        ])
+        self.metrics = {"val_loss": log_loss(logits, validation_batches.labels)}
+        _, metrics = ranking_metrics(validation_groups, logits, validation_batches.labels, ks=RANKING_KS)
+        self.metrics.update({f"val_{name}": value for name, value in metrics.items()})
+        for name, value in self.metrics.items():
+            logging.info(f"{name}: {value}")
+        return self
+
+    def linear_weights(self):
+        return fold(self.mean, self.variance, self.kernel, [self.bias])
+
+
+def get_trainer(name=TRAINER):
+    """Trainer class of a backend, Keras is only imported when used"""
+    if name == "keras":
+        from wemoms_homework.models.keras_trainer import KerasTrainer
+        return KerasTrainer
+    if name == "lbfgs":
+        return LBFGSTrainer
+    raise ValueError(f"Unknown trainer {name}, expected one of {TRAINERS}")
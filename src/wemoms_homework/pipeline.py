@@ -0,0 +1,459 @@
+import ast
+import click
+import datetime
+import functools
+import hashlib
+import importlib.util
+import json
+import logging
+import os
+import subprocess
+import sys
+
+from wemoms_homework.config import load_config
+
+CONF = load_config()
+DATA_PATH = CONF["path"]["input_data_path"]
+CACHE_ROOT = CONF["path"]["raw_cache_root"]
+OUTPUT_ROOT = CONF["path"]["output_data_root"]
+INTERIM_ROOT = CONF["path"]["interim_data_root"]
+FEATURE_STORE_ROOT = CONF["path"]["feature_store_root"]
+MODELS_ROOT = CONF["path"]["models_root"]
+FEATURE_DEFINITIONS = CONF["feature_definitions"]
+JOBS = CONF["build"]["jobs"]
+STAMPS_ROOT = CONF["pipeline"]["stamps_root"]
+
+# Same name as `models.linear_scorer.LINEAR_MODEL_FILE`, the module is not
+# imported to keep the runner light
+LINEAR_MODEL_FILE = "linear_model.json"
+
+# Same names as in `feature_matrix`, which imports NumPy and Arrow
+MATRIX_FILE = "features.npy"
+EVENT_ID_FILE = "features.event_id.npy"
+MANIFEST_FILE = "features.columns.json"
+
+PACKAGE = "wemoms_homework"
+DIGESTS_FILE = "digests.json"
+BLOCK_SIZE = 1 << 20
+
+
+class Stage():
+    """One command of the pipeline with everything its outputs depend on:
+    input files and directories, config sections (dotted keys) and code
+    modules (with the modules of the package they import, except the ones
+    of `exclude_code`)"""
+
+    def __init__(self, name, args, inputs, config, code, outputs, exclude_code=()):
+        self.name = name
+        self.args = args
+        self.inputs = inputs
+        self.config = config
+        self.code = code
+        self.outputs = outputs
+        self.exclude_code = list(exclude_code)
+
+
+def feature_files(feature_group):
+    return [
+        os.path.join(INTERIM_ROOT, f"{feature}.parquet")
+        for feature in FEATURE_DEFINITIONS[feature_group]
+    ]
+
+
+@functools.lru_cache(maxsize=None)
+def feature_modules():
+    """Module of the `Feature` class of each group, read from the source of
+    `build_features` (its `FEATURE_DICT` and imports) without importing it"""
+    path = module_path("wemoms_homework.features.build_features")
+    with open(path, "r") as f:
+        tree = ast.parse(f.read(), filename=path)
+    classes = {}
+    for node in ast.walk(tree):
+        if isinstance(node, ast.ImportFrom) and node.module:
+            classes.update({a.asname or a.name: node.module for a in node.names})
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(
+            isinstance(target, ast.Name) and target.id == "FEATURE_DICT" for target in node.targets
+        ):
+            return {
+                key.value: classes[value.id]
+                for key, value in zip(node.value.keys, node.value.values)
+            }
+    raise ValueError(f"No FEATURE_DICT in {path}")
+
+
+def feature_module(feature_group):
+    return feature_modules()[feature_group]
+
+
+def stages():
+    """Stages of the pipeline in topological order. Each feature group is
+    its own stage, so only the groups whose definition or `Feature` class
+    changed are rebuilt"""
+    all_feature_files = [
+        path
+        for feature_group in FEATURE_DEFINITIONS
+        for path in feature_files(feature_group)
+    ]
+    datasets = [os.path.join(OUTPUT_ROOT, f"{name}.parquet") for name in ["train", "eval", "test"]]
+    features_path = os.path.join(OUTPUT_ROOT, "features.parquet")
+    matrix_files = [
+        os.path.join(OUTPUT_ROOT, name)
+        for name in [MATRIX_FILE, EVENT_ID_FILE, MANIFEST_FILE]
+    ]
+    linear_model_path = os.path.join(MODELS_ROOT, LINEAR_MODEL_FILE)
+
+    return (
+        [
+            Stage(
+                "ingest_data",
+                ["ingest-data", "--force"],
+                inputs=[DATA_PATH],
+                config=["ingest", "parquet"],
+                code=["wemoms_homework.data.ingest_data"],
+                outputs=[CACHE_ROOT],
+            ),
+            Stage(
+                "make_dataset",
+                ["make-dataset"],
+                inputs=[CACHE_ROOT],
+                config=["dataset", "parquet"],
+                code=["wemoms_homework.data.make_dataset"],
+                outputs=datasets,
+            ),
+        ]
+        + [
+            Stage(
+                f"build_features.{feature_group}",
+                ["build-features", "--features", feature_group],
+                inputs=[CACHE_ROOT],
+                config=[
+                    f"features.{feature_group}",
+                    f"windows.{feature_group}",
+                    f"feature_definitions.{feature_group}",
+                    "sparse_features",
+                    "parquet",
+                ],
+                code=[
+                    feature_module(feature_group),
+                    "wemoms_homework.features.build_features",
+                    "wemoms_homework.utils",
+                ],
+                outputs=feature_files(feature_group),
+                # `build_features` imports every group, only this one counts
+                exclude_code=[
+                    feature_module(other)
+                    for other in FEATURE_DEFINITIONS
+                    if other != feature_group
+                ],
+            )
+            for feature_group in FEATURE_DEFINITIONS
+        ]
+        + [
+            Stage(
+                "merge_features",
+                ["merge-features"],
+                inputs=all_feature_files,
+                config=["feature_definitions", "sparse_features", "parquet"],
+                code=["wemoms_homework.features.merge_features"],
+                outputs=[features_path, FEATURE_STORE_ROOT] + matrix_files,
+            ),
+            Stage(
+                "train_model",
+                ["train-model"],
+                inputs=[features_path, datasets[0], datasets[1]] + matrix_files + all_feature_files,
+                config=["model", "feature_definitions"],
+                code=["wemoms_homework.models.train_model"],
+                outputs=[
+                    os.path.join(MODELS_ROOT, "feature_names.json"),
+                    linear_model_path,
+                ],
+            ),
+            Stage(
+                "make_predictions",
+                ["make-predictions"],
+                inputs=[datasets[2], FEATURE_STORE_ROOT, linear_model_path] + all_feature_files,
+                config=["model.ranking_ks", "feature_definitions", "features"],
+                code=["wemoms_homework.models.predict_model"],
+                outputs=[
+                    os.path.join(OUTPUT_ROOT, "raw_predictions.parquet"),
+                    os.path.join(OUTPUT_ROOT, "ranking_metrics.parquet"),
+                ],
+            ),
+        ]
+    )
+
+
+def ancestors(stages, names):
+    """`names` and the stages producing their inputs, recursively"""
+    producers = {}
+    for stage in stages:
+        for output in stage.outputs:
+            producers[os.path.normpath(output)] = stage.name
+    by_name = {stage.name: stage for stage in stages}
+
+    selected = set()
+    todo = list(names)
+    while todo:
+        name = todo.pop()
+        if name in selected:
+            continue
+        selected.add(name)
+        for path in by_name[name].inputs:
+            if os.path.normpath(path) in producers:
+                todo.append(producers[os.path.normpath(path)])
+    return selected
+
+
+class Digests():
+    """Content digests of files, cached by (size, mtime) so an unchanged
+    file is only hashed once"""
+
+    def __init__(self, root=STAMPS_ROOT):
+        self.path = os.path.join(root, DIGESTS_FILE)
+        self.cache = {}
+        if os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                self.cache = json.load(f)
+
+    def file(self, path):
+        stat = os.stat(path)
+        key = os.path.abspath(path)
+        cached = self.cache.get(key)
+        if cached is not None and cached[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return cached[2]
+
+        h = hashlib.blake2b(digest_size=16)
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(BLOCK_SIZE), b""):
+                h.update(block)
+        digest = h.hexdigest()
+        self.cache[key] = [stat.st_size, stat.st_mtime_ns, digest]
+        return digest
+
+    def __call__(self, path):
+        """Digest of a file, or of the relative paths and digests of every
+        file of a directory. None if the path does not exist"""
+        if os.path.isfile(path):
+            return self.file(path)
+        if not os.path.isdir(path):
+            return None
+        h = hashlib.blake2b(digest_size=16)
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                full_path = os.path.join(root, name)
+                h.update(os.path.relpath(full_path, path).encode())
+                h.update(self.file(full_path).encode())
+        return h.hexdigest()
+
+    def save(self):
+        write_json(self.cache, self.path)
+
+
+def write_json(data, path):
+    """Write atomically, an interrupted run never leaves a partial stamp"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def config_value(key, conf=CONF):
+    value = conf
+    for part in key.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+def module_path(module):
+    spec = importlib.util.find_spec(module)
+    return spec.origin if spec is not None else None
+
+
+def imported_modules(path):
+    """Modules of the package imported by a source file"""
+    with open(path, "r") as f:
+        tree = ast.parse(f.read(), filename=path)
+    modules = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            modules.update(a.name for a in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module:
+            modules.add(node.module)
+    return {m for m in modules if m == PACKAGE or m.startswith(PACKAGE + ".")}
+
+
+def code_files(modules, exclude=()):
+    """Source files of `modules` and of every module of the package they
+    import, found without importing them. The modules of `exclude` and
+    their imports are not followed"""
+    files = set()
+    todo = list(modules)
+    seen = set(exclude)
+    while todo:
+        module = todo.pop()
+        if module in seen:
+            continue
+        seen.add(module)
+        path = module_path(module)
+        if path is None or not path.endswith(".py"):
+            continue
+        files.add(path)
+        todo += imported_modules(path)
+    return sorted(files)
+
+
+def fingerprint(stage, digests):
+    """What the outputs of `stage` depend on, and its hash"""
+    components = {
+        "args": stage.args,
+        "config": {key: config_value(key) for key in stage.config},
+        "code": {
+            os.path.relpath(path, os.path.dirname(module_path(PACKAGE))): digests(path)
+            for path in code_files(stage.code, stage.exclude_code)
+        },
+        "inputs": {path: digests(path) for path in stage.inputs},
+    }
+    missing = [path for path, digest in components["inputs"].items() if digest is None]
+    if missing:
+        raise click.ClickException(f"{stage.name} is missing its inputs {missing}")
+    key = hashlib.sha256(json.dumps(components, sort_keys=True, default=str).encode()).hexdigest()
+    return key, components
+
+
+def stamp_path(stage, root=STAMPS_ROOT):
+    return os.path.join(root, f"{stage.name}.json")
+
+
+def read_stamp(stage, root=STAMPS_ROOT):
+    path = stamp_path(stage, root)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def stale_reasons(stage, key, components, stamp, digests):
+    """Why `stage` must run, empty if its outputs are still valid"""
+    if stamp is None:
+        return ["never run"]
+    reasons = []
+    if stamp["fingerprint"] != key:
+        for part, values in components.items():
+            previous = stamp["components"].get(part)
+            if isinstance(values, dict) and isinstance(previous, dict):
+                changed = sorted(k for k in set(values) | set(previous) if values.get(k) != previous.get(k))
+                reasons += [f"{part} {k} changed" for k in changed]
+            elif values != previous:
+                reasons.append(f"{part} changed")
+        reasons = reasons or ["fingerprint changed"]
+    for path, digest in stamp["outputs"].items():
+        if digests(path) != digest:
+            reasons.append(f"output {path} missing or modified")
+    return reasons
+
+
+def run_command(args):
+    logging.info(f"Running {' '.join(args)}")
+    process = subprocess.run([sys.executable, "-m", PACKAGE, *args])
+    if process.returncode != 0:
+        raise click.ClickException(f"{' '.join(args)} failed")
+
+
+def run_pipeline_stages(targets=None, force=False, dry_run=False, jobs=JOBS, root=STAMPS_ROOT):
+    """Run the stages whose fingerprint changed since their last successful
+    run, in order. A stage is fingerprinted once its upstream stages ran, so
+    an upstream stage rebuilding identical outputs does not invalidate it.
+    A dry run lists the stages downstream of a stale one as to run"""
+    all_stages = stages()
+    if targets:
+        selected = ancestors(all_stages, targets)
+        all_stages = [stage for stage in all_stages if stage.name in selected]
+
+    digests = Digests(root)
+    ran = []
+    # Outputs of the stages a dry run would run
+    pending = {}
+    try:
+        for stage in all_stages:
+            upstream = sorted({
+                pending[os.path.normpath(path)]
+                for path in stage.inputs
+                if os.path.normpath(path) in pending
+            })
+            if upstream:
+                # Cannot be fingerprinted before its upstream stages run
+                logging.info(f"{stage.name}: after {', '.join(upstream)}")
+                pending.update({os.path.normpath(path): stage.name for path in stage.outputs})
+                ran.append(stage.name)
+                continue
+
+            key, components = fingerprint(stage, digests)
+            reasons = ["forced"] if force else stale_reasons(
+                stage, key, components, read_stamp(stage, root), digests
+            )
+            if not reasons:
+                logging.info(f"{stage.name}: up to date")
+                continue
+
+            logging.info(f"{stage.name}: {', '.join(reasons)}")
+            if dry_run:
+                pending.update({os.path.normpath(path): stage.name for path in stage.outputs})
+                ran.append(stage.name)
+                continue
+
+            args = stage.args
+            if args[0] == "build-features":
+                args = args + ["--jobs", str(jobs)]
+            run_command(args)
+            write_json({
+                "fingerprint": key,
+                "components": components,
+                "outputs": {path: digests(path) for path in stage.outputs},
+                "finished_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            }, stamp_path(stage, root))
+            ran.append(stage.name)
+    finally:
+        digests.save()
+    return ran
+
+
+@click.group()
+def pipeline():
+    pass
+
+
+@pipeline.command()
+@click.argument(
+    'targets',
+    nargs=-1,
+    type=click.Choice([stage.name for stage in stages()])
+)
+@click.option(
+    '--force',
+    is_flag=True,
+    default=False,
+    help='Run every stage even if its outputs are up to date'
+)
+@click.option(
+    '--dry-run',
+    is_flag=True,
+    default=False,
+    help='Only print the stages to run and why'
+)
+@click.option(
+    '--jobs',
+    type=click.IntRange(min=1),
+    default=JOBS,
+    help='Number of processes computing the features, default is {}'.format(
+        JOBS
+    )
+)
+def run_pipeline(targets, force, dry_run, jobs):
+    """Run the stages of the pipeline whose inputs, config or code changed"""
+    ran = run_pipeline_stages(targets, force=force, dry_run=dry_run, jobs=jobs)
+    logging.info(f"{len(ran)} stages {'to run' if dry_run else 'run'}")
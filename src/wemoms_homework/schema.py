@@ -0,0 +1,166 @@
+import os
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from wemoms_homework.config import load_config
+
+CONF = load_config()
+ROW_GROUP_SIZE = CONF["parquet"]["row_group_size"]
+COMPRESSION = CONF["parquet"]["compression"]
+
+DATE_COLUMNS = [
+    "tracker_created_at",
+    "user_created_at",
+    "first_comment_at"
+]
+
+# The booleans and integers are never missing in the raw export. They are
+# stored without nulls (uint8, int32, uint16): a missing value is read as
+# False or 0 by the ingestion, with a warning, which is also what the model
+# inputs make of it
+BOOL_COLUMNS = [
+    "user_is_mom",
+    "user_is_pregnant",
+    "user_is_trying",
+    "has_picture",
+    "has_text",
+    "has_video",
+    "has_been_opened",
+    "author_has_same_age_children",
+    "author_has_same_age_month_children",
+    "author_has_older_children"
+]
+
+# Small counts
+UINT16_COLUMNS = [
+    "author_children_count",
+    "user_children_count"
+]
+
+INT_COLUMNS = UINT16_COLUMNS + [
+    "post_age_in_minutes",
+    "post_comments_count",
+    "post_likes_count",
+    "survey_answers_count",
+    "direct_reports_count",
+    "days_since_user_account_creation",
+    "user_followings_count",
+    "user_posts_count",
+    "user_received_comments_count",
+    "user_pictures_count",
+    "user_likes_count"
+]
+
+# Integers with missing values are kept as floats
+FLOAT_COLUMNS = [
+    "user_pregnancy_current_day",
+    "user_pregnancy_current_week",
+    "user_pregnancy_current_month",
+    "user_pregnancy_current_trimester",
+    "user_age",
+    "user_is_trying_since_days",
+    "author_age",
+    "author_amenorrhea_week"
+]
+
+# Few distinct values repeated on many rows: stored as categories in pandas
+# and dictionary encoded in the parquet files
+CATEGORY_COLUMNS = [
+    "trackable_id",
+    "user_id",
+    "user_country_code",
+    "author_maternity_stage",
+    "platform",
+    "user_department",
+    "author_department"
+]
+
+LIST_COLUMNS = [
+    "user_children_age_month",
+    "author_children_age_month",
+    "author_children_age_year"
+]
+
+# Dtypes of the windowed popularity features, by suffix
+SUFFIX_DTYPES = {
+    "_views_count": "int32",
+    "_clicks_count": "int32",
+    "_ratio": "float32"
+}
+
+DTYPES = {
+    **{col: "uint8" for col in BOOL_COLUMNS},
+    **{col: "int32" for col in INT_COLUMNS},
+    **{col: "uint16" for col in UINT16_COLUMNS},
+    **{col: "float32" for col in FLOAT_COLUMNS},
+    **{col: "category" for col in CATEGORY_COLUMNS},
+}
+
+DICTIONARY_TYPE = pa.dictionary(pa.int32(), pa.string())
+
+
+def dtype_of(column):
+    """Declared dtype of a column, None if it keeps its own"""
+    if column in DTYPES:
+        return DTYPES[column]
+    for suffix, dtype in SUFFIX_DTYPES.items():
+        if column.endswith(suffix):
+            return dtype
+    return None
+
+
+def apply_schema(df):
+    """Cast the columns of `df` to their declared dtypes"""
+    casts = {}
+    for col in df.columns:
+        dtype = dtype_of(col)
+        if dtype is not None and df[col].dtype != dtype:
+            casts[col] = dtype
+    return df.astype(casts) if casts else df
+
+
+def to_table(df):
+    """Arrow table of `df` following the schema. The categories are
+    dictionaries of strings with int32 indices whatever their number, so the
+    tables of different files can be concatenated"""
+    if isinstance(df, pd.DataFrame):
+        df = pa.Table.from_pandas(apply_schema(df), preserve_index=False)
+    for i, field in enumerate(df.schema):
+        if pa.types.is_dictionary(field.type) and field.type != DICTIONARY_TYPE:
+            df = df.set_column(i, field.name, df.column(i).cast(DICTIONARY_TYPE))
+    return df
+
+
+def write_parquet(df, path, row_group_size=ROW_GROUP_SIZE):
+    """Write a DataFrame or an Arrow table following the schema. Every
+    column is dictionary encoded (the writer falls back to plain encoding
+    when a column has too many distinct values)"""
+    pq.write_table(
+        to_table(df),
+        path,
+        row_group_size=row_group_size,
+        use_dictionary=True,
+        compression=COMPRESSION
+    )
+
+
+def partition_path(root, day):
+    return os.path.join(root, f"day={day}", "data.parquet")
+
+
+def write_partition(df, root, day):
+    """Write the partition of `day`, replaced at once"""
+    path = partition_path(root, day)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_parquet(df, path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+
+def read_parquet(paths, columns=None):
+    """Read and concatenate parquet files written with `write_parquet`, the
+    categories of the files are merged"""
+    tables = [pq.read_table(path, columns=columns) for path in paths]
+    if not tables:
+        return pd.DataFrame(columns=columns)
+    return pa.concat_tables([to_table(table) for table in tables]).to_pandas()
@@ -1,30 +1,49 @@
+import logging
 import os
 import pandas as pd
+import pyarrow.parquet as pq
 
 from wemoms_homework.config import load_config
+from wemoms_homework.data.ingest_data import cache_is_fresh
+from wemoms_homework.data.ingest_data import ingest
+from wemoms_homework.data.ingest_data import partition_files
+from wemoms_homework.features.age_bitmask import AGE_PROFILE_COLUMNS
+from wemoms_homework.schema import read_parquet
 
 CONF = load_config()
 DATA_PATH = CONF["path"]["input_data_path"]
+CACHE_ROOT = CONF["path"]["raw_cache_root"]
 OUPUT_ROOT = CONF["path"]["output_data_root"]
+INTERIM_ROOT = CONF["path"]["interim_data_root"]
+FEATURE_DEFINITIONS = CONF["feature_definitions"]
 
 
-def load_data():
-	return pd.read_json(
-        path_or_buf=DATA_PATH,
-        lines=True,
-        compression="gzip"
-    ).drop_duplicates(subset=[
-	    "trackable_id",
-	    "user_id",
-	    "tracker_created_at"
-	])
+def load_data(columns=None):
+    """Load the deduplicated raw data from the parquet cache, building the
+    cache first if the raw file changed since the last ingestion"""
+    if not cache_is_fresh(DATA_PATH, CACHE_ROOT):
+        logging.info("Parquet cache is missing or outdated, ingesting raw data")
+        ingest(DATA_PATH, CACHE_ROOT)
 
-def load_features():
-	return pd.read_parquet(os.path.join(OUPUT_ROOT, "features.parquet"))
+    return read_parquet(partition_files(CACHE_ROOT), columns=columns)
+
+def feature_columns(feature_groups):
+    """Sorted columns of the feature files of `feature_groups`, read from
+    the parquet footers only. The children ages are left out, they are only
+    used to compute features"""
+    cols = []
+    for feature_group in feature_groups:
+        for filename in FEATURE_DEFINITIONS[feature_group]:
+            path = os.path.join(INTERIM_ROOT, f"{filename}.parquet")
+            cols += pq.read_schema(path).names
+    return sorted(set([
+        c for c in cols
+        if not c.startswith("__") and c != "event_id" and c not in AGE_PROFILE_COLUMNS
+    ]))
 
 def load_datasets():
-	return (
-		pd.read_parquet(os.path.join(OUPUT_ROOT, "train.parquet")),
-		pd.read_parquet(os.path.join(OUPUT_ROOT, "eval.parquet")),
-		pd.read_parquet(os.path.join(OUPUT_ROOT, "test.parquet")),
-	)
+    return (
+        pd.read_parquet(os.path.join(OUPUT_ROOT, "train.parquet")),
+        pd.read_parquet(os.path.join(OUPUT_ROOT, "eval.parquet")),
+        pd.read_parquet(os.path.join(OUPUT_ROOT, "test.parquet")),
+    )
@@ -0,0 +1,37 @@
+import os
+import pandas as pd
+import pytest
+
+# The modules read `config.yml` from the working directory when imported
+os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from wemoms_homework.data.generate_data import generate  # noqa: E402
+from wemoms_homework.data.ingest_data import KEYS  # noqa: E402
+from wemoms_homework.data.ingest_data import fix_dtypes  # noqa: E402
+
+N_EVENTS = 3000
+DAYS = 7
+
+
+@pytest.fixture(scope="session")
+def raw_path(tmp_path_factory):
+    """Synthetic raw file, generated once for the whole session"""
+    path = str(tmp_path_factory.mktemp("raw") / "synthetic.json.gzip")
+    generate(path, N_EVENTS, days=DAYS, seed=0)
+    return path
+
+
+@pytest.fixture(scope="session")
+def raw_events(raw_path):
+    """Raw lines with the dtypes of the ingestion, duplicates included"""
+    df = pd.read_json(raw_path, lines=True, compression="gzip", dtype=False, convert_dates=False)
+    return fix_dtypes(df)
+
+
+@pytest.fixture
+def events(raw_events):
+    """Distinct events in time order, a copy the test can modify"""
+    return (raw_events
+        .drop_duplicates(subset=KEYS)
+        .sort_values("tracker_created_at", kind="stable")
+        .reset_index(drop=True))
@@ -0,0 +1,102 @@
+import numpy as np
+import pandas as pd
+
+from wemoms_homework.features.age_bitmask import MONTH_WORDS
+from wemoms_homework.features.age_bitmask import WORD_BITS
+from wemoms_homework.features.age_bitmask import YEAR_WORDS
+from wemoms_homework.features.age_bitmask import add_age_bitmasks
+from wemoms_homework.features.age_bitmask import age_match_features
+from wemoms_homework.features.age_bitmask import any_common
+from wemoms_homework.features.age_bitmask import encode_ages
+
+
+def ages_of_mask(mask):
+    """Ages whose bit is set in one row of words"""
+    return {
+        word * WORD_BITS + bit
+        for word, value in enumerate(mask)
+        for bit in range(WORD_BITS)
+        if int(value) >> bit & 1
+    }
+
+
+def test_encode_ages_sets_the_bits_of_the_ages_in_range():
+    ages = pd.Series([[], [0, 12, 25], [255, 256, 300], [-3, 5], [None, 40.5]], index=[10, 11, 12, 13, 14])
+
+    res = encode_ages(ages, {1: MONTH_WORDS, 12: YEAR_WORDS})
+
+    months, max_months, outside_months = res[1]
+    assert months.shape == (5, MONTH_WORDS) and months.dtype == "uint64"
+    assert [ages_of_mask(mask) for mask in months] == [set(), {0, 12, 25}, {255}, {5}, set()]
+    np.testing.assert_array_equal(max_months, [-1, 25, 300, 5, 40])
+    np.testing.assert_array_equal(outside_months, [False, False, True, True, True])
+
+    years, max_years, outside_years = res[12]
+    assert [ages_of_mask(mask) for mask in years] == [set(), {0, 1, 2}, {21, 25}, {0}, {3}]
+    np.testing.assert_array_equal(max_years, [-1, 2, 25, 0, 3])
+    np.testing.assert_array_equal(outside_years, [False, False, False, True, True])
+
+
+def baseline_features(df):
+    """Age features computed on the raw lists, as sets"""
+    user_years = [[age // 12 for age in ages] for ages in df["user_children_age_month"]]
+    return {
+        "author_has_same_age_children": [
+            bool(set(author) & set(user)) for author, user in zip(df["author_children_age_year"], user_years)
+        ],
+        "author_has_same_age_month_children": [
+            bool(set(author) & set(user))
+            for author, user in zip(df["author_children_age_month"], df["user_children_age_month"])
+        ],
+        "author_has_older_children": [
+            max(author, default=-1) > max(user, default=-1)
+            for author, user in zip(df["author_children_age_year"], user_years)
+        ],
+    }
+
+
+def test_age_match_features_match_the_raw_lists(events):
+    df = add_age_bitmasks(events)
+
+    res = age_match_features(df, df)
+    for name, expected in baseline_features(df).items():
+        np.testing.assert_array_equal(res[name], expected, err_msg=name)
+
+
+def test_any_common_compares_the_raw_lists_of_the_ages_out_of_range():
+    df = add_age_bitmasks(pd.DataFrame({
+        "user_children_age_month": [[300], [300], [-1], [12], [300], [24.5], [12, 700]],
+        "author_children_age_month": [[300], [400], [-1], [12, 400], [300, 500], [24], [700]],
+        "author_children_age_year": [[], [], [], [], [25, 41], [2], [58]],
+    }))
+
+    res = any_common(df, "author_children_age_month", df, "user_children_age_month")
+    np.testing.assert_array_equal(res, [True, False, True, True, True, False, True])
+    for name, expected in baseline_features(df).items():
+        np.testing.assert_array_equal(age_match_features(df, df)[name], expected, err_msg=name)
+
+
+def test_any_common_broadcasts_users_against_authors():
+    users = add_age_bitmasks(pd.DataFrame({
+        "user_children_age_month": [[], [12, 30], [300]],
+        "author_children_age_month": [[]] * 3,
+        "author_children_age_year": [[]] * 3,
+    }))
+    authors = add_age_bitmasks(pd.DataFrame({
+        "user_children_age_month": [[]] * 4,
+        "author_children_age_month": [[30], [300, 500], [13], []],
+        "author_children_age_year": [[2], [25], [1], [70]],
+    }))
+
+    user = {c: users[c].to_numpy()[:, None] for c in users.columns}
+    author = {c: authors[c].to_numpy()[None, :] for c in authors.columns}
+    res = age_match_features(user, author)
+
+    pairs = pd.DataFrame([
+        {**{c: users[c].iloc[i] for c in users.columns if c.startswith("user")},
+         **{c: authors[c].iloc[j] for c in authors.columns if c.startswith("author")}}
+        for i in range(len(users)) for j in range(len(authors))
+    ])
+    for name, expected in baseline_features(pairs).items():
+        assert res[name].shape == (len(users), len(authors))
+        np.testing.assert_array_equal(res[name].ravel(), expected, err_msg=name)
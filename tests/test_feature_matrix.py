@@ -0,0 +1,65 @@
+import os
+import numpy as np
+import pyarrow as pa
+import pytest
+
+from wemoms_homework.feature_matrix import FeatureMatrix
+from wemoms_homework.feature_matrix import open_feature_matrix
+from wemoms_homework.feature_matrix import write_feature_matrix
+from wemoms_homework.features.age_bitmask import AGE_PROFILE_COLUMNS
+from wemoms_homework.features.age_bitmask import add_age_bitmasks
+from wemoms_homework.models.input_pipeline import EventBatches
+from wemoms_homework.schema import write_parquet
+
+FEATURES = ["user_likes_count", "user_age", "has_picture", "post_age_in_minutes"]
+
+
+def write_features(events, root):
+    """Merged features file of the events and its matrix"""
+    events["event_id"] = np.arange(len(events)) * 2
+    # Missing values are 0 in the matrix
+    events.loc[::10, "user_age"] = np.nan
+    table = pa.Table.from_pandas(add_age_bitmasks(events), preserve_index=False)
+    path = os.path.join(root, "features.parquet")
+    write_parquet(table, path)
+    write_feature_matrix(table, path, root)
+    return path
+
+
+def test_the_matrix_has_the_model_inputs_of_the_features(events, tmp_path):
+    path = write_features(events, str(tmp_path))
+    matrix = open_feature_matrix(path)
+
+    assert set(FEATURES) <= set(matrix.columns)
+    assert not set(matrix.columns) & set(AGE_PROFILE_COLUMNS + ["event_id", "user_id", "tracker_created_at"])
+    sample = events.sample(100, random_state=0)
+    np.testing.assert_array_equal(
+        matrix.take(sample["event_id"], FEATURES),
+        sample[FEATURES].fillna(0).to_numpy(dtype="float32")
+    )
+    with pytest.raises(ValueError, match="1 events have no features"):
+        matrix.rows([0, 1])
+
+    # The batches of the training are the same from the matrix or the file
+    dataset = events.iloc[::3]
+    from_matrix = EventBatches(path, FEATURES, dataset, feature_matrix=matrix)
+    from_file = EventBatches(path, FEATURES, dataset)
+    X_matrix, y_matrix = from_matrix.matrix()
+    X_file, y_file = from_file.matrix()
+    assert len(y_matrix) == len(dataset)
+    np.testing.assert_array_equal(X_matrix, X_file)
+    np.testing.assert_array_equal(y_matrix, y_file)
+
+
+def test_a_matrix_older_than_its_features_is_not_used(events, tmp_path):
+    path = write_features(events, str(tmp_path))
+    assert open_feature_matrix(path) is not None
+
+    # Features merged again without the matrix
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    assert open_feature_matrix(path) is None
+    assert not FeatureMatrix.open(str(tmp_path)).is_fresh(path)
+
+    os.remove(os.path.join(str(tmp_path), "features.columns.json"))
+    assert open_feature_matrix(path) is None
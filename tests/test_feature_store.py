@@ -0,0 +1,138 @@
+import glob
+import os
+import numpy as np
+import pandas as pd
+
+from wemoms_homework.features import USER_AUTHOR_FEATURES
+from wemoms_homework.features.age_bitmask import AGE_PROFILE_COLUMNS
+from wemoms_homework.features.age_bitmask import add_age_bitmasks
+from wemoms_homework.features.feature_store import ENTITIES
+from wemoms_homework.features.feature_store import FeatureStore
+from wemoms_homework.features.window_counts import rolling_counts
+from wemoms_homework.features.window_counts import to_nanoseconds
+
+
+def snapshot_data(events):
+    """Events with one user/post feature, at distinct times so the last
+    snapshot of an entity is always defined"""
+    events = events.drop_duplicates(subset=["tracker_created_at"]).reset_index(drop=True)
+    views, _, _ = rolling_counts(
+        events["user_id"].astype(str) + "/" + events["trackable_id"].astype(str),
+        to_nanoseconds(events["tracker_created_at"]),
+        events["has_been_opened"].astype("int64"),
+        ["1d"]
+    )["1d"]
+    events["user_post_last_1d_views_count"] = views
+
+    # A few children ages out of the bits of the masks
+    events.loc[::50, "user_children_age_month"] = pd.Series([[300, 12]] * len(events[::50]), index=events.index[::50])
+    events.loc[::70, "author_children_age_month"] = pd.Series([[300]] * len(events[::70]), index=events.index[::70])
+    return add_age_bitmasks(events)
+
+
+def queries(events):
+    """Known entities between and after their snapshots, and an unknown user"""
+    df = events[["user_id", "trackable_id", "tracker_created_at"]].copy()
+    df["user_id"] = df["user_id"].astype(str)
+    df["trackable_id"] = df["trackable_id"].astype(str)
+    df["tracker_created_at"] += pd.Timedelta(minutes=30)
+    unknown = df.iloc[:5].assign(user_id="unknown user")
+    before = df.iloc[:5].assign(tracker_created_at=df["tracker_created_at"].min() - pd.Timedelta(days=1))
+    return pd.concat([df, unknown, before], ignore_index=True).sample(frac=1, random_state=0)
+
+
+def expected_features(data, df, keys, features):
+    """Last snapshot at or before each query with `merge_asof`"""
+    right = data[keys + ["tracker_created_at"] + features].copy()
+    for key in keys:
+        right[key] = right[key].astype(str)
+    left = df.reset_index(drop=True).reset_index()
+    res = pd.merge_asof(
+        left.sort_values("tracker_created_at"),
+        right.sort_values("tracker_created_at"),
+        on="tracker_created_at",
+        by=keys,
+        direction="backward"
+    )
+    return res.sort_values("index").reset_index(drop=True)[features]
+
+
+def expected_pair_features(data, df):
+    """Post age at the time of the query and children age features of the
+    user and the author of their last snapshots, from the raw lists"""
+    data = data.assign(snapshot_time=data["tracker_created_at"])
+    post = expected_features(data, df, ["trackable_id"], ["post_age_in_minutes", "snapshot_time"] + [
+        "author_children_age_month", "author_children_age_year"
+    ])
+    user = expected_features(data, df, ["user_id"], ["user_children_age_month"])
+    elapsed = df["tracker_created_at"].reset_index(drop=True) - post["snapshot_time"]
+    res = pd.DataFrame({"post_age_in_minutes": post["post_age_in_minutes"] + elapsed // pd.Timedelta(minutes=1)})
+
+    known = user["user_children_age_month"].notna() & post["author_children_age_month"].notna()
+    for name in USER_AUTHOR_FEATURES:
+        res[name] = np.nan
+    for i in np.flatnonzero(known):
+        months, author_months = user["user_children_age_month"][i], post["author_children_age_month"][i]
+        years, author_years = {m // 12 for m in months}, set(post["author_children_age_year"][i])
+        res.loc[i, "author_has_same_age_children"] = float(bool(years & author_years))
+        res.loc[i, "author_has_same_age_month_children"] = float(bool(set(months) & set(author_months)))
+        res.loc[i, "author_has_older_children"] = float(max(author_years, default=-1) > max(years, default=-1))
+    return res
+
+
+def assert_same_features(res, expected):
+    for col in expected.columns:
+        if isinstance(expected[col].dtype, pd.CategoricalDtype) or expected[col].dtype == object:
+            np.testing.assert_array_equal(
+                res[col].astype(object).fillna("").astype(str).to_numpy(),
+                expected[col].astype(object).fillna("").astype(str).to_numpy(),
+                err_msg=col
+            )
+        else:
+            np.testing.assert_allclose(
+                res[col].to_numpy(dtype="float64", na_value=np.nan),
+                expected[col].to_numpy(dtype="float64", na_value=np.nan),
+                err_msg=col
+            )
+
+
+def test_lookup_matches_merge_asof(events, tmp_path):
+    data = snapshot_data(events)
+    df = queries(data)
+
+    store = FeatureStore.build(data)
+    store.save(str(tmp_path))
+    for store in [store, FeatureStore.load(str(tmp_path))]:
+        res = store.lookup(df)
+        assert len(res) == len(df)
+        for keys, features in ENTITIES.values():
+            features = [
+                c for c in features
+                if c in data.columns and c not in AGE_PROFILE_COLUMNS + ["post_age_in_minutes"]
+            ]
+            assert features
+            assert_same_features(res, expected_features(data, df, keys, features))
+        assert not set(AGE_PROFILE_COLUMNS) & set(res.columns)
+        assert_same_features(res, expected_pair_features(data, df))
+
+
+def test_replace_day_matches_a_rebuilt_store(events, tmp_path):
+    data = snapshot_data(events)
+    day = data["tracker_created_at"].dt.normalize().iloc[len(data) // 2]
+    in_day = data["tracker_created_at"].dt.normalize() == day
+    FeatureStore.build(data).save(str(tmp_path))
+
+    # The features of the day are computed again with other values, only
+    # the partitions of the day are written
+    other_days = {
+        path: os.stat(path).st_mtime_ns
+        for path in glob.glob(str(tmp_path / "*" / "day=*" / "data.parquet"))
+        if day.strftime("%Y-%m-%d") not in path
+    }
+    new_day = data[in_day].assign(user_likes_count=lambda df: df["user_likes_count"] + 1000)
+    FeatureStore.replace_day(new_day, day.strftime("%Y-%m-%d"), root=str(tmp_path))
+    assert {path: os.stat(path).st_mtime_ns for path in other_days} == other_days
+
+    df = queries(data)
+    rebuilt = pd.concat([data[~in_day], new_day], ignore_index=True)
+    assert_same_features(FeatureStore.load(str(tmp_path)).lookup(df), FeatureStore.build(rebuilt).lookup(df))
@@ -0,0 +1,85 @@
+import gzip
+import json
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+from wemoms_homework.data.ingest_data import KEYS
+from wemoms_homework.data.ingest_data import MANIFEST
+from wemoms_homework.data.ingest_data import cache_is_fresh
+from wemoms_homework.data.ingest_data import deduplicate
+from wemoms_homework.data.ingest_data import fingerprints
+from wemoms_homework.data.ingest_data import ingest
+from wemoms_homework.data.ingest_data import partition_files
+
+
+def test_deduplicate_keeps_the_first_row_of_each_key(raw_events):
+    expected = raw_events.drop_duplicates(subset=KEYS)
+    assert len(expected) < len(raw_events)
+
+    res = deduplicate(raw_events)
+    pd.testing.assert_frame_equal(res, expected)
+
+
+def test_fingerprints_do_not_depend_on_the_categories(raw_events):
+    chunk = raw_events[KEYS].copy()
+    other = chunk.copy()
+    for col in ["trackable_id", "user_id"]:
+        categories = chunk[col].cat.categories
+        other[col] = chunk[col].cat.set_categories(categories[::-1])
+
+    np.testing.assert_array_equal(fingerprints(chunk), fingerprints(other))
+    # The first half of a chunk has the fingerprints of its rows in the
+    # whole chunk, whatever the categories left in the half
+    half = chunk.iloc[:len(chunk) // 2].copy()
+    half["user_id"] = half["user_id"].cat.remove_unused_categories()
+    np.testing.assert_array_equal(fingerprints(half), fingerprints(chunk)[:len(half)])
+
+
+def test_fingerprints_tell_the_keys_apart(events):
+    assert len(np.unique(fingerprints(events))) == len(events)
+
+
+def split_raw_file(raw_path, root):
+    """The lines of the raw file in three files, the first and the second
+    sharing some lines"""
+    with gzip.open(raw_path, "rt") as f:
+        lines = f.readlines()
+    bounds = [(0, 1500), (1000, 2200), (2200, len(lines))]
+    for name, (start, end) in zip(["a", "b", "c"], bounds):
+        with gzip.open(os.path.join(root, f"events-{name}.json.gzip"), "wt") as f:
+            f.writelines(lines[start:end])
+    return os.path.join(root, "events-*.json.gzip")
+
+
+def read_cache(cache_root):
+    return {
+        os.path.basename(os.path.dirname(path)): pd.read_parquet(path)
+        for path in partition_files(cache_root)
+    }
+
+
+def test_files_ingested_together_are_the_file_they_come_from(raw_path, tmp_path):
+    ingest(raw_path, str(tmp_path / "single"), chunksize=1000, jobs=1)
+    pattern = split_raw_file(raw_path, str(tmp_path))
+    ingest([pattern], str(tmp_path / "files"), chunksize=700, jobs=2)
+
+    expected, res = read_cache(str(tmp_path / "single")), read_cache(str(tmp_path / "files"))
+    assert list(res) == list(expected)
+    for day, df in res.items():
+        # The unused categories depend on the chunks
+        pd.testing.assert_frame_equal(df, expected[day], check_categorical=False, obj=day)
+        assert df["event_id"].is_monotonic_increasing
+
+    # The lines repeated across the files are counted as duplicates
+    with open(str(tmp_path / "files" / MANIFEST), "r") as f:
+        manifest = json.load(f)
+    assert manifest["rows"] == len(pd.read_json(raw_path, lines=True, compression="gzip")) + 500
+    assert manifest["rows_deduplicated"] == sum(len(df) for df in res.values())
+    assert manifest["duplicate_rate"] == pytest.approx(1 - manifest["rows_deduplicated"] / manifest["rows"])
+
+    # The cache follows the files matched by the pattern
+    assert cache_is_fresh([pattern], str(tmp_path / "files"))
+    os.remove(str(tmp_path / "events-c.json.gzip"))
+    assert not cache_is_fresh([pattern], str(tmp_path / "files"))
@@ -0,0 +1,65 @@
+import numpy as np
+import pyarrow.parquet as pq
+import pytest
+
+from wemoms_homework.models.input_pipeline import EventBatches
+from wemoms_homework.models.input_pipeline import moments
+from wemoms_homework.schema import write_parquet
+
+FEATURES = ["user_likes_count", "post_likes_count", "post_age_in_minutes", "has_picture"]
+
+
+def features_file(events, path, row_group_size=200):
+    events["event_id"] = np.arange(len(events)) * 3
+    write_parquet(events[["event_id"] + FEATURES], path, row_group_size=row_group_size)
+    return path
+
+
+def test_only_the_row_groups_of_the_events_are_read(events, tmp_path):
+    path = features_file(events, str(tmp_path / "features.parquet"))
+    # The events of a date window are contiguous in the file
+    dataset = events.iloc[1000:1500].sample(frac=0.5, random_state=0)
+    batches = EventBatches(path, FEATURES, dataset)
+
+    assert batches.row_groups(pq.ParquetFile(path)) == [5, 6, 7]
+    X, y = batches.matrix()
+    expected = dataset.sort_values("event_id")
+    np.testing.assert_array_equal(X, expected[FEATURES].to_numpy(dtype="float32"))
+    np.testing.assert_array_equal(y, expected["has_been_opened"].to_numpy(dtype="float32"))
+
+    missing = dataset.assign(event_id=dataset["event_id"] + 1)
+    with pytest.raises(ValueError, match=f"{len(dataset)} events have no features"):
+        EventBatches(path, FEATURES, missing).matrix()
+
+
+def test_moments_of_the_blocks_are_the_ones_of_the_whole_matrix(events, tmp_path):
+    path = features_file(events, str(tmp_path / "features.parquet"))
+    batches = EventBatches(path, FEATURES, events)
+    X, _ = batches.matrix()
+
+    mean, variance = batches.moments()
+    np.testing.assert_allclose(mean, X.mean(axis=0, dtype="float64"), rtol=1e-10)
+    np.testing.assert_allclose(variance, X.var(axis=0, dtype="float64"), rtol=1e-8)
+
+    # Any split of the rows, empty blocks included
+    splits = np.split(X, [0, 1, 1, 17, 1000])
+    for res, expected in zip(moments(splits, X.shape[1]), (mean, variance)):
+        np.testing.assert_allclose(res, expected, rtol=1e-8)
+
+
+def test_the_shuffled_batches_have_every_row_once(events, tmp_path):
+    path = features_file(events, str(tmp_path / "features.parquet"))
+    batches = EventBatches(path, FEATURES, events, batch_size=32, shuffle_buffer=500, seed=0)
+    X, y = batches.matrix()
+
+    batch_X, batch_y = zip(*batches)
+    assert all(len(b) == 32 for b in batch_y[:-1])
+    shuffled_X, shuffled_y = np.concatenate(batch_X), np.concatenate(batch_y)
+    assert not np.array_equal(shuffled_X, X)
+
+    # Same rows, with their labels
+    def sorted_rows(X, y):
+        rows = np.column_stack([X, y])
+        return rows[np.lexsort(rows.T[::-1])]
+
+    np.testing.assert_array_equal(sorted_rows(shuffled_X, shuffled_y), sorted_rows(X, y))
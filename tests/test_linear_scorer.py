@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from wemoms_homework.models.linear_scorer import EPSILON
+from wemoms_homework.models.linear_scorer import LinearScorer
+from wemoms_homework.models.linear_scorer import fold
+from wemoms_homework.models.linear_scorer import fold_normalization
+
+
+def standardized_model(rng, n_features=5):
+    """Statistics of the inputs and weights of a model on standardized
+    inputs, one constant input (a variance below EPSILON)"""
+    mean = rng.normal(scale=1e3, size=n_features)
+    variance = rng.uniform(1e-2, 1e6, size=n_features)
+    variance[-1] = 0
+    kernel = rng.normal(size=(n_features, 1))
+    bias = rng.normal(size=1)
+    return mean, variance, kernel, bias
+
+
+def test_folded_weights_score_the_raw_features():
+    rng = np.random.default_rng(0)
+    mean, variance, kernel, bias = standardized_model(rng)
+    X = mean + rng.normal(size=(100, len(mean))) * np.sqrt(variance)
+
+    scorer = LinearScorer([f"x{i}" for i in range(len(mean))], *fold(mean, variance, kernel, bias))
+    expected = (X - mean) / np.maximum(np.sqrt(variance), EPSILON) @ kernel.ravel() + bias[0]
+    np.testing.assert_allclose(scorer.logits(X), expected, rtol=1e-9, atol=1e-6)
+
+
+def test_fold_normalization_matches_the_keras_model():
+    tf = pytest.importorskip("tensorflow")
+
+    rng = np.random.default_rng(0)
+    mean, variance, kernel, bias = standardized_model(rng)
+    variance[-1] = 1
+    model = tf.keras.Sequential([
+        tf.keras.layers.Normalization(axis=-1, mean=mean, variance=variance),
+        tf.keras.layers.Dense(units=1, activation="sigmoid"),
+    ])
+    model.build((None, len(mean)))
+    model.layers[-1].set_weights([kernel, bias])
+    X = (mean + rng.normal(size=(100, len(mean))) * np.sqrt(variance)).astype("float32")
+
+    scorer = LinearScorer([f"x{i}" for i in range(len(mean))], *fold_normalization(model))
+    np.testing.assert_allclose(scorer.predict(X), model.predict(X, verbose=0).ravel(), atol=1e-5)
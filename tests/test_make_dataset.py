@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+
+from wemoms_homework.data.make_dataset import generate_candidates
+
+
+def events_testset(events):
+    return events.assign(
+        event_id=np.arange(len(events)),
+        user_id=events["user_id"].astype(str),
+        trackable_id=events["trackable_id"].astype(str)
+    )
+
+
+def baseline_candidates(testset):
+    """Rows of the original loop over the positives: the positive and every
+    post published the day before it as a negative"""
+    creation_date = (testset.tracker_created_at - pd.to_timedelta(testset.post_age_in_minutes, unit="m")).dt.date
+    candidate_date = creation_date + pd.Timedelta(days=1)
+    positives = testset[testset.has_been_opened.astype(bool) & (testset.tracker_created_at.dt.date == candidate_date)]
+
+    rows = []
+    for _, row in positives.iterrows():
+        rows.append((row["event_id"], row["user_id"], row["tracker_created_at"], row["trackable_id"], 1))
+        for post_id in testset[candidate_date == row["tracker_created_at"].date()].trackable_id.unique():
+            rows.append((-1, row["user_id"], row["tracker_created_at"], post_id, 0))
+    return rows
+
+
+def as_rows(candidates):
+    return list(zip(
+        candidates["event_id"],
+        candidates["user_id"].astype(str),
+        candidates["tracker_created_at"],
+        candidates["trackable_id"].astype(str),
+        candidates["has_been_opened"].astype(int),
+    ))
+
+
+def test_candidates_are_the_ones_of_the_original_loop(events):
+    testset = events_testset(events)
+
+    res = generate_candidates(testset)
+
+    expected = baseline_candidates(testset)
+    assert len(expected) > (res.event_id >= 0).sum() > 0
+    assert sorted(as_rows(res)) == sorted(expected)
+
+
+def test_negatives_are_sampled_per_positive(events):
+    testset = events_testset(events)
+    full = generate_candidates(testset)
+    full_rows = set(as_rows(full))
+    positives = full[full.event_id >= 0]
+    # Negatives of each positive: the rows following it in the original loop
+    is_positive = np.array([row[0] >= 0 for row in baseline_candidates(testset)])
+    n_negatives = np.diff(np.r_[np.flatnonzero(is_positive), len(is_positive)]) - 1
+
+    capped = generate_candidates(testset, max_negatives=3)
+    assert set(as_rows(capped)) <= full_rows
+    assert as_rows(capped[capped.event_id >= 0]) == as_rows(positives)
+    assert (capped.event_id == -1).sum() == np.minimum(n_negatives, 3).sum()
+
+    sampled = generate_candidates(testset, negative_ratio=0.25)
+    assert set(as_rows(sampled)) <= full_rows
+    assert (sampled.event_id == -1).sum() == round(0.25 * (full.event_id == -1).sum())
+    # The sampling is reproducible
+    assert as_rows(sampled) == as_rows(generate_candidates(testset, negative_ratio=0.25))
@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+
+from wemoms_homework.config import window_file
+from wemoms_homework.data.ingest_data import add_event_id
+from wemoms_homework.features import user_post_popularity
+from wemoms_homework.features.merge_features import merge_files
+from wemoms_homework.features.post_popularity import PostPopularity
+from wemoms_homework.features.user_post_popularity import UserPostPopularity
+from wemoms_homework.schema import write_parquet
+
+WINDOWS = ["1d", "7d"]
+
+
+def test_sparse_files_are_filled_with_zeros(events, tmp_path, monkeypatch):
+    events["event_id"] = np.arange(len(events))
+    ids_path = str(tmp_path / "ids.parquet")
+    write_parquet(events[["event_id", "has_been_opened"]], ids_path)
+
+    monkeypatch.setattr(user_post_popularity, "OUTPUT_ROOT", str(tmp_path))
+    dense = UserPostPopularity.extract_feature(events.copy(), save=True, windows=WINDOWS, sparse=True)
+
+    paths = {
+        "user_post_popularity": {
+            window_file("user_post_popularity", w): str(tmp_path / f"{window_file('user_post_popularity', w)}.parquet")
+            for w in WINDOWS
+        }
+    }
+    # Only the events with a history are saved
+    for path in paths["user_post_popularity"].values():
+        assert 0 < pq.read_metadata(path).num_rows < len(events)
+
+    res = merge_files({"ids": {"ids": ids_path}, **paths}).to_pandas()
+    np.testing.assert_array_equal(res["event_id"], events["event_id"])
+    for col in dense.columns.drop("event_id"):
+        assert res[col].dtype == dense[col].dtype, col
+        np.testing.assert_array_equal(res[col], dense[col], err_msg=col)
+
+
+def test_feature_files_are_aligned_on_the_event_ids(events, tmp_path):
+    days = events["tracker_created_at"].dt.strftime("%Y-%m-%d")
+    # The days are ingested in any order, their ids still sort them by time
+    events = pd.concat([
+        add_event_id(events[days == day], day) for day in days.unique()[::-1]
+    ], ignore_index=True)
+    ids = events.sort_values("event_id")
+    assert ids["tracker_created_at"].is_monotonic_increasing
+    ids_path = str(tmp_path / "ids.parquet")
+    write_parquet(ids[["event_id", "has_been_opened"]], ids_path)
+
+    post = PostPopularity.extract_feature(events.copy(), windows=["1d"])
+    post_path = str(tmp_path / "post.parquet")
+    write_parquet(post, post_path)
+    res = merge_files({"ids": {"ids": ids_path}, "post_popularity": {"post": post_path}}).to_pandas()
+    np.testing.assert_array_equal(res["event_id"], ids["event_id"])
+    np.testing.assert_array_equal(res["has_been_opened"], ids["has_been_opened"])
+    for col in post.columns.drop("event_id"):
+        np.testing.assert_array_equal(res[col], post[col], err_msg=col)
+
+    # A file built from other events is not merged by position
+    other_events = events[events["tracker_created_at"].dt.normalize() > events["tracker_created_at"].min()]
+    write_parquet(PostPopularity.extract_feature(other_events.copy(), windows=["1d"]), post_path)
+    with pytest.raises(ValueError, match="not aligned"):
+        merge_files({"ids": {"ids": ids_path}, "post_popularity": {"post": post_path}})
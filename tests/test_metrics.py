@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+
+from wemoms_homework.models.metrics import group_ids
+from wemoms_homework.models.metrics import ranking_metrics
+from wemoms_homework.models.metrics import sort_groups
+
+KS = (1, 3, 10)
+
+
+def group_metrics(scores, labels, k):
+    """MAP@k, NDCG@k, Recall@k and MRR of one group, from their
+    definitions"""
+    relevant = labels[np.argsort(-scores, kind="stable")] > 0
+    n_relevant = relevant.sum()
+    hits, precisions = 0, []
+    for rank, is_relevant in enumerate(relevant[:k], start=1):
+        if is_relevant:
+            hits += 1
+            precisions.append(hits / rank)
+    dcg = sum(1 / np.log2(rank + 1) for rank, r in enumerate(relevant[:k], start=1) if r)
+    ideal_dcg = sum(1 / np.log2(rank + 1) for rank in range(1, min(n_relevant, k) + 1))
+    return {
+        f"map@{k}": sum(precisions) / min(n_relevant, k),
+        f"ndcg@{k}": dcg / ideal_dcg,
+        f"recall@{k}": hits / n_relevant,
+        "mrr": 1 / (np.argmax(relevant) + 1),
+    }
+
+
+def test_ranking_metrics_match_their_definitions(events):
+    events["day"] = events["tracker_created_at"].dt.normalize()
+    groups = group_ids(events, ["user_id", "day"])
+    labels = events["has_been_opened"].to_numpy()
+    # Distinct scores, the order of the ties is not defined
+    scores = np.random.default_rng(0).permutation(len(events)).astype("float64")
+
+    per_group, aggregates = ranking_metrics(groups, scores, labels, ks=KS)
+
+    expected = {}
+    for group in np.unique(groups):
+        rows = groups == group
+        if not labels[rows].any():
+            assert per_group.loc[group, "mrr"] != per_group.loc[group, "mrr"]
+            continue
+        for k in KS:
+            for name, value in group_metrics(scores[rows], labels[rows], k).items():
+                assert per_group.loc[group, name] == pytest.approx(value)
+                expected.setdefault(name, {})[group] = value
+
+    for name, values in expected.items():
+        assert aggregates[name] == pytest.approx(np.mean(list(values.values())))
+
+
+def test_ranking_metrics_of_a_small_example():
+    groups = [0, 0, 0, 1, 1, 2]
+    scores = [0.9, 0.5, 0.1, 0.2, 0.8, 0.3]
+    labels = [0, 1, 1, 1, 0, 0]
+
+    per_group, aggregates = ranking_metrics(groups, scores, labels, ks=(2,))
+
+    # Group 0: relevant at ranks 2 and 3, group 1 at rank 2, group 2 has none
+    assert per_group.loc[0, "map@2"] == pytest.approx(0.5 / 2)
+    assert per_group.loc[1, "map@2"] == pytest.approx(0.5)
+    assert per_group.loc[0, "recall@2"] == pytest.approx(0.5)
+    assert per_group.loc[0, "mrr"] == pytest.approx(0.5)
+    assert np.isnan(per_group.loc[2, "mrr"])
+    assert aggregates["mrr"] == pytest.approx(0.5)
+    assert aggregates["mean_rank"] == pytest.approx((2 + 3 + 2) / 3)
+
+
+def test_ranking_metrics_without_rows():
+    per_group, aggregates = ranking_metrics([], [], [])
+    assert per_group.empty and aggregates == {}
+
+
+@pytest.mark.parametrize("contiguous", [True, False])
+def test_sort_groups_matches_a_lexsort(contiguous):
+    rng = np.random.default_rng(0)
+    groups = np.repeat(np.arange(200), rng.integers(1, 12, 200))
+    if not contiguous:
+        groups = rng.permutation(groups)
+    # Ties, NaN and infinite scores keep the order of the rows
+    scores = rng.integers(0, 5, len(groups)).astype("float64")
+    scores[rng.random(len(groups)) < 0.1] = np.nan
+    scores[rng.random(len(groups)) < 0.05] = -np.inf
+
+    order, starts, ranks = sort_groups(groups, scores)
+    np.testing.assert_array_equal(order, np.lexsort((-scores, groups)))
+    np.testing.assert_array_equal(groups[order][starts], np.arange(200))
+    np.testing.assert_array_equal(ranks, np.arange(len(groups)) - np.repeat(starts, np.bincount(groups)) + 1)
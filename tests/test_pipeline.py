@@ -0,0 +1,84 @@
+import json
+import subprocess
+import sys
+
+from wemoms_homework import pipeline
+from wemoms_homework.features.build_features import FEATURE_DICT
+from wemoms_homework.pipeline import Stage
+from wemoms_homework.pipeline import feature_module
+
+
+def test_feature_modules_are_the_ones_of_the_feature_classes():
+    for feature_group, feature in FEATURE_DICT.items():
+        assert feature_module(feature_group) == feature.__module__
+
+
+def test_the_stages_are_listed_without_importing_the_features():
+    code = (
+        "import sys\n"
+        "from wemoms_homework.pipeline import stages\n"
+        "stages()\n"
+        "print(sorted(m for m in ['pandas', 'numpy', 'wemoms_homework.features.build_features'] if m in sys.modules))\n"
+    )
+    res = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    assert res.stdout.strip() == "[]"
+
+
+def toy_stages(root):
+    """Two stages: `first` reads the raw file, `second` the output of `first`"""
+    return [
+        Stage("first", ["first"], inputs=[str(root / "raw")], config=["dataset"],
+              code=["wemoms_homework.config"], outputs=[str(root / "middle")]),
+        Stage("second", ["second"], inputs=[str(root / "middle")], config=["model"],
+              code=["wemoms_homework.config"], outputs=[str(root / "out")]),
+    ]
+
+
+def test_only_the_stale_stages_run(tmp_path, monkeypatch):
+    commands = []
+
+    def run_command(args):
+        commands.append(args[0])
+        source, target = {"first": ("raw", "middle"), "second": ("middle", "out")}[args[0]]
+        # The first stage only keeps the first line of the raw file
+        lines = (tmp_path / source).read_text().splitlines()
+        (tmp_path / target).write_text(lines[0] if args[0] == "first" else "\n".join(lines))
+
+    monkeypatch.setattr(pipeline, "stages", lambda: toy_stages(tmp_path))
+    monkeypatch.setattr(pipeline, "run_command", run_command)
+    root = str(tmp_path / ".pipeline")
+
+    def run(**kwargs):
+        commands.clear()
+        return pipeline.run_pipeline_stages(root=root, **kwargs)
+
+    (tmp_path / "raw").write_text("a\nb")
+    assert run() == ["first", "second"] and commands == ["first", "second"]
+    assert run() == [] and commands == []
+
+    # A dry run lists the downstream stages without running anything
+    (tmp_path / "raw").write_text("a\nc")
+    assert run(dry_run=True) == ["first", "second"] and commands == []
+    # The first stage rebuilds the same output, the second one is up to date
+    assert run() == ["first"]
+    (tmp_path / "raw").write_text("d")
+    assert run() == ["first", "second"]
+
+    # A modified output or a forced run makes its stage run again
+    (tmp_path / "out").write_text("e")
+    assert run(dry_run=True) == ["second"]
+    assert run() == ["second"] and (tmp_path / "out").read_text() == "d"
+    assert run(targets=["first"], force=True) == ["first"]
+
+
+def test_a_changed_config_section_is_a_reason_to_run(tmp_path):
+    stage = toy_stages(tmp_path)[0]
+    (tmp_path / "raw").write_text("a")
+    digests = pipeline.Digests(str(tmp_path))
+    key, components = pipeline.fingerprint(stage, digests)
+    stamp = {"fingerprint": key, "components": components, "outputs": {}}
+    assert pipeline.stale_reasons(stage, key, components, stamp, digests) == []
+
+    changed = json.loads(json.dumps(components))
+    changed["config"]["dataset"] = {"seed": -1}
+    assert pipeline.stale_reasons(stage, "other", changed, stamp, digests) == ["config dataset changed"]
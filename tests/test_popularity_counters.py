@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+
+from wemoms_homework.features.popularity_counters import PopularityCounters
+from wemoms_homework.features.window_counts import to_nanoseconds
+
+WINDOWS = ["1d", "7d", "28d"]
+HOUR = pd.Timedelta("1h").value
+
+
+def test_counts_on_the_hours_match_the_events_of_the_windows(events, tmp_path):
+    post_ids = events["trackable_id"].astype(str).to_numpy()
+    times = to_nanoseconds(events["tracker_created_at"])
+    clicks = events["has_been_opened"].to_numpy().astype("int64")
+    posts, codes = np.unique(post_ids, return_inverse=True)
+
+    counters = PopularityCounters(WINDOWS, "1h")
+    added = 0
+    for hour in range(times.min() // HOUR + 1, times.max() // HOUR + 2, 7):
+        # The events are added by batches, up to the time of the query
+        end = np.searchsorted(times, hour * HOUR, side="left")
+        counters.add(post_ids[added:end], times[added:end], clicks[added:end])
+        added = end
+
+        views, window_clicks = counters.counts(posts, np.full(len(posts), hour * HOUR))
+        for window in WINDOWS:
+            in_window = (times >= hour * HOUR - pd.Timedelta(window).value) & (times < hour * HOUR)
+            np.testing.assert_array_equal(
+                views[window], np.bincount(codes[in_window], minlength=len(posts))
+            )
+            np.testing.assert_array_equal(
+                window_clicks[window], np.bincount(codes[in_window], clicks[in_window], minlength=len(posts))
+            )
+
+    # A snapshot has the same counts, the posts without events in the
+    # windows are forgotten
+    counters.save(str(tmp_path / "counters.npz"))
+    loaded = PopularityCounters.load(str(tmp_path / "counters.npz"), WINDOWS, "1h")
+    query_times = np.full(len(posts), (times.max() // HOUR + 1) * HOUR)
+    for before, after in zip(counters.counts(posts, query_times), loaded.counts(posts, query_times)):
+        for window in WINDOWS:
+            np.testing.assert_array_equal(before[window], after[window])
+
+
+def test_features_exclude_the_events_at_the_time_of_the_query():
+    counters = PopularityCounters(["1d"], "1h")
+    counters.add_events(pd.DataFrame({
+        "trackable_id": ["a", "a", "b", "a", "a"],
+        "tracker_created_at": [
+            "2023-01-01T00:00:00Z", "2023-01-01T00:30:00Z", "2023-01-01T00:30:00Z",
+            "2023-01-01T01:00:00Z", "2023-01-01T01:00:00Z"
+        ],
+        "has_been_opened": [True, False, True, True, None],
+    }))
+
+    res = counters.features(
+        np.array(["a", "b", "c"]),
+        pd.to_datetime(["2023-01-01T01:00:00Z"] * 3)
+    )
+    np.testing.assert_array_equal(res["post_last_1d_views_count"], [2, 1, 0])
+    np.testing.assert_array_equal(res["post_last_1d_clicks_count"], [1, 1, 0])
+    np.testing.assert_allclose(res["post_last_1d_ratio"], [0.5, 1, 0])
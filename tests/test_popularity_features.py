@@ -0,0 +1,27 @@
+import numpy as np
+
+from wemoms_homework.config import load_config
+from wemoms_homework.features import POST_FEATURES
+from wemoms_homework.features import USER_POST_FEATURES
+from wemoms_homework.features import popularity_columns
+from wemoms_homework.features.post_popularity import PostPopularity
+from wemoms_homework.features.user_post_popularity import UserPostPopularity
+
+
+def test_files_and_columns_follow_the_windows_of_the_config(events):
+    conf = load_config()
+    events["event_id"] = np.arange(len(events))
+
+    for feature_group, feature, prefix, features in [
+        ("post_popularity", PostPopularity, "post", POST_FEATURES),
+        ("user_post_popularity", UserPostPopularity, "user_post", USER_POST_FEATURES),
+    ]:
+        windows = conf["windows"][feature_group]
+        assert conf["feature_definitions"][feature_group] == [f"{feature_group}_{w}" for w in windows]
+
+        columns = list(feature.extract_feature(events.copy()).columns.drop("event_id"))
+        assert columns == popularity_columns(prefix, windows)
+        assert set(columns) <= set(features)
+
+        res = feature.extract_feature(events.copy(), windows=["2h"])
+        assert list(res.columns.drop("event_id")) == popularity_columns(prefix, ["2h"])
@@ -0,0 +1,39 @@
+import numpy as np
+import pyarrow.parquet as pq
+import pytest
+
+from wemoms_homework.features.age_bitmask import add_age_bitmasks
+from wemoms_homework.features.feature_store import FeatureStore
+from wemoms_homework.models.linear_scorer import LinearScorer
+from wemoms_homework.models.rank_users import block_size
+from wemoms_homework.models.rank_users import write_top_k
+from wemoms_homework.models.serve_model import Ranker
+
+
+@pytest.mark.parametrize("users_per_block", [1, 7, 1000])
+def test_write_top_k_streams_the_top_of_every_user(events, tmp_path, users_per_block):
+    store = FeatureStore.build(add_age_bitmasks(events))
+    day = events["tracker_created_at"].max().normalize().tz_localize(None)
+    scorer = LinearScorer(["user_likes_count", "post_likes_count", "post_comments_count"], [0.01, 0.02, -0.03], -1.0)
+    ranker = Ranker(store, scorer, day, top_k=4)
+    assert len(ranker.post_ids) > 4
+    user_ids = np.asarray(ranker.user_index)[:50]
+
+    path = str(tmp_path / "top_k.parquet")
+    n_rows = write_top_k(ranker, user_ids, path, users_per_block)
+    res = pq.read_table(path).to_pandas()
+    assert n_rows == len(res) == 4 * len(user_ids)
+
+    # The blocks give the ranking of all the users at once
+    top, scores = ranker.top_posts(user_ids)
+    np.testing.assert_array_equal(res["user_id"], np.repeat(user_ids, 4))
+    np.testing.assert_array_equal(res["rank"], np.tile([1, 2, 3, 4], len(user_ids)))
+    np.testing.assert_array_equal(res["trackable_id"], ranker.post_ids[top.ravel()].astype(str))
+    np.testing.assert_allclose(res["score"], scores.ravel(), rtol=1e-6)
+    assert (np.diff(scores, axis=1) <= 0).all()
+
+
+def test_blocks_fit_in_their_memory():
+    assert block_size(1000, block_mb=1) == 2 ** 20 // (1000 * 32)
+    # At least one user, even when its candidates do not fit
+    assert block_size(10 ** 9, block_mb=1) == 1
@@ -0,0 +1,141 @@
+import asyncio
+import json
+import numpy as np
+import pandas as pd
+
+from wemoms_homework.features import POST_FEATURES
+from wemoms_homework.features import USER_AUTHOR_FEATURES
+from wemoms_homework.features import USER_FEATURES
+from wemoms_homework.features.age_bitmask import add_age_bitmasks
+from wemoms_homework.features.age_bitmask import age_match_features
+from wemoms_homework.features.feature_store import FeatureStore
+from wemoms_homework.features.popularity_counters import PopularityCounters
+from wemoms_homework.features.window_counts import rolling_counts
+from wemoms_homework.features.window_counts import to_nanoseconds
+from wemoms_homework.models.linear_scorer import LinearScorer
+from wemoms_homework.models.serve_model import MicroBatcher
+from wemoms_homework.models.serve_model import Ranker
+from wemoms_homework.models.serve_model import make_handler
+
+
+def store_data(events):
+    """Events with the user/post features of the store, a few children ages
+    out of the bits of the masks"""
+    events["user_children_age_month"] = [
+        [300, 12] if i % 40 == 0 else ages for i, ages in enumerate(events["user_children_age_month"])
+    ]
+    events = add_age_bitmasks(events)
+    for col, values in age_match_features(events, events).items():
+        events[col] = values
+    views, clicks, _ = rolling_counts(
+        events["user_id"].astype(str) + "/" + events["trackable_id"].astype(str),
+        to_nanoseconds(events["tracker_created_at"]),
+        events["has_been_opened"].astype("int64"),
+        ["1d"]
+    )["1d"]
+    events["user_post_last_1d_views_count"] = views
+    events["user_post_last_1d_clicks_count"] = clicks
+    return events
+
+
+def test_ranker_matches_the_scorer_on_the_joined_rows(events):
+    data = store_data(events)
+    store = FeatureStore.build(data)
+    day = data["tracker_created_at"].max().normalize()
+    # The ranker uses the snapshots before the day, the lookups the ones at
+    # or before it
+    assert not (data["tracker_created_at"] == day).any()
+
+    feature_names = [
+        c for c in USER_FEATURES + POST_FEATURES + USER_AUTHOR_FEATURES
+        + ["user_post_last_1d_views_count", "user_post_last_1d_clicks_count"]
+        if c in data.columns and pd.api.types.is_numeric_dtype(data[c])
+    ]
+    rng = np.random.default_rng(0)
+    scorer = LinearScorer(feature_names, rng.normal(scale=0.1, size=len(feature_names)), -1.0)
+    # The age of the posts changes by minutes, its weight is small
+    scorer.weights[feature_names.index("post_age_in_minutes")] = 1e-3
+    ranker = Ranker(store, scorer, day.tz_localize(None), top_k=5)
+    assert len(ranker.post_ids) > 5
+
+    user_ids = list(pd.unique(data["user_id"].astype(str))[:30]) + ["unknown user"]
+    top, scores = ranker.top_posts(user_ids)
+
+    for user_id, user_top, user_scores in zip(user_ids, top, scores):
+        df = pd.DataFrame({
+            "user_id": user_id,
+            "trackable_id": ranker.post_ids.astype(str),
+            "tracker_created_at": day,
+        })
+        X = store.lookup(df)[feature_names].apply(pd.to_numeric, errors="coerce").fillna(0)
+        expected = scorer.predict(X)
+        order = np.argsort(-expected, kind="stable")[:5]
+        np.testing.assert_allclose(user_scores, expected[order], rtol=1e-9, err_msg=user_id)
+        np.testing.assert_array_equal(ranker.post_ids[user_top], ranker.post_ids[order], err_msg=user_id)
+
+
+def test_ranker_counts_the_popularity_at_the_time_of_the_request(events):
+    data = store_data(events)
+    store = FeatureStore.build(data)
+    day = data["tracker_created_at"].max().normalize()
+    scorer = LinearScorer(
+        ["post_last_1d_views_count", "post_last_7d_clicks_count", "post_likes_count"],
+        [0.05, 0.3, 0.01],
+        -2.0
+    )
+
+    counters = PopularityCounters(["1d", "7d"], "1h")
+    ranker = Ranker(store, scorer, day.tz_localize(None), top_k=3, counters=counters)
+    posts = store.entities["post"].latest(day).set_index("trackable_id")
+    likes = posts["post_likes_count"].reindex(ranker.post_ids).to_numpy(dtype="float64")
+
+    data = data.assign(views=1)
+    added = pd.Series(False, index=data.index)
+    for time in [day, day + pd.Timedelta(hours=5)]:
+        # The counters have the events before the request
+        new = (data["tracker_created_at"] < time) & ~added
+        counters.add_events(data[new])
+        added |= new
+        top, scores = ranker.top_posts(["unknown user"], time)
+
+        def window_counts(window, column):
+            in_window = added & (data["tracker_created_at"] >= time - pd.Timedelta(window))
+            counts = data[in_window].groupby(data["trackable_id"].astype(str))[column].sum()
+            return counts.reindex(ranker.post_ids.astype(str), fill_value=0).to_numpy(dtype="float64")
+
+        logits = (
+            -2.0
+            + 0.05 * window_counts("1d", "views")
+            + 0.3 * window_counts("7d", "has_been_opened")
+            + 0.01 * likes
+        )
+        order = np.argsort(-logits, kind="stable")[:3]
+        np.testing.assert_allclose(scores[0], 1 / (1 + np.exp(-logits[order])), rtol=1e-9)
+        np.testing.assert_array_equal(ranker.post_ids[top[0]], ranker.post_ids[order])
+
+
+class FailingRanker():
+    def rank(self, user_ids, time=None):
+        raise RuntimeError("no ranking")
+
+
+def test_a_failed_ranking_is_a_server_error():
+    async def request():
+        batcher = MicroBatcher(FailingRanker())
+        batcher_task = asyncio.create_task(batcher.run())
+        server = await asyncio.start_server(make_handler(batcher), host="127.0.0.1", port=0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            # The connection is kept open after the error
+            for _ in range(2):
+                writer.write(b"GET /rank?user_id=a HTTP/1.1\r\n\r\n")
+                status = await reader.readline()
+                headers = await reader.readuntil(b"\r\n\r\n")
+                length = int(headers.split(b"Content-Length: ")[1].split(b"\r\n")[0])
+                assert status == b"HTTP/1.1 500 Internal Server Error\r\n"
+                assert json.loads(await reader.readexactly(length)) == {"error": "ranking failed"}
+            writer.close()
+        batcher_task.cancel()
+
+    asyncio.run(request())
@@ -0,0 +1,116 @@
+import numpy as np
+import pyarrow as pa
+import pytest
+
+from concurrent.futures import ProcessPoolExecutor
+
+from wemoms_homework.config import load_config
+from wemoms_homework.feature_matrix import FeatureMatrix
+from wemoms_homework.feature_matrix import write_feature_matrix
+from wemoms_homework.models import sweep
+from wemoms_homework.models.metrics import group_ids
+from wemoms_homework.models.metrics import ranking_metrics
+from wemoms_homework.models.trainer import fit_logistic
+from wemoms_homework.models.trainer import log_loss
+from wemoms_homework.schema import write_parquet
+
+FEATURES = ["user_likes_count", "post_likes_count", "post_age_in_minutes", "has_picture", "user_is_mom"]
+L2 = 1e-2
+
+
+def test_configurations_leave_each_group_out_once():
+    groups = list(load_config()["feature_definitions"])
+    configs = sweep.configurations([], [0.1, 1.0])
+    assert len(configs) == 2 * (len(groups) + 1)
+    assert configs[0] == (tuple(groups), 0.1)
+    assert {len(subset) for subset, _ in configs[2:]} == {len(groups) - 1}
+    assert sweep.configurations([["base_features"]], [1.0]) == [(("base_features",), 1.0)]
+
+
+def share(arrays):
+    """Arrays copied in shared memory, with their specs for `attach`"""
+    blocks, specs = [], {}
+    for name, values in arrays.items():
+        shared, block = sweep.to_shared(values.shape, values.dtype)
+        shared[:] = values
+        blocks.append(block)
+        specs[name] = (block.name, values.shape, values.dtype.str)
+    return blocks, specs
+
+
+@pytest.fixture
+def sweep_data(events, tmp_path, monkeypatch):
+    """Features of the events and their matrix, the first 2000 events
+    train and the others validate"""
+    monkeypatch.setattr(sweep, "_SHARED", {})
+    events["event_id"] = np.arange(len(events))
+    table = pa.Table.from_pandas(events[["event_id"] + FEATURES], preserve_index=False)
+    write_parquet(table, str(tmp_path / "features.parquet"))
+    write_feature_matrix(table, str(tmp_path / "features.parquet"), str(tmp_path))
+
+    X = events[FEATURES].to_numpy(dtype="float32")
+    y = events["has_been_opened"].to_numpy(dtype="float32")
+    train, validation = np.arange(2000), np.arange(2000, len(events))
+    groups = group_ids(events.iloc[validation], ["user_id"])
+    mean = X[train].mean(axis=0, dtype="float64")
+    std = X[train].std(axis=0, dtype="float64")
+    return X, y, train, validation, groups, mean, std, str(tmp_path)
+
+
+def expected_result(sweep_data, columns):
+    """Fit of a copy of the standardized columns"""
+    X, y, train, validation, groups, mean, std, _ = sweep_data
+    X_std = ((X - mean.astype("float32")) / std.astype("float32"))[:, columns]
+    weights, bias, _ = fit_logistic(np.ascontiguousarray(X_std[train]), y[train], l2=L2)
+    logits = X_std[validation].astype("float64") @ weights + bias
+    _, metrics = ranking_metrics(groups, logits, y[validation], ks=sweep.RANKING_KS)
+    return {"val_loss": log_loss(logits, y[validation]), **{f"val_{k}": v for k, v in metrics.items()}}
+
+
+def assert_same_results(res, expected):
+    for name, value in expected.items():
+        assert res[name] == pytest.approx(value, rel=1e-4, abs=1e-6), name
+
+
+def test_a_configuration_fits_the_standardized_shared_matrices(sweep_data):
+    X, y, train, validation, groups, mean, std, _ = sweep_data
+    X_std = (X - mean.astype("float32")) / std.astype("float32")
+    blocks, specs = share({
+        "X_train": X_std[train], "X_validation": X_std[validation],
+        "y_train": y[train], "y_validation": y[validation], "validation_groups": groups,
+    })
+    try:
+        sweep.attach(specs)
+        columns = [0, 2, 3]
+        res = sweep.fit_configuration(("some", "groups"), columns, L2)
+        assert res["features"] == "some+groups" and res["n_features"] == 3
+        assert_same_results(res, expected_result(sweep_data, columns))
+    finally:
+        for name in list(sweep._SHARED):
+            sweep._SHARED.pop(name)[0].close()
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+
+def test_the_workers_read_the_rows_of_the_feature_matrix(sweep_data):
+    X, y, train, validation, groups, mean, std, root = sweep_data
+    blocks, specs = share({
+        "train_rows": train, "validation_rows": validation,
+        "y_train": y[train], "y_validation": y[validation], "validation_groups": groups,
+    })
+    matrix_columns = np.asarray(FeatureMatrix.open(root).column_indices(FEATURES))
+    tasks = [
+        (("config",), matrix_columns[columns], L2, sweep.MAX_ITER,
+         (mean[columns].astype("float32"), std[columns].astype("float32")))
+        for columns in [[0, 1], [1, 3, 4]]
+    ]
+    try:
+        with ProcessPoolExecutor(max_workers=2, initializer=sweep.attach, initargs=(specs, root)) as executor:
+            results = list(executor.map(sweep.fit_configuration, *zip(*tasks)))
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+    for res, columns in zip(results, [[0, 1], [1, 3, 4]]):
+        assert_same_results(res, expected_result(sweep_data, columns))
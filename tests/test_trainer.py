@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+from scipy.special import expit
+
+from wemoms_homework.models.input_pipeline import EventBatches
+from wemoms_homework.models.metrics import group_ids
+from wemoms_homework.models.trainer import LBFGSTrainer
+from wemoms_homework.models.trainer import Trainer
+from wemoms_homework.models.trainer import get_trainer
+from wemoms_homework.schema import write_parquet
+
+FEATURES = ["user_likes_count", "post_likes_count", "post_age_in_minutes", "has_picture", "user_is_mom"]
+
+
+def test_lbfgs_scorer_matches_the_trained_model(events, tmp_path):
+    events["event_id"] = np.arange(len(events))
+    path = str(tmp_path / "features.parquet")
+    write_parquet(events[["event_id"] + FEATURES], path)
+    train, validation = events.iloc[:2000], events.iloc[2000:]
+
+    l2 = 1e-3
+    trainer = LBFGSTrainer(FEATURES, l2=l2, models_root=str(tmp_path), logs_root=str(tmp_path))
+    trainer.fit(
+        EventBatches(path, FEATURES, train),
+        EventBatches(path, FEATURES, validation),
+        group_ids(validation, ["user_id"])
+    )
+    trainer.save()
+    scorer = Trainer.load(str(tmp_path))
+    assert scorer.feature_names == FEATURES
+
+    # The weights minimize the regularized loss of the standardized features
+    X = train[FEATURES].to_numpy(dtype="float64")
+    y = train["has_been_opened"].to_numpy(dtype="float64")
+    X_std = (X - trainer.mean) / np.sqrt(trainer.variance)
+    residuals = expit(X_std @ trainer.kernel + trainer.bias) - y
+    np.testing.assert_allclose(X_std.T @ residuals / len(y) + l2 * trainer.kernel, 0, atol=1e-4)
+    assert abs(residuals.mean()) < 1e-4
+
+    # The saved scorer gives the predictions of the model on the raw features
+    X = events[FEATURES].to_numpy(dtype="float64")
+    expected = expit((X - trainer.mean) / np.sqrt(trainer.variance) @ trainer.kernel + trainer.bias)
+    np.testing.assert_allclose(scorer.predict(X), expected, rtol=1e-6)
+    assert set(trainer.metrics) >= {"val_loss", "val_map@10", "val_mrr"}
+
+
+def test_unknown_trainers_are_rejected():
+    assert get_trainer("lbfgs") is LBFGSTrainer
+    with pytest.raises(ValueError, match="Unknown trainer"):
+        get_trainer("sgd")
@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+
+from wemoms_homework.features.window_counts import rolling_counts
+from wemoms_homework.features.window_counts import to_nanoseconds
+
+WINDOWS = ["1h", "1d", "7d"]
+
+
+def brute_force_counts(keys, times, labels, window):
+    """Views and clicks of the same key in `[t - window, t)`, comparing
+    every pair of events"""
+    delta = pd.Timedelta(window).value
+    same_key = keys[:, None] == keys[None, :]
+    in_window = (times[None, :] >= times[:, None] - delta) & (times[None, :] < times[:, None])
+    selected = same_key & in_window
+    return selected.sum(axis=1), (selected * labels[None, :]).sum(axis=1)
+
+
+def test_rolling_counts_match_brute_force(events):
+    # Shuffled, the results must follow the input order
+    events = events.sample(frac=1, random_state=0)
+    keys = events["trackable_id"].astype(str).to_numpy()
+    times = to_nanoseconds(events["tracker_created_at"])
+    labels = events["has_been_opened"].to_numpy().astype("int64")
+
+    res = rolling_counts(keys, times, labels, WINDOWS)
+    for window in WINDOWS:
+        views, clicks = brute_force_counts(keys, times, labels, window)
+        np.testing.assert_array_equal(res[window][0], views)
+        np.testing.assert_array_equal(res[window][1], clicks)
+        ratio = np.divide(clicks, views, out=np.zeros(len(views)), where=views > 0)
+        np.testing.assert_allclose(res[window][2], ratio)
+
+
+def test_rolling_counts_exclude_the_events_at_the_same_time():
+    times = to_nanoseconds(pd.to_datetime([
+        "2023-01-01 00:00", "2023-01-01 00:00", "2023-01-01 00:30", "2023-01-01 02:00"
+    ]))
+    res = rolling_counts(["a", "a", "a", "a"], times, [1, 0, 1, 1], ["1h"])
+    views, clicks, ratio = res["1h"]
+    np.testing.assert_array_equal(views, [0, 0, 2, 0])
+    np.testing.assert_array_equal(clicks, [0, 0, 1, 0])
+    np.testing.assert_array_equal(ratio, [0, 0, 0.5, 0])